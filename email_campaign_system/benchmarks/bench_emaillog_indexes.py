@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""
+Benchmark: EmailLog hot queries with and without the composite indexes
+
+Seeds a PostgreSQL database with campaigns, recipients and email logs spread
+over the last 90 days, then prints EXPLAIN ANALYZE plans for the hot
+queries twice: with the old ``sent_at__date`` lookups and without the
+indexes from migration 0004, and with range filters and the indexes.
+
+Everything runs in one transaction that is rolled back at the end, so the
+database is left as it was. Run it against a migrated scratch database
+anyway: the seed takes a while and holds locks on the campaigns tables.
+
+Usage: DATABASE_URL=postgres://... python benchmarks/bench_emaillog_indexes.py [rows]
+"""
+import os
+import re
+import sys
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'email_campaign_system.settings')
+
+import django
+
+django.setup()
+
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from campaigns.models import Campaign, EmailLog, RecipientList
+from campaigns.utils import local_day_range
+
+CAMPAIGNS = 20
+ERROR_RATE = 0.05
+HISTORY_DAYS = 90
+
+
+class Rollback(Exception):
+    pass
+
+
+def seed(rows):
+    """Insert `rows` email logs: CAMPAIGNS campaigns sent to one shared list"""
+    recipients = rows // CAMPAIGNS
+    recipient_list = RecipientList.objects.create(name='bench-list')
+    Campaign.objects.bulk_create([
+        Campaign(name=f'bench-{i}', subject='Subject', content='Content', recipient_list=recipient_list)
+        for i in range(CAMPAIGNS)
+    ])
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO campaigns_recipient (id, email, email_normalized, name, recipient_list_id, created_at)
+            SELECT gen_random_uuid(), 'user' || i || '@example.com', lower('user' || i || '@example.com'), 'User ' || i, %s, now()
+            FROM generate_series(1, %s) AS i
+        """, [recipient_list.pk, recipients])
+        cursor.execute("""
+            INSERT INTO campaigns_emaillog (id, campaign_id, recipient_id, status, error_message, sent_at)
+            SELECT gen_random_uuid(), c.id, r.id, s.status,
+                   CASE WHEN s.status = 'error' THEN 'Mailbox unavailable' END,
+                   now() - random() * %s * interval '1 day'
+            FROM campaigns_campaign c
+            CROSS JOIN campaigns_recipient r
+            CROSS JOIN LATERAL (
+                SELECT CASE WHEN random() < %s THEN 'error' ELSE 'sent' END AS status
+                OFFSET 0
+            ) s
+            WHERE c.recipient_list_id = %s AND r.recipient_list_id = %s
+        """, [HISTORY_DAYS, ERROR_RATE, recipient_list.pk, recipient_list.pk])
+        cursor.execute("ANALYZE campaigns_recipient")
+        cursor.execute("ANALYZE campaigns_emaillog")
+    return Campaign.objects.filter(recipient_list=recipient_list).first()
+
+
+def hot_queries(campaign, sargable):
+    """The hot EmailLog queries, either with __date lookups or with day ranges"""
+    today = timezone.localdate()
+    yesterday = today - timedelta(days=1)
+    week_start = today - timedelta(days=6)
+
+    def day(date):
+        if sargable:
+            start, end = local_day_range(date)
+            return Q(sent_at__gte=start, sent_at__lt=end)
+        return Q(sent_at__date=date)
+
+    if sargable:
+        week = Q(sent_at__gte=local_day_range(week_start)[0], sent_at__lt=local_day_range(today)[1])
+    else:
+        week = Q(sent_at__date__gte=week_start)
+
+    return [
+        ('daily quota', EmailLog.objects.filter(day(today), status='sent').values('id')),
+        ('daily report', EmailLog.objects.filter(day(yesterday)).values('campaign').annotate(
+            sent=Count('id', filter=Q(status='sent')),
+            errors=Count('id', filter=Q(status='error'))
+        ).order_by()),
+        ('daily stats', EmailLog.objects.filter(week).annotate(
+            day=TruncDate('sent_at', tzinfo=timezone.get_current_timezone())
+        ).values('day').annotate(
+            sent=Count('id', filter=Q(status='sent')),
+            errors=Count('id', filter=Q(status='error'))
+        ).order_by()),
+        ('campaign errors', EmailLog.objects.filter(campaign=campaign, status='error').values('id')),
+        ('error log page', EmailLog.objects.filter(campaign=campaign, status='error').order_by('-sent_at')[:50]),
+        ('logs page', EmailLog.objects.order_by('-sent_at')[:1000]),
+    ]
+
+
+def explain(label, queryset):
+    plan = queryset.explain(analyze=True)
+    execution = re.search(r'Execution Time: ([\d.]+) ms', plan)
+    print(f"--- {label}: {execution.group(1) if execution else '?'} ms")
+    print(plan)
+    print()
+    return float(execution.group(1)) if execution else 0.0
+
+
+def run(rows):
+    indexes = EmailLog._meta.indexes
+    campaign = seed(rows)
+    print(f"Seeded {EmailLog.objects.count():,} email logs\n")
+
+    with connection.schema_editor() as editor:
+        for index in indexes:
+            editor.remove_index(EmailLog, index)
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE campaigns_emaillog")
+
+    print("=== Before: __date lookups, no composite indexes ===\n")
+    before = {label: explain(label, qs) for label, qs in hot_queries(campaign, sargable=False)}
+
+    with connection.schema_editor() as editor:
+        for index in indexes:
+            editor.add_index(EmailLog, index)
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE campaigns_emaillog")
+
+    print("=== After: range filters, composite indexes ===\n")
+    after = {label: explain(label, qs) for label, qs in hot_queries(campaign, sargable=True)}
+
+    print(f"{'query':<18}{'before ms':>12}{'after ms':>12}")
+    for label in before:
+        print(f"{label:<18}{before[label]:>12.2f}{after[label]:>12.2f}")
+
+
+if __name__ == "__main__":
+    if connection.vendor != 'postgresql':
+        sys.exit("This benchmark needs PostgreSQL (set DATABASE_URL)")
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+
+    try:
+        with transaction.atomic():
+            run(rows)
+            raise Rollback()
+    except Rollback:
+        print("\nRolled back benchmark data")
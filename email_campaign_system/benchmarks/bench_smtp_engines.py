@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Benchmark: blocking SMTP loop vs. the thread pool and asyncio sending engines
+
+Starts a local aiosmtpd server that waits ``latency`` seconds before
+accepting each message, standing in for the round trips to a real SMTP
+provider. The same batch of rendered campaign messages is then sent with
+send_serial() over one blocking session, with send_threaded() from
+``sessions`` threads and with send_async() over ``sessions`` sessions, and
+messages per second are printed.
+
+Nothing is written to the database: quota, rate limits and email logs are
+replaced by no-op stand-ins so that only the sending loops are measured.
+
+Usage: python benchmarks/bench_smtp_engines.py [messages] [latency] [sessions]
+"""
+import asyncio
+import os
+import smtplib
+import socket
+import sys
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'email_campaign_system.settings')
+
+import django
+
+django.setup()
+
+import aiosmtplib
+from aiosmtpd.controller import Controller
+from django.conf import settings
+
+from campaigns.async_engine import send_async
+from campaigns.models import Campaign, Recipient
+from campaigns.sending import CampaignRenderer, SendOutcome, send_serial
+from campaigns.smtp_pool import SMTPConnectionPool
+from campaigns.thread_engine import send_threaded
+
+
+class SlowHandler:
+    """Accepts every message after a fixed delay"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.latency)
+        self.received += 1
+        return '250 Message accepted'
+
+
+class NoopLogWriter:
+    def record(self, campaign_id, recipient_id, status, error_message=None):
+        pass
+
+
+class NoopRateLimiter:
+    def acquire(self, tokens=1, account=None):
+        return 0.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def build_batch(messages):
+    campaign = Campaign(
+        name='bench',
+        subject='Hello $name',
+        content='\n'.join(['<p>Hi $name, this is the message for $email.</p>'] * 20),
+        from_name='Bench'
+    )
+    recipients = [Recipient(email=f'user{i}@example.com', name=f'User {i}') for i in range(messages)]
+    return campaign, recipients
+
+
+def run_serial(port, campaign, recipients):
+    pool = SMTPConnectionPool(connect=lambda: smtplib.SMTP('127.0.0.1', port), max_size=1, max_messages=len(recipients) + 1)
+    outcome = SendOutcome()
+    with mock.patch('campaigns.sending.get_smtp_pool', return_value=pool):
+        send_serial(campaign, recipients, CampaignRenderer(campaign), mock.Mock(), NoopRateLimiter(), NoopLogWriter(), outcome)
+    pool.close_all()
+    return outcome
+
+
+def run_threaded(port, campaign, recipients, threads):
+    pool = SMTPConnectionPool(connect=lambda: smtplib.SMTP('127.0.0.1', port), max_size=threads, max_messages=len(recipients) + 1)
+    outcome = SendOutcome()
+    send_threaded(
+        campaign, recipients, CampaignRenderer(campaign), mock.Mock(), NoopRateLimiter(), NoopLogWriter(), outcome,
+        threads=threads, smtp_pool=pool
+    )
+    pool.close_all()
+    return outcome
+
+
+def run_async(port, campaign, recipients, sessions):
+    async def connect():
+        smtp = aiosmtplib.SMTP(hostname='127.0.0.1', port=port, start_tls=False)
+        await smtp.connect()
+        return smtp
+
+    outcome = SendOutcome()
+    send_async(
+        campaign, recipients, CampaignRenderer(campaign), mock.Mock(), NoopRateLimiter(), NoopLogWriter(), outcome,
+        sessions=sessions, connect=connect
+    )
+    return outcome
+
+
+def measure(label, send):
+    started = time.perf_counter()
+    outcome = send()
+    elapsed = time.perf_counter() - started
+    rate = outcome.sent / elapsed if elapsed else 0.0
+    print(f"{label:<28}{outcome.sent:>8}{outcome.errors:>8}{elapsed:>10.2f}{rate:>12.1f}")
+    return rate
+
+
+def run(messages, latency, sessions):
+    handler = SlowHandler(latency)
+    port = free_port()
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        campaign, recipients = build_batch(messages)
+        print(f"{messages} messages, {latency * 1000:.0f} ms server latency\n")
+        print(f"{'engine':<28}{'sent':>8}{'errors':>8}{'seconds':>10}{'msgs/sec':>12}")
+        serial = measure('sync (1 session)', lambda: run_serial(port, campaign, recipients))
+        threaded = measure(f'threads ({sessions} threads)', lambda: run_threaded(port, campaign, recipients, sessions))
+        concurrent = measure(f'async ({sessions} sessions)', lambda: run_async(port, campaign, recipients, sessions))
+        print(f"\nthreads are {threaded / serial:.1f}x and async is {concurrent / serial:.1f}x the blocking loop")
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    sessions = int(sys.argv[3]) if len(sys.argv) > 3 else settings.SMTP_ASYNC_SESSIONS
+    run(messages, latency, sessions)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Microbenchmark: precompiled campaign templates vs per-recipient safe_substitute
+
+Usage: python benchmarks/bench_templates.py [recipients]
+"""
+import os
+import sys
+import time
+from collections import namedtuple
+from string import Template
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from campaigns.templating import CompiledTemplate, recipient_context
+
+FakeRecipient = namedtuple('FakeRecipient', ['name', 'email'])
+
+CONTENT = """
+<html>
+<body>
+    <p>Hello $name,</p>
+    <p>We have prepared a special offer for ${email}. It costs only $$10!</p>
+    <p>""" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 40 + """</p>
+    <p>Regards,<br>The team ($unknown placeholders are left as-is)</p>
+</body>
+</html>
+"""
+SUBJECT = "$name, your offer is waiting"
+
+
+def safe_substitute_path(recipients):
+    """The previous send loop: build a Template for every recipient"""
+    for recipient in recipients:
+        Template(SUBJECT)
+        Template(CONTENT).safe_substitute(name=recipient.name, email=recipient.email)
+
+
+def compiled_path(recipients):
+    """Compile once, then render each recipient with a single join"""
+    subject = CompiledTemplate(SUBJECT)
+    body = CompiledTemplate(CONTENT)
+    for recipient in recipients:
+        context = recipient_context(recipient)
+        subject.render(context)
+        body.render(context)
+
+
+def timed(func, recipients):
+    start = time.perf_counter()
+    func(recipients)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    recipients = [FakeRecipient(f"User {i}", f"user{i}@example.com") for i in range(count)]
+
+    # Both paths must produce identical output
+    body = CompiledTemplate(CONTENT)
+    for recipient in recipients[:1000]:
+        expected = Template(CONTENT).safe_substitute(name=recipient.name, email=recipient.email)
+        assert body.render(recipient_context(recipient)) == expected
+
+    baseline = timed(safe_substitute_path, recipients)
+    compiled = timed(compiled_path, recipients)
+
+    print(f"Recipients:           {count}")
+    print(f"safe_substitute path: {baseline:.3f}s ({count / baseline:,.0f} msgs/s)")
+    print(f"compiled path:        {compiled:.3f}s ({count / compiled:,.0f} msgs/s)")
+    print(f"Speedup:              {baseline / compiled:.1f}x")
@@ -1,24 +1,26 @@
 from django.contrib import admin
 from import_export.admin import ImportExportModelAdmin
-from .models import Campaign, Recipient, EmailLog, RecipientList
+from .models import Campaign, Recipient, EmailLog, RecipientList, RecipientImport, DailySendQuota, CampaignSendLease
 
 @admin.register(Campaign)
 class CampaignAdmin(admin.ModelAdmin):
-    list_display = ('name', 'subject', 'status', 'schedule_type', 'scheduled_time', 'created_at')
-    list_filter = ('status', 'schedule_type', 'created_at')
+    list_display = ('name', 'subject', 'status', 'priority', 'schedule_type', 'scheduled_time', 'created_at')
+    list_filter = ('status', 'priority', 'schedule_type', 'created_at')
     search_fields = ('name', 'subject')
     date_hierarchy = 'created_at'
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = (
+        'created_at', 'updated_at', 'started_at', 'emails_sent', 'emails_failed', 'emails_skipped', 'send_cursor'
+    )
 
 @admin.register(RecipientList)
 class RecipientListAdmin(admin.ModelAdmin):
     list_display = ('name', 'created_at', 'recipient_count')
     search_fields = ('name',)
     date_hierarchy = 'created_at'
-    readonly_fields = ('created_at',)
+    readonly_fields = ('created_at', 'recipient_count')
     
     def recipient_count(self, obj):
-        return obj.recipients.count()
+        return obj.recipient_count
     recipient_count.short_description = 'Number of Recipients'
 
 @admin.register(Recipient)
@@ -28,6 +30,15 @@ class RecipientAdmin(ImportExportModelAdmin):
     search_fields = ('email', 'name')
     date_hierarchy = 'created_at'
     readonly_fields = ('created_at',)
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        RecipientList.increment_recipient_count(obj.recipient_list_id, -1)
+    
+    def delete_queryset(self, request, queryset):
+        list_ids = set(queryset.values_list('recipient_list_id', flat=True))
+        super().delete_queryset(request, queryset)
+        RecipientList.refresh_recipient_counts(list_ids)
 
 @admin.register(EmailLog)
 class EmailLogAdmin(admin.ModelAdmin):
@@ -36,3 +47,24 @@ class EmailLogAdmin(admin.ModelAdmin):
     search_fields = ('campaign__name', 'recipient__email')
     date_hierarchy = 'sent_at'
     readonly_fields = ('campaign', 'recipient', 'status', 'error_message', 'sent_at')
+
+@admin.register(RecipientImport)
+class RecipientImportAdmin(admin.ModelAdmin):
+    list_display = ('file_name', 'recipient_list', 'status', 'rows_processed', 'rows_inserted', 'rows_rejected', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('file_name', 'recipient_list__name')
+    date_hierarchy = 'created_at'
+    readonly_fields = (
+        'file_path', 'rows_processed', 'rows_inserted', 'rows_updated', 'rows_rejected',
+        'error_messages', 'created_at', 'finished_at'
+    )
+
+@admin.register(DailySendQuota)
+class DailySendQuotaAdmin(admin.ModelAdmin):
+    list_display = ('day', 'reserved')
+    date_hierarchy = 'day'
+
+@admin.register(CampaignSendLease)
+class CampaignSendLeaseAdmin(admin.ModelAdmin):
+    list_display = ('campaign', 'token', 'expires_at')
+    search_fields = ('campaign__name',)
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+
+import aiosmtplib
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the session is unusable and has to be re-established
+ASYNC_CONNECTION_ERRORS = (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPTimeoutError, ConnectionError, TimeoutError)
+
+
+async def open_async_smtp_connection():
+    """
+    Open and authenticate a new asyncio SMTP session
+
+    Authenticates like open_smtp_connection(): OAuth2 (XOAUTH2) when a
+    Google refresh token is configured, basic authentication otherwise or
+    when OAuth2 fails.
+
+    Returns:
+        aiosmtplib.SMTP: Authenticated SMTP session
+    """
+    from .utils import get_gmail_oauth2_credentials
+
+    if getattr(settings, 'GOOGLE_REFRESH_TOKEN', None):
+        smtp = aiosmtplib.SMTP(hostname=settings.EMAIL_HOST, port=settings.EMAIL_PORT, start_tls=settings.EMAIL_USE_TLS)
+        try:
+            await smtp.connect()
+            # The credentials helper may refresh the token over HTTP
+            creds = await asyncio.to_thread(get_gmail_oauth2_credentials)
+            await smtp.auth_xoauth2(settings.EMAIL_HOST_USER, creds['access_token'])
+            return smtp
+        except Exception as e:
+            smtp.close()
+            logger.error(f"OAuth2 authentication failed: {str(e)}")
+            logger.info("Falling back to basic auth")
+
+    smtp = aiosmtplib.SMTP(hostname=settings.EMAIL_HOST, port=settings.EMAIL_PORT, start_tls=settings.EMAIL_USE_TLS)
+    await smtp.connect()
+    await smtp.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
+    return smtp
+
+
+def is_async_deferral(exc):
+    """Whether an aiosmtplib error is a temporary (4xx) rejection worth retrying later"""
+    if isinstance(exc, aiosmtplib.SMTPRecipientsRefused):
+        return bool(exc.recipients) and all(is_async_deferral(error) for error in exc.recipients)
+    if isinstance(exc, aiosmtplib.SMTPResponseException):
+        return 400 <= exc.code < 500
+    return False
+
+
+class AsyncSender:
+    """
+    Sends a batch over several SMTP sessions at once from one event loop
+
+    Each session takes the next recipient from a shared queue as soon as
+    its previous message is accepted, so the batch waits on the network
+    for the slowest session rather than for every message in turn.
+    Sessions are opened when the batch starts and closed when it ends.
+
+    Sending stops at the first deferral the recipient should be retried
+    for, or when the rate limits ask for a longer pause; messages already
+    in flight on other sessions finish. Outcomes go to the log writer from
+    the event loop, so the writer must not flush to the database until the
+    loop has finished.
+
+    ``connect`` is a coroutine function returning a connected session and
+    defaults to open_async_smtp_connection().
+    """
+
+    def __init__(self, campaign, renderer, throttle, rate_limiter, log_writer, outcome, sessions=None, connect=None):
+        self.campaign = campaign
+        self.renderer = renderer
+        self.throttle = throttle
+        self.rate_limiter = rate_limiter
+        self.log_writer = log_writer
+        self.outcome = outcome
+        self.sessions = sessions or settings.SMTP_ASYNC_SESSIONS
+        self.connect = connect or open_async_smtp_connection
+        self._stopped = False
+
+    async def _take_token(self):
+        # The limiter talks to Redis with a blocking client
+        wait = await asyncio.to_thread(self.rate_limiter.acquire)
+        while 0 < wait <= settings.RATE_LIMIT_MAX_WAIT:
+            await asyncio.sleep(wait)
+            wait = await asyncio.to_thread(self.rate_limiter.acquire)
+        return wait
+
+    async def _send(self, smtp, recipient):
+        """Send to one recipient; returns False when the batch should stop"""
+        try:
+            message = self.renderer.render(recipient)
+            await smtp.sendmail(
+                message.from_addr,
+                message.to_addrs,
+                message.data,
+                mail_options=list(message.mail_options)
+            )
+            self.log_writer.record(self.campaign.id, recipient.id, 'sent')
+            self.outcome.sent += 1
+
+        except Exception as e:
+            if is_async_deferral(e) and self.throttle.should_retry(self.campaign.id, recipient.id):
+                logger.warning(f"Sending to {recipient.email} deferred: {str(e)}")
+                self.outcome.deferred += 1
+                return False
+
+            logger.error(f"Error sending to {recipient.email}: {str(e)}")
+            self.log_writer.record(self.campaign.id, recipient.id, 'error', str(e))
+            self.outcome.errors += 1
+            self.outcome.done.add(recipient.id)
+            if isinstance(e, ASYNC_CONNECTION_ERRORS):
+                raise
+            return True
+        self.outcome.done.add(recipient.id)
+        return True
+
+    async def _session(self, queue):
+        smtp = None
+        try:
+            while not self._stopped and not queue.empty():
+                wait = await self._take_token()
+                if wait:
+                    logger.info(f"Send rate limit reached, next token in {wait:.1f}s")
+                    self.outcome.rate_limited_for = max(self.outcome.rate_limited_for, wait)
+                    self._stopped = True
+                    return
+                if self._stopped or queue.empty():
+                    return
+
+                recipient = queue.get_nowait()
+                if smtp is None:
+                    smtp = await self.connect()
+                try:
+                    if not await self._send(smtp, recipient):
+                        self._stopped = True
+                except ASYNC_CONNECTION_ERRORS:
+                    # Reconnect for the next message
+                    smtp.close()
+                    smtp = None
+        finally:
+            if smtp is not None:
+                try:
+                    await smtp.quit()
+                except Exception:
+                    smtp.close()
+
+    async def run(self, recipients):
+        queue = asyncio.Queue()
+        for recipient in recipients:
+            queue.put_nowait(recipient)
+        sessions = min(self.sessions, len(recipients))
+        await asyncio.gather(*(self._session(queue) for _ in range(sessions)))
+
+
+def send_async(campaign, recipients, renderer, throttle, rate_limiter, log_writer, outcome, sessions=None, connect=None):
+    """
+    Send a batch with AsyncSender; same arguments as send_serial()
+
+    Args:
+        sessions: SMTP sessions to keep open, defaults to SMTP_ASYNC_SESSIONS
+        connect: Coroutine function opening a session
+    """
+    sender = AsyncSender(campaign, renderer, throttle, rate_limiter, log_writer, outcome, sessions, connect)
+    asyncio.run(sender.run(recipients))
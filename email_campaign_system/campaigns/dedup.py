@@ -0,0 +1,118 @@
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .log_writer import write_email_logs
+from .models import Campaign, EmailLog, Recipient
+
+logger = logging.getLogger(__name__)
+
+# Duplicate recipients written per bulk insert
+DEDUP_CHUNK_SIZE = 5000
+
+
+def skip_duplicate_recipients(campaign):
+    """
+    Skip recipients that an earlier campaign sending the same message reached
+
+    Campaigns with the same subject and content are treated as one send
+    split across lists. When such a campaign starts, addresses that a
+    sibling campaign has already sent the message to get a 'skipped' log
+    instead of a second copy. Addresses a sibling only has in its list, or
+    failed to send to, are still sent. Siblings that send to an address
+    later are caught batch by batch by skip_recipients_sent_by_siblings().
+
+    Runs once per campaign: it claims the campaign by setting started_at.
+    Sibling rows are locked while claiming so that two siblings starting
+    at the same time are ordered. Duplicates are found with one semi-join
+    on the normalized address and written in chunks.
+
+    Args:
+        campaign: Campaign object about to send its first batch
+
+    Returns:
+        int: Number of recipients skipped
+    """
+    skipped = 0
+    with transaction.atomic():
+        sibling_ids = [
+            sibling_id for sibling_id in Campaign.objects.select_for_update().filter(
+                subject=campaign.subject,
+                content=campaign.content
+            ).order_by('pk').values_list('pk', flat=True)
+            if sibling_id != campaign.pk
+        ]
+
+        started_at = timezone.now()
+        if not Campaign.objects.filter(pk=campaign.pk, started_at__isnull=True).update(started_at=started_at):
+            return 0
+        campaign.started_at = started_at
+        if not sibling_ids:
+            return 0
+
+        duplicate_ids = Recipient.objects.filter(
+            recipient_list_id=campaign.recipient_list_id,
+            email_normalized__in=EmailLog.objects.filter(
+                campaign_id__in=sibling_ids,
+                status='sent'
+            ).values('recipient__email_normalized')
+        ).values_list('id', flat=True)
+
+        entries = []
+        now = timezone.now().isoformat()
+        for recipient_id in duplicate_ids.iterator(chunk_size=DEDUP_CHUNK_SIZE):
+            entries.append(_skipped_entry(campaign, recipient_id, now))
+            if len(entries) >= DEDUP_CHUNK_SIZE:
+                skipped += write_email_logs(entries)
+                entries = []
+        if entries:
+            skipped += write_email_logs(entries)
+
+    if skipped:
+        logger.info(f"Skipped {skipped} recipients of campaign {campaign.pk} already sent by an earlier campaign")
+    return skipped
+
+
+def skip_recipients_sent_by_siblings(campaign, recipients):
+    """
+    Skip recipients of a batch that a sibling campaign has sent the message to
+
+    Catches addresses that campaigns with the same subject and content
+    sent to after this campaign started, with one query per batch.
+
+    Args:
+        campaign: Campaign object being sent
+        recipients: Recipient objects about to be sent to
+
+    Returns:
+        tuple: (remaining, skipped) with the recipients still to send to, in
+        the given order, and the ids of those given a 'skipped' log
+    """
+    if not recipients:
+        return recipients, set()
+
+    sent = set(EmailLog.objects.filter(
+        campaign__subject=campaign.subject,
+        campaign__content=campaign.content,
+        status='sent',
+        recipient__email_normalized__in={recipient.email_normalized for recipient in recipients}
+    ).exclude(campaign_id=campaign.pk).values_list('recipient__email_normalized', flat=True))
+    if not sent:
+        return recipients, set()
+
+    now = timezone.now().isoformat()
+    skipped = {recipient.id for recipient in recipients if recipient.email_normalized in sent}
+    write_email_logs([_skipped_entry(campaign, recipient_id, now) for recipient_id in skipped])
+    logger.info(f"Skipped {len(skipped)} recipients of campaign {campaign.pk} sent by another campaign")
+    return [recipient for recipient in recipients if recipient.id not in skipped], skipped
+
+
+def _skipped_entry(campaign, recipient_id, now):
+    return {
+        'campaign_id': str(campaign.pk),
+        'recipient_id': str(recipient_id),
+        'status': 'skipped',
+        'error_message': None,
+        'sent_at': now,
+    }
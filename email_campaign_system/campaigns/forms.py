@@ -1,9 +1,8 @@
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm
 from ckeditor.widgets import CKEditorWidget
+from .importer import REQUIRED_CSV_FIELDS, read_csv_header
 from .models import Campaign, RecipientList
-import csv
-import io
 
 class CustomAuthenticationForm(AuthenticationForm):
     """Custom login form with styled fields"""
@@ -39,23 +38,17 @@ class CSVUploadForm(forms.Form):
         if not csv_file.name.endswith('.csv'):
             raise forms.ValidationError('File must be a CSV file')
         
-        # Read and validate the CSV structure
+        # Validate the header without reading the rest of the file
         try:
-            csv_file_data = csv_file.read().decode('utf-8')
-            csv_io = io.StringIO(csv_file_data)
-            reader = csv.DictReader(csv_io)
-            
-            # Check for required fields
-            required_fields = {'name', 'email'}
-            if not required_fields.issubset(set(reader.fieldnames)):
-                missing = required_fields - set(reader.fieldnames)
-                raise forms.ValidationError(f"CSV missing required fields: {', '.join(missing)}")
-            
-            # Reset the file pointer for later use
-            csv_file.seek(0)
-            return csv_file
-        except Exception as e:
-            raise forms.ValidationError(f"Invalid CSV file: {str(e)}")
+            fieldnames = read_csv_header(csv_file)
+        except UnicodeDecodeError:
+            raise forms.ValidationError("Invalid CSV file: the file must be UTF-8 encoded")
+        
+        missing = REQUIRED_CSV_FIELDS - set(fieldnames)
+        if missing:
+            raise forms.ValidationError(f"CSV missing required fields: {', '.join(sorted(missing))}")
+        
+        return csv_file
 
 
 class CampaignForm(forms.ModelForm):
@@ -66,7 +59,7 @@ class CampaignForm(forms.ModelForm):
         model = Campaign
         fields = [
             'name', 'subject', 'content', 'from_name', 'status',
-            'schedule_type', 'scheduled_time', 'recurring_days', 'recipient_list'
+            'schedule_type', 'scheduled_time', 'recurring_days', 'priority', 'recipient_list'
         ]
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control'}),
@@ -79,6 +72,7 @@ class CampaignForm(forms.ModelForm):
                 format='%Y-%m-%dT%H:%M'
             ),
             'recurring_days': forms.NumberInput(attrs={'class': 'form-control', 'min': '1'}),
+            'priority': forms.Select(attrs={'class': 'form-select'}),
             'recipient_list': forms.Select(attrs={'class': 'form-select'}),
         }
 
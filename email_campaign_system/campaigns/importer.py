@@ -0,0 +1,194 @@
+import csv
+import io
+import logging
+import os
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from .models import Recipient, RecipientImport, RecipientList, normalize_email
+
+logger = logging.getLogger(__name__)
+
+# Columns every recipient CSV must have
+REQUIRED_CSV_FIELDS = {'name', 'email'}
+
+# Number of row errors kept for display; further errors are only counted
+MAX_IMPORT_ERROR_MESSAGES = 100
+
+EMAIL_MAX_LENGTH = Recipient._meta.get_field('email').max_length
+NAME_MAX_LENGTH = Recipient._meta.get_field('name').max_length
+
+
+def read_csv_header(csv_file):
+    """
+    Read the column names from the first line of an uploaded CSV
+
+    Only the first line is read; the file is rewound afterwards.
+
+    Args:
+        csv_file: Binary file object with UTF-8 CSV data
+
+    Returns:
+        list: Column names
+    """
+    first_line = csv_file.readline()
+    csv_file.seek(0)
+    return next(csv.reader([first_line.decode('utf-8-sig')]), [])
+
+
+def create_recipient_import(csv_file, recipient_list):
+    """
+    Store an uploaded CSV for a background import
+
+    The upload is copied chunk by chunk to RECIPIENT_IMPORT_DIR, which must
+    be shared with the Celery workers.
+
+    Args:
+        csv_file: Uploaded file
+        recipient_list: RecipientList object to import into
+
+    Returns:
+        RecipientImport: Pending import job
+    """
+    import_id = uuid.uuid4()
+    os.makedirs(settings.RECIPIENT_IMPORT_DIR, exist_ok=True)
+    file_path = os.path.join(settings.RECIPIENT_IMPORT_DIR, f"{import_id}.csv")
+    with open(file_path, 'wb') as destination:
+        for chunk in csv_file.chunks():
+            destination.write(chunk)
+
+    return RecipientImport.objects.create(
+        id=import_id,
+        recipient_list=recipient_list,
+        file_name=os.path.basename(csv_file.name)[:255],
+        file_path=file_path
+    )
+
+
+class RecipientImporter:
+    """
+    Streams a recipient CSV into a recipient list
+
+    The file is decoded incrementally and rows are validated and upserted
+    in chunks of ``chunk_size``, one transaction per chunk, so memory use
+    and lock time do not grow with the size of the file. A row for an
+    address that is already in the list, ignoring case and surrounding
+    whitespace, updates that recipient's name.
+
+    ``progress`` is called with the importer after every chunk.
+    """
+
+    def __init__(self, recipient_list, chunk_size=None, progress=None):
+        self.recipient_list = recipient_list
+        self.chunk_size = chunk_size or settings.RECIPIENT_IMPORT_CHUNK_SIZE
+        self.progress = progress
+        self.processed = 0
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.error_messages = []
+
+    def _reject(self, line_num, message):
+        self.rejected += 1
+        if len(self.error_messages) < MAX_IMPORT_ERROR_MESSAGES:
+            self.error_messages.append(f"Row {line_num}: {message}")
+
+    def _clean_row(self, line_num, row):
+        """Validate a row and build its recipient, or reject it"""
+        email = (row.get('email') or '').strip()
+        name = (row.get('name') or '').strip()
+
+        if not email:
+            self._reject(line_num, "Email is required")
+            return None
+        if len(email) > EMAIL_MAX_LENGTH:
+            self._reject(line_num, f"Email is longer than {EMAIL_MAX_LENGTH} characters")
+            return None
+        try:
+            validate_email(email)
+        except ValidationError:
+            self._reject(line_num, f"Invalid email address: {email}")
+            return None
+
+        return Recipient(
+            email=email,
+            email_normalized=normalize_email(email),
+            name=(name or email.split('@')[0])[:NAME_MAX_LENGTH],
+            recipient_list=self.recipient_list
+        )
+
+    def _write_chunk(self, recipients):
+        # The last row for an address wins, as with sequential updates; a single
+        # upsert can't touch the same row twice
+        by_email = {recipient.email_normalized: recipient for recipient in recipients}
+
+        with transaction.atomic():
+            # Serialize imports into the same list so inserts are counted once
+            RecipientList.objects.select_for_update().filter(pk=self.recipient_list.pk).values_list('pk').get()
+            existing = set(Recipient.objects.filter(
+                recipient_list=self.recipient_list,
+                email_normalized__in=by_email
+            ).values_list('email_normalized', flat=True))
+
+            # Existing recipients keep the spelling of their address
+            Recipient.objects.bulk_create(
+                by_email.values(),
+                update_conflicts=True,
+                unique_fields=['email_normalized', 'recipient_list'],
+                update_fields=['name']
+            )
+            inserted = len(by_email) - len(existing)
+            RecipientList.increment_recipient_count(self.recipient_list.pk, inserted)
+
+        self.inserted += inserted
+        self.updated += len(recipients) - inserted
+
+    def _flush(self, recipients):
+        if recipients:
+            self._write_chunk(recipients)
+        if self.progress:
+            self.progress(self)
+
+    def run(self, csv_file):
+        """
+        Import a CSV file
+
+        Args:
+            csv_file: Binary file object with UTF-8 CSV data
+
+        Raises:
+            ValueError: If the file has no header or misses a required column
+        """
+        text = io.TextIOWrapper(csv_file, encoding='utf-8-sig', newline='')
+        try:
+            reader = csv.DictReader(text)
+            missing = REQUIRED_CSV_FIELDS - set(reader.fieldnames or ())
+            if missing:
+                raise ValueError(f"CSV missing required fields: {', '.join(sorted(missing))}")
+
+            chunk = []
+            rows_in_chunk = 0
+            for row in reader:
+                self.processed += 1
+                rows_in_chunk += 1
+                recipient = self._clean_row(reader.line_num, row)
+                if recipient is not None:
+                    chunk.append(recipient)
+                if rows_in_chunk >= self.chunk_size:
+                    self._flush(chunk)
+                    chunk = []
+                    rows_in_chunk = 0
+            self._flush(chunk)
+        finally:
+            # Leave the caller's file open
+            text.detach()
+
+        logger.info(
+            f"Imported recipients into {self.recipient_list.name}: {self.processed} rows, "
+            f"{self.inserted} inserted, {self.updated} updated, {self.rejected} rejected"
+        )
+        return self
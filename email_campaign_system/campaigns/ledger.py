@@ -0,0 +1,95 @@
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import CampaignSendLease, SendClaim
+
+logger = logging.getLogger(__name__)
+
+
+def acquire_send_lease(campaign_id, token=None, hold_for=0):
+    """
+    Take or renew the lease on sending a campaign
+
+    Only the holder of the lease sends a campaign, so tasks enqueued for a
+    campaign that is already being sent (by the scheduler, the views and
+    the signals alike) stop instead of sending overlapping batches. The
+    holder passes the token along its task chain and renews the lease with
+    every task. A lease whose holder died is taken over once it expires.
+
+    Args:
+        campaign_id: Campaign primary key
+        token: Token of the lease the caller holds, None to take a free lease
+        hold_for: Seconds to hold the lease on top of CAMPAIGN_SEND_LEASE_TIMEOUT,
+            e.g. until a delayed next task runs
+
+    Returns:
+        str: Lease token, or None if another task holds the lease
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.CAMPAIGN_SEND_LEASE_TIMEOUT + hold_for)
+    leases = CampaignSendLease.objects.filter(campaign_id=campaign_id)
+    if token:
+        renewed = leases.filter(token=token).update(expires_at=expires_at)
+        return token if renewed else None
+
+    CampaignSendLease.objects.bulk_create([CampaignSendLease(campaign_id=campaign_id)], ignore_conflicts=True)
+    token = str(uuid.uuid4())
+    acquired = leases.filter(Q(token__isnull=True) | Q(expires_at__lte=now)).update(token=token, expires_at=expires_at)
+    return token if acquired else None
+
+
+def release_send_lease(campaign_id, token):
+    """Give up the lease on sending a campaign, if the caller still holds it"""
+    if token:
+        CampaignSendLease.objects.filter(campaign_id=campaign_id, token=token).update(token=None, expires_at=None)
+
+
+def claim_recipients(campaign_id, recipients):
+    """
+    Claim recipients for a batch before sending to them
+
+    A recipient can be claimed by one batch at a time, so batches that
+    overlap despite the lease (or a batch started while an earlier one is
+    still writing its outcomes) never send to the same recipient. Claims
+    older than CAMPAIGN_SEND_LEASE_TIMEOUT belong to batches that died and
+    are taken over.
+
+    Args:
+        campaign_id: Campaign primary key
+        recipients: Recipient objects the batch wants to send to
+
+    Returns:
+        tuple: (batch, claimed) with the batch token to pass to
+        release_claims() and the recipients claimed, in the given order
+    """
+    batch = uuid.uuid4()
+    if not recipients:
+        return batch, []
+    now = timezone.now()
+    recipient_ids = [recipient.id for recipient in recipients]
+
+    SendClaim.objects.bulk_create([
+        SendClaim(campaign_id=campaign_id, recipient_id=recipient_id, batch=batch, claimed_at=now)
+        for recipient_id in recipient_ids
+    ], ignore_conflicts=True)
+    stale_before = now - timedelta(seconds=settings.CAMPAIGN_SEND_LEASE_TIMEOUT)
+    SendClaim.objects.filter(
+        campaign_id=campaign_id, recipient_id__in=recipient_ids, claimed_at__lt=stale_before
+    ).update(batch=batch, claimed_at=now)
+
+    claimed = set(SendClaim.objects.filter(
+        campaign_id=campaign_id, recipient_id__in=recipient_ids, batch=batch
+    ).values_list('recipient_id', flat=True))
+    if len(claimed) < len(recipient_ids):
+        logger.info(f"{len(recipient_ids) - len(claimed)} recipients of campaign {campaign_id} are claimed by another batch")
+    return batch, [recipient for recipient in recipients if recipient.id in claimed]
+
+
+def release_claims(campaign_id, batch):
+    """Drop a batch's claims once its outcomes are written"""
+    SendClaim.objects.filter(campaign_id=campaign_id, batch=batch).delete()
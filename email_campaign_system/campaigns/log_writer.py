@@ -0,0 +1,223 @@
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Campaign, EmailLog, Recipient
+from .utils import invalidate_dashboard_stats
+
+logger = logging.getLogger(__name__)
+
+
+class EmailLogWriter:
+    """
+    Buffers email send outcomes and writes them with bulk_create
+
+    Outcomes are flushed once ``flush_size`` of them are buffered or
+    ``flush_interval`` seconds have passed since the last flush, and when the
+    writer is closed. Every outcome is appended to a journal file before it
+    is buffered, so outcomes of a worker that dies before flushing are
+    written by recover_email_log_journals() instead of being lost.
+
+    The first outcome recorded for a campaign/recipient pair wins; later
+    duplicates are ignored on insert.
+    """
+
+    def __init__(self, flush_size=None, flush_interval=None, journal_dir=None):
+        self.flush_size = flush_size or settings.EMAIL_LOG_FLUSH_SIZE
+        self.flush_interval = flush_interval or settings.EMAIL_LOG_FLUSH_INTERVAL
+        self.journal_dir = journal_dir or settings.EMAIL_LOG_JOURNAL_DIR
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._journal = None
+        self._journal_path = None
+        self._campaign_ids = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _open_journal(self):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        path = os.path.join(self.journal_dir, f"{os.getpid()}-{uuid.uuid4().hex}.jsonl")
+        journal = open(path + '.tmp', 'a+', encoding='utf-8')
+        # The lock tells recovery that this journal's owner is still alive.
+        # Take it before the journal becomes visible to recovery.
+        fcntl.flock(journal, fcntl.LOCK_EX)
+        os.rename(path + '.tmp', path)
+        self._journal_path = path
+        return journal
+
+    def record(self, campaign_id, recipient_id, status, error_message=None):
+        """
+        Record the outcome of one send
+
+        Args:
+            campaign_id: Campaign primary key
+            recipient_id: Recipient primary key
+            status: 'sent', 'error' or 'skipped'
+            error_message: Error details for failed sends
+        """
+        entry = {
+            'campaign_id': str(campaign_id),
+            'recipient_id': str(recipient_id),
+            'status': status,
+            'error_message': error_message,
+            'sent_at': timezone.now().isoformat(),
+        }
+        if self._journal is None:
+            self._journal = self._open_journal()
+        self._journal.write(json.dumps(entry) + '\n')
+        self._journal.flush()
+
+        self._buffer.append(entry)
+        if len(self._buffer) >= self.flush_size or \
+                time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write buffered outcomes to the database and clear the journal"""
+        if self._buffer:
+            write_email_logs(self._buffer)
+            self._campaign_ids.update(entry['campaign_id'] for entry in self._buffer)
+            self._buffer = []
+            self._journal.seek(0)
+            self._journal.truncate()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """Flush remaining outcomes, remove the journal and check campaign completion"""
+        self.flush()
+        if self._journal is not None:
+            os.remove(self._journal_path)
+            self._journal.close()
+            self._journal = None
+
+        # Completion is decided once per batch rather than once per outcome
+        for campaign_id in self._campaign_ids:
+            if Campaign.complete_if_finished(campaign_id):
+                logger.info(f"All emails sent for campaign {campaign_id}. Marking as completed.")
+        if self._campaign_ids:
+            invalidate_dashboard_stats()
+        self._campaign_ids = set()
+
+
+def write_email_logs(entries):
+    """
+    Insert journal entries into EmailLog and update the campaign counters
+
+    Pairs that already have a log entry are skipped, and only the inserted
+    entries are added to the counters. The campaign rows are locked for the
+    duration of the insert so that concurrent writers count each pair once.
+
+    Args:
+        entries: List of outcome dicts as written by EmailLogWriter
+
+    Returns:
+        int: Number of entries inserted
+    """
+    campaign_ids = sorted({entry['campaign_id'] for entry in entries})
+    with transaction.atomic():
+        list(Campaign.objects.select_for_update().filter(pk__in=campaign_ids).order_by('pk').values_list('pk'))
+        existing = {
+            (str(campaign_id), str(recipient_id))
+            for campaign_id, recipient_id in EmailLog.objects.filter(
+                campaign_id__in=campaign_ids,
+                recipient_id__in={entry['recipient_id'] for entry in entries}
+            ).values_list('campaign_id', 'recipient_id')
+        }
+
+        logs = []
+        counters = defaultdict(Counter)
+        for entry in entries:
+            key = (entry['campaign_id'], entry['recipient_id'])
+            if key in existing:
+                continue
+            existing.add(key)
+            logs.append(EmailLog(
+                campaign_id=entry['campaign_id'],
+                recipient_id=entry['recipient_id'],
+                status=entry['status'],
+                error_message=entry['error_message'],
+                sent_at=datetime.fromisoformat(entry['sent_at']),
+            ))
+            counters[entry['campaign_id']][entry['status']] += 1
+
+        EmailLog.objects.bulk_create(logs, ignore_conflicts=True)
+        for campaign_id, counts in counters.items():
+            Campaign.increment_counters(
+                campaign_id, sent=counts['sent'], failed=counts['error'], skipped=counts['skipped']
+            )
+    return len(logs)
+
+
+def _drop_deleted(entries):
+    """Skip outcomes whose campaign or recipient was deleted since they were journaled"""
+    campaign_ids = {str(pk) for pk in Campaign.objects.filter(
+        id__in={entry['campaign_id'] for entry in entries}
+    ).values_list('id', flat=True)}
+    recipient_ids = {str(pk) for pk in Recipient.objects.filter(
+        id__in={entry['recipient_id'] for entry in entries}
+    ).values_list('id', flat=True)}
+    return [
+        entry for entry in entries
+        if entry['campaign_id'] in campaign_ids and entry['recipient_id'] in recipient_ids
+    ]
+
+
+def recover_email_log_journals(journal_dir=None):
+    """
+    Write outcomes left behind in journals of writers that died before flushing
+
+    Journals still locked by a live writer are skipped.
+
+    Returns:
+        int: Number of recovered outcomes
+    """
+    journal_dir = journal_dir or settings.EMAIL_LOG_JOURNAL_DIR
+    try:
+        names = os.listdir(journal_dir)
+    except FileNotFoundError:
+        return 0
+
+    recovered = 0
+    for name in names:
+        if not name.endswith('.jsonl'):
+            continue
+        path = os.path.join(journal_dir, name)
+        try:
+            journal = open(path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            continue
+
+        with journal:
+            try:
+                fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+
+            entries = []
+            for line in journal:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # A partially written last line means the send never finished logging
+                    logger.warning(f"Skipping corrupt line in email log journal {path}")
+            if entries:
+                recovered += write_email_logs(_drop_deleted(entries))
+            os.remove(path)
+
+    if recovered:
+        logger.warning(f"Recovered {recovered} email log entries from journals")
+    return recovered
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from campaigns.models import Campaign, RecipientList
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized campaign and recipient list counters from EmailLog and Recipient'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--campaign',
+            action='append',
+            dest='campaign_ids',
+            help='Only rebuild the counters of this campaign (can be repeated)'
+        )
+
+    def handle(self, *args, **options):
+        campaign_ids = options['campaign_ids']
+        
+        if campaign_ids:
+            list_ids = set(Campaign.objects.filter(pk__in=campaign_ids).values_list('recipient_list_id', flat=True))
+        else:
+            list_ids = None
+        
+        RecipientList.refresh_recipient_counts(list_ids)
+        Campaign.refresh_counters(campaign_ids)
+        
+        scope = f"{len(campaign_ids)} campaign(s)" if campaign_ids else "all campaigns"
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters for {scope}"))
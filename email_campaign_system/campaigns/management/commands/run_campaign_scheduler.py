@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from campaigns.scheduler import CampaignScheduler
+
+
+class Command(BaseCommand):
+    help = 'Dispatch scheduled campaigns as they fall due and re-arm recurring campaigns'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-sleep',
+            type=int,
+            help='Longest time to sleep between checks, in seconds (defaults to SCHEDULER_MAX_SLEEP)'
+        )
+
+    def handle(self, *args, **options):
+        scheduler = CampaignScheduler(max_sleep=options['max_sleep'])
+        self.stdout.write(self.style.SUCCESS("Campaign scheduler running"))
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            self.stdout.write("Campaign scheduler stopped")
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:33
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    EmailLog = apps.get_model('campaigns', 'EmailLog')
+    for status, field in (('sent', 'emails_sent'), ('error', 'emails_failed')):
+        counts = EmailLog.objects.filter(
+            campaign=OuterRef('pk'), status=status
+        ).order_by().values('campaign').annotate(total=Count('id')).values('total')
+        Campaign.objects.update(**{field: Coalesce(Subquery(counts), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='emails_failed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='emails_sent',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:35
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_recipient_counts(apps, schema_editor):
+    RecipientList = apps.get_model('campaigns', 'RecipientList')
+    Recipient = apps.get_model('campaigns', 'Recipient')
+    counts = Recipient.objects.filter(
+        recipient_list=OuterRef('pk')
+    ).order_by().values('recipient_list').annotate(total=Count('id')).values('total')
+    RecipientList.objects.update(recipient_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0002_campaign_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipientlist',
+            name='recipient_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_recipient_counts, migrations.RunPython.noop),
+    ]
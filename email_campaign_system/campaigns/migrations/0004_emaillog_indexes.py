@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+from campaigns.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # Concurrent index builds can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('campaigns', '0003_recipient_list_count'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='emaillog',
+            index=models.Index(fields=['status', 'sent_at'], name='emaillog_status_sent_at_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='emaillog',
+            index=models.Index(fields=['sent_at'], include=('status', 'campaign'), name='emaillog_sent_at_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='emaillog',
+            index=models.Index(fields=['campaign', 'status'], name='emaillog_campaign_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='emaillog',
+            index=models.Index(condition=models.Q(('status', 'error')), fields=['campaign', '-sent_at'], name='emaillog_errors_idx'),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Lower, Trim
+
+
+def normalize_emails(apps, schema_editor):
+    Recipient = apps.get_model('campaigns', 'Recipient')
+    RecipientList = apps.get_model('campaigns', 'RecipientList')
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    EmailLog = apps.get_model('campaigns', 'EmailLog')
+    
+    Recipient.objects.update(email_normalized=Lower(Trim('email')))
+    
+    # Keep the oldest recipient of each address within a list
+    duplicates = Recipient.objects.values(
+        'recipient_list', 'email_normalized'
+    ).annotate(total=Count('id')).filter(total__gt=1).order_by()
+    removed = False
+    for group in duplicates.iterator():
+        ids = list(Recipient.objects.filter(
+            recipient_list=group['recipient_list'],
+            email_normalized=group['email_normalized']
+        ).order_by('created_at', 'pk').values_list('pk', flat=True))
+        keep, duplicate_ids = ids[0], ids[1:]
+        
+        # Move the duplicates' send history to the kept recipient rather than
+        # letting the delete cascade to it. A campaign can log each recipient
+        # once, so where it logged several of them only one log is kept,
+        # preferring a sent one, then the earliest.
+        kept_logs = {}
+        for log in EmailLog.objects.filter(recipient_id__in=ids).order_by('sent_at', 'pk'):
+            kept = kept_logs.get(log.campaign_id)
+            if kept is None or (kept.status != 'sent' and log.status == 'sent'):
+                kept_logs[log.campaign_id] = log
+        EmailLog.objects.filter(recipient_id__in=ids).exclude(
+            pk__in=[log.pk for log in kept_logs.values()]
+        ).delete()
+        EmailLog.objects.filter(recipient_id__in=duplicate_ids).update(recipient_id=keep)
+        
+        Recipient.objects.filter(pk__in=duplicate_ids).delete()
+        removed = True
+    
+    if removed:
+        counts = Recipient.objects.filter(
+            recipient_list=OuterRef('pk')
+        ).order_by().values('recipient_list').annotate(total=Count('id')).values('total')
+        RecipientList.objects.update(recipient_count=Coalesce(Subquery(counts), 0))
+        for status, field in (('sent', 'emails_sent'), ('error', 'emails_failed')):
+            counts = EmailLog.objects.filter(
+                campaign=OuterRef('pk'), status=status
+            ).order_by().values('campaign').annotate(total=Count('id')).values('total')
+            Campaign.objects.update(**{field: Coalesce(Subquery(counts), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0005_recipient_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipient',
+            name='email_normalized',
+            field=models.CharField(default='', editable=False, max_length=255),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='emails_skipped',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='started_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='emaillog',
+            name='status',
+            field=models.CharField(choices=[('sent', 'Sent'), ('error', 'Error'), ('skipped', 'Skipped (duplicate)')], max_length=10),
+        ),
+        migrations.RunPython(normalize_emails, migrations.RunPython.noop),
+    ]
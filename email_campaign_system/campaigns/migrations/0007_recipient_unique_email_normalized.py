@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+from campaigns.migration_operations import AddUniqueConstraintConcurrently
+
+
+class Migration(migrations.Migration):
+    """Kept apart from 0006 so the constraint is added after the data changes commit"""
+
+    # Concurrent index builds can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('campaigns', '0006_recipient_email_normalized'),
+    ]
+
+    operations = [
+        # Built before the old constraint is dropped, so addresses stay unique meanwhile
+        AddUniqueConstraintConcurrently(
+            model_name='recipient',
+            constraint=models.UniqueConstraint(fields=('email_normalized', 'recipient_list'), name='unique_recipient_email_per_list'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='recipient',
+            unique_together=set(),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:55
+
+from django.db import migrations, models
+
+from campaigns.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # Concurrent index builds can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('campaigns', '0007_recipient_unique_email_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='send_cursor',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        AddIndexConcurrently(
+            model_name='recipient',
+            index=models.Index(fields=['recipient_list', 'id'], name='recipient_list_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0008_campaign_send_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySendQuota',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False)),
+                ('reserved', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
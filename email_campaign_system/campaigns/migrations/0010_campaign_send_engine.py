@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0009_dailysendquota'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='send_engine',
+            field=models.CharField(blank=True, choices=[('sync', 'Blocking SMTP'), ('async', 'Asyncio SMTP')], help_text='Leave blank to use the SMTP_SEND_ENGINE setting', max_length=10),
+        ),
+    ]
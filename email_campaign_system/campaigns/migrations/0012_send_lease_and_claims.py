@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:17
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0011_campaign_send_engine_threads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CampaignSendLease',
+            fields=[
+                ('campaign', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='send_lease', serialize=False, to='campaigns.campaign')),
+                ('token', models.UUIDField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SendClaim',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch', models.UUIDField()),
+                ('claimed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='send_claims', to='campaigns.campaign')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='send_claims', to='campaigns.recipient')),
+            ],
+            options={
+                'unique_together': {('campaign', 'recipient')},
+            },
+        ),
+    ]
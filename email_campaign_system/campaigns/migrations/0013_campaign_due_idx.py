@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0012_send_lease_and_claims'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(condition=models.Q(('status', 'scheduled')), fields=['scheduled_time'], name='campaign_due_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0013_campaign_due_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='priority',
+            field=models.CharField(choices=[('high', 'High'), ('normal', 'Normal'), ('low', 'Low')], default='normal', help_text='High priority campaigns are sent from their own queue, ahead of bulk sends', max_length=10),
+        ),
+    ]
@@ -0,0 +1,153 @@
+import io
+import re
+from collections import namedtuple
+from email import base64mime
+from email.generator import BytesGenerator, Generator
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.policy import compat32
+from email.utils import getaddresses
+from functools import lru_cache
+
+# Same patterns the email package's generator uses for body text
+NEWLINE_RE = re.compile(r'\r\n|\r|\n')
+FROM_LINE_RE = re.compile(r'^From ', re.MULTILINE)
+
+CRLF = b'\r\n'
+
+# smtplib.send_message flattens with the message's compat32 policy and CRLF line endings
+SMTP_POLICY = compat32.clone(linesep='\r\n')
+
+PreparedMessage = namedtuple('PreparedMessage', ['from_addr', 'to_addrs', 'data', 'mail_options'])
+
+
+def build_message(from_header, to, subject, html_body):
+    """
+    Build a campaign email with the email package
+
+    Args:
+        from_header: Value of the From header
+        to: Recipient email address
+        subject: Personalized subject line
+        html_body: Personalized HTML content
+
+    Returns:
+        MIMEMultipart: Email message
+    """
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = from_header
+    msg['To'] = to
+    msg.attach(MIMEText(html_body, 'html'))
+    return msg
+
+
+def flatten_message(msg, policy=None):
+    """Serialize a message exactly like smtplib.SMTP.send_message does"""
+    with io.BytesIO() as buffer:
+        BytesGenerator(buffer, policy=policy).flatten(msg, linesep='\r\n')
+        return buffer.getvalue()
+
+
+def _header_block(data):
+    return data.split(CRLF + CRLF, 1)[0] + CRLF
+
+
+class CampaignMessageFactory:
+    """
+    Produces campaign emails as ready-to-send bytes
+
+    The parts shared by every message (multipart headers, From header,
+    boundary lines and body part headers) are serialized once. Each
+    recipient's message is then assembled by splicing in the folded Subject
+    and To headers and the encoded body. The result is byte-for-byte what the
+    email package produces for the same message and boundary.
+    """
+
+    def __init__(self, from_header):
+        self.from_header = from_header
+        self.from_addr = getaddresses([from_header])[0][1]
+        self.boundary = Generator._make_boundary()
+        self._delimiter = ('--' + self.boundary).encode('ascii')
+
+        # Serialize a skeleton with short marker values and cut it around them
+        skeleton = build_message(from_header, 'T', 'S', '')
+        skeleton.set_boundary(self.boundary)
+        headers = _header_block(flatten_message(skeleton))
+        subject_start = headers.index(CRLF + b'Subject: S' + CRLF) + len(CRLF)
+        subject_end = subject_start + len(b'Subject: S' + CRLF)
+        to_start = headers.index(CRLF + b'To: T' + CRLF, subject_end) + len(CRLF)
+        to_end = to_start + len(b'To: T' + CRLF)
+
+        self._before_subject = headers[:subject_start]
+        self._between_subject_and_to = headers[subject_end:to_start]
+        self._after_to = headers[to_end:] + CRLF + self._delimiter + CRLF
+        self._close = CRLF + self._delimiter + b'--' + CRLF
+
+        # MIMEText picks us-ascii/7bit or utf-8/base64 depending on the content
+        self._ascii_part_headers = _header_block(flatten_message(MIMEText('', 'html'))) + CRLF
+        self._utf8_part_headers = _header_block(flatten_message(MIMEText('é', 'html'))) + CRLF
+
+        self._last_subject = (None, None)
+
+    def _subject_header(self, subject):
+        # Non-personalized subjects are folded only once
+        last_subject, line = self._last_subject
+        if subject != last_subject:
+            line = SMTP_POLICY.fold_binary('Subject', subject)
+            self._last_subject = (subject, line)
+        return line
+
+    def _encode_body(self, html_body):
+        try:
+            html_body.encode('ascii')
+        except UnicodeEncodeError:
+            payload = base64mime.body_encode(html_body.encode('utf-8'), eol='\r\n').encode('ascii')
+            return self._utf8_part_headers, payload
+        payload = NEWLINE_RE.sub('\r\n', FROM_LINE_RE.sub('>From ', html_body)).encode('ascii')
+        return self._ascii_part_headers, payload
+
+    def render(self, to, subject, html_body):
+        """
+        Produce the bytes to send to one recipient
+
+        Args:
+            to: Recipient email address
+            subject: Personalized subject line
+            html_body: Personalized HTML content
+
+        Returns:
+            PreparedMessage: Envelope addresses, message bytes and SMTP options
+        """
+        to_addrs = [address for _, address in getaddresses([to])]
+        part_headers, payload = self._encode_body(html_body)
+
+        if not (self.from_addr.isascii() and to.isascii()) or self._delimiter in payload:
+            return self._render_with_email_package(to, to_addrs, subject, html_body)
+
+        data = b''.join([
+            self._before_subject,
+            self._subject_header(subject),
+            self._between_subject_and_to,
+            SMTP_POLICY.fold_binary('To', to),
+            self._after_to,
+            part_headers,
+            payload,
+            self._close,
+        ])
+        return PreparedMessage(self.from_addr, to_addrs, data, ())
+
+    def _render_with_email_package(self, to, to_addrs, subject, html_body):
+        # Internationalized addresses and boundary collisions are rare enough
+        # to take the slow path
+        msg = build_message(self.from_header, to, subject, html_body)
+        if all(address.isascii() for address in [self.from_addr, *to_addrs]):
+            return PreparedMessage(self.from_addr, to_addrs, flatten_message(msg), ())
+        data = flatten_message(msg, policy=msg.policy.clone(utf8=True))
+        return PreparedMessage(self.from_addr, to_addrs, data, ('SMTPUTF8', 'BODY=8BITMIME'))
+
+
+@lru_cache(maxsize=16)
+def get_message_factory(from_header):
+    """Get the shared message factory for a sender"""
+    return CampaignMessageFactory(from_header)
@@ -1,21 +1,70 @@
 from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.text import slugify
 import uuid
 
-class RecipientList(models.Model):
+class CounterFieldsModel(models.Model):
+    """
+    Base for models with denormalized counters
+    
+    Counters and progress markers only change through queryset updates, so
+    saving a stale instance must not overwrite them.
+    """
+    COUNTER_FIELDS = ()
+    PROGRESS_FIELDS = ()
+    
+    class Meta:
+        abstract = True
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS + self.PROGRESS_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+class RecipientList(CounterFieldsModel):
     """Model for storing lists of email recipients"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # Denormalized recipient count, maintained by the recipient write paths
+    recipient_count = models.PositiveIntegerField(default=0)
+    
+    COUNTER_FIELDS = ('recipient_count',)
+    
     def __str__(self):
         return self.name
+    
+    @classmethod
+    def increment_recipient_count(cls, list_id, amount):
+        """Atomically add to a list's recipient count"""
+        if amount:
+            cls.objects.filter(pk=list_id).update(recipient_count=F('recipient_count') + amount)
+    
+    @classmethod
+    def refresh_recipient_counts(cls, list_ids=None):
+        """Recount recipients for the given lists, or for all lists"""
+        counts = Recipient.objects.filter(
+            recipient_list=OuterRef('pk')
+        ).order_by().values('recipient_list').annotate(total=Count('id')).values('total')
+        lists = cls.objects.all() if list_ids is None else cls.objects.filter(pk__in=list_ids)
+        lists.update(recipient_count=Coalesce(Subquery(counts), 0))
+
+def normalize_email(email):
+    """Canonical form of an address used to detect duplicate recipients"""
+    return email.strip().lower()
 
 class Recipient(models.Model):
     """Model for storing information about individual email recipients"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     email = models.EmailField(max_length=255)
+    # Set from email on save; bulk writers must set it themselves
+    email_normalized = models.CharField(max_length=255, editable=False)
     name = models.CharField(max_length=255)
     recipient_list = models.ForeignKey(
         RecipientList, 
@@ -25,12 +74,78 @@ class Recipient(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
-        unique_together = ['email', 'recipient_list']
+        constraints = [
+            # Leads with the address so cross-list lookups can use it as well
+            models.UniqueConstraint(
+                fields=['email_normalized', 'recipient_list'],
+                name='unique_recipient_email_per_list'
+            ),
+        ]
+        indexes = [
+            # Keyset pagination of a list by the send task
+            models.Index(fields=['recipient_list', 'id'], name='recipient_list_keyset_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} <{self.email}>"
+    
+    def save(self, *args, **kwargs):
+        self.email_normalized = normalize_email(self.email)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'email' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'email_normalized'}
+        super().save(*args, **kwargs)
+
+class RecipientImport(models.Model):
+    """Model for tracking background recipient CSV imports"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    recipient_list = models.ForeignKey(
+        RecipientList, 
+        on_delete=models.CASCADE, 
+        related_name='imports'
+    )
+    file_name = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=500)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    rows_processed = models.PositiveIntegerField(default=0)
+    rows_inserted = models.PositiveIntegerField(default=0)
+    rows_updated = models.PositiveIntegerField(default=0)
+    rows_rejected = models.PositiveIntegerField(default=0)
+    error_messages = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.file_name} -> {self.recipient_list.name} ({self.status})"
+    
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+    
+    def record_progress(self, importer, status=None):
+        """Store an importer's counters, and optionally a new status"""
+        self.rows_processed = importer.processed
+        self.rows_inserted = importer.inserted
+        self.rows_updated = importer.updated
+        self.rows_rejected = importer.rejected
+        self.error_messages = importer.error_messages
+        update_fields = ['rows_processed', 'rows_inserted', 'rows_updated', 'rows_rejected', 'error_messages']
+        if status:
+            self.status = status
+            update_fields.append('status')
+            if self.is_finished:
+                self.finished_at = timezone.now()
+                update_fields.append('finished_at')
+        self.save(update_fields=update_fields)
 
-class Campaign(models.Model):
+class Campaign(CounterFieldsModel):
     """Model for storing email campaign information"""
     SCHEDULE_TYPES = (
         ('one_time', 'One Time'),
@@ -46,6 +161,18 @@ class Campaign(models.Model):
         ('cancelled', 'Cancelled'),
     )
     
+    SEND_ENGINES = (
+        ('sync', 'Blocking SMTP'),
+        ('async', 'Asyncio SMTP'),
+        ('threads', 'SMTP thread pool'),
+    )
+    
+    PRIORITIES = (
+        ('high', 'High'),
+        ('normal', 'Normal'),
+        ('low', 'Low'),
+    )
+    
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
     subject = models.CharField(max_length=255)
@@ -63,36 +190,171 @@ class Campaign(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     celery_task_id = models.CharField(max_length=50, blank=True, null=True)
+    send_engine = models.CharField(
+        max_length=10,
+        choices=SEND_ENGINES,
+        blank=True,
+        help_text="Leave blank to use the SMTP_SEND_ENGINE setting"
+    )
+    priority = models.CharField(
+        max_length=10,
+        choices=PRIORITIES,
+        default='normal',
+        help_text="High priority campaigns are sent from their own queue, ahead of bulk sends"
+    )
+    # Set by the first batch; orders campaigns sending the same message for deduplication
+    started_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Last recipient id handed to a batch; the next batch starts after it
+    send_cursor = models.UUIDField(null=True, blank=True, editable=False)
+    
+    # Denormalized send counters, maintained by the email log write path
+    emails_sent = models.PositiveIntegerField(default=0)
+    emails_failed = models.PositiveIntegerField(default=0)
+    emails_skipped = models.PositiveIntegerField(default=0)
+    
+    COUNTER_FIELDS = ('emails_sent', 'emails_failed', 'emails_skipped')
+    PROGRESS_FIELDS = ('started_at', 'send_cursor')
+    
+    class Meta:
+        indexes = [
+            # The scheduler's queue of upcoming runs: due campaigns and the
+            # next due time come from the front of this index
+            models.Index(
+                fields=['scheduled_time'],
+                condition=models.Q(status='scheduled'),
+                name='campaign_due_idx'
+            ),
+        ]
     
     def __str__(self):
         return self.name
     
+    @classmethod
+    def increment_counters(cls, campaign_id, sent=0, failed=0, skipped=0):
+        """Atomically add send outcomes to a campaign's counters"""
+        if sent or failed or skipped:
+            cls.objects.filter(pk=campaign_id).update(
+                emails_sent=F('emails_sent') + sent,
+                emails_failed=F('emails_failed') + failed,
+                emails_skipped=F('emails_skipped') + skipped
+            )
+    
+    @classmethod
+    def complete_if_finished(cls, campaign_id):
+        """
+        Mark a running campaign as completed once every recipient has an outcome
+        
+        Returns:
+            bool: True if the campaign was marked as completed
+        """
+        completed = cls.objects.filter(
+            pk=campaign_id,
+            status__in=['active', 'scheduled']
+        ).alias(
+            processed=F('emails_sent') + F('emails_failed') + F('emails_skipped')
+        ).filter(
+            processed__gte=F('recipient_list__recipient_count')
+        ).update(
+            status='completed',
+            updated_at=timezone.now()
+        )
+        return completed > 0
+    
+    @classmethod
+    def advance_send_cursor(cls, campaign_id, recipient_id):
+        """Move a campaign's send cursor forward to a recipient id, never backwards"""
+        cls.objects.filter(
+            models.Q(send_cursor__isnull=True) | models.Q(send_cursor__lt=recipient_id),
+            pk=campaign_id
+        ).update(send_cursor=recipient_id)
+    
+    def next_recipients(self, limit):
+        """
+        Get the next recipients after the send cursor, in id order
+        
+        Uses the (recipient_list, id) index, so every batch costs the same
+        regardless of how far the campaign has progressed. Recipients added
+        behind the cursor are not returned; see unsent_recipients().
+        
+        Args:
+            limit: Maximum number of recipients
+        
+        Returns:
+            list: Recipient objects
+        """
+        return self.recipients_in_range(self.send_cursor, None, limit)
+    
+    def recipients_in_range(self, after, upto, limit):
+        """
+        Get recipients with ids after ``after`` up to and including ``upto``
+        
+        Args:
+            after: Recipient id to start after, None for the start of the list
+            upto: Last recipient id to return, None for the end of the list
+            limit: Maximum number of recipients
+        
+        Returns:
+            list: Recipient objects in id order
+        """
+        recipients = Recipient.objects.filter(recipient_list_id=self.recipient_list_id).order_by('id')
+        if after is not None:
+            recipients = recipients.filter(id__gt=after)
+        if upto is not None:
+            recipients = recipients.filter(id__lte=upto)
+        return list(recipients[:limit])
+    
+    def unsent_recipients(self):
+        """Recipients of the list without an email log for this campaign"""
+        return Recipient.objects.filter(
+            recipient_list_id=self.recipient_list_id
+        ).exclude(email_logs__campaign=self).order_by('id')
+    
+    @property
+    def remaining_count(self):
+        return max(self.total_recipients - (self.emails_sent + self.emails_failed + self.emails_skipped), 0)
+    
     def get_absolute_url(self):
         return f"/campaigns/{self.id}/"
     
     @property
     def sent_count(self):
-        return self.email_logs.filter(status='sent').count()
+        return self.emails_sent
     
     @property
     def error_count(self):
-        return self.email_logs.filter(status='error').count()
+        return self.emails_failed
+    
+    @property
+    def skipped_count(self):
+        return self.emails_skipped
     
     @property
     def total_recipients(self):
-        return self.recipient_list.recipients.count()
+        return self.recipient_list.recipient_count
     
     @property
     def completion_percentage(self):
-        if self.total_recipients == 0:
+        total_recipients = self.total_recipients
+        if total_recipients == 0:
             return 0
-        return int((self.sent_count / self.total_recipients) * 100)
+        return int((self.sent_count / total_recipients) * 100)
+    
+    @classmethod
+    def refresh_counters(cls, campaign_ids=None):
+        """Recount send outcomes from EmailLog for the given campaigns, or for all campaigns"""
+        campaigns = cls.objects.all() if campaign_ids is None else cls.objects.filter(pk__in=campaign_ids)
+        for status, field in (('sent', 'emails_sent'), ('error', 'emails_failed'), ('skipped', 'emails_skipped')):
+            counts = EmailLog.objects.filter(
+                campaign=OuterRef('pk'), status=status
+            ).order_by().values('campaign').annotate(total=Count('id')).values('total')
+            campaigns.update(**{field: Coalesce(Subquery(counts), 0)})
 
 class EmailLog(models.Model):
     """Model for logging email sending status and errors"""
     STATUS_CHOICES = (
         ('sent', 'Sent'),
         ('error', 'Error'),
+        ('skipped', 'Skipped (duplicate)'),
     )
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -112,6 +374,65 @@ class EmailLog(models.Model):
     
     class Meta:
         unique_together = ['campaign', 'recipient']
+        indexes = [
+            # Daily quota ledger seed: status='sent' within a day
+            models.Index(fields=['status', 'sent_at'], name='emaillog_status_sent_at_idx'),
+            # Day ranges grouped by status (daily stats, dashboard, daily report) and
+            # the logs view ordering; covering on PostgreSQL
+            models.Index(fields=['sent_at'], include=['status', 'campaign'], name='emaillog_sent_at_idx'),
+            # Per-campaign outcome counts (campaign stats, counter rebuilds)
+            models.Index(fields=['campaign', 'status'], name='emaillog_campaign_status_idx'),
+            # Errors are a small fraction of all logs and are browsed by campaign
+            models.Index(
+                fields=['campaign', '-sent_at'],
+                condition=models.Q(status='error'),
+                name='emaillog_errors_idx'
+            ),
+        ]
         
     def __str__(self):
         return f"{self.campaign.name} - {self.recipient.email} - {self.status}"
+
+class DailySendQuota(models.Model):
+    """Model for the daily send quota ledger, one row per local day"""
+    day = models.DateField(primary_key=True)
+    reserved = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.day}: {self.reserved} reserved"
+
+class CampaignSendLease(models.Model):
+    """Model for the lease held by the task chain (or set of shards) sending a campaign"""
+    campaign = models.OneToOneField(
+        Campaign,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='send_lease'
+    )
+    # Token of the holder, passed along the chain; empty when free
+    token = models.UUIDField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.campaign_id}: {self.token or 'free'}"
+
+class SendClaim(models.Model):
+    """Model for recipients claimed by a batch that is sending to them"""
+    campaign = models.ForeignKey(
+        Campaign,
+        on_delete=models.CASCADE,
+        related_name='send_claims'
+    )
+    recipient = models.ForeignKey(
+        Recipient,
+        on_delete=models.CASCADE,
+        related_name='send_claims'
+    )
+    batch = models.UUIDField()
+    claimed_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ['campaign', 'recipient']
+    
+    def __str__(self):
+        return f"{self.campaign_id} - {self.recipient_id} claimed by {self.batch}"
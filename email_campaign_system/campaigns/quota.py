@@ -0,0 +1,64 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import DailySendQuota, EmailLog
+from .utils import local_day_range
+
+logger = logging.getLogger(__name__)
+
+
+def _lock_quota(day):
+    """Lock the ledger row for a day, creating it on the day's first reservation"""
+    quota = DailySendQuota.objects.select_for_update().filter(day=day).first()
+    if quota is None:
+        # Start from what was already sent that day, e.g. before the ledger existed
+        start, end = local_day_range(day)
+        sent = EmailLog.objects.filter(status='sent', sent_at__gte=start, sent_at__lt=end).count()
+        DailySendQuota.objects.bulk_create([DailySendQuota(day=day, reserved=sent)], ignore_conflicts=True)
+        quota = DailySendQuota.objects.select_for_update().get(day=day)
+    return quota
+
+
+def reserve_daily_quota(count, day=None):
+    """
+    Reserve sends from the daily quota before sending a batch
+
+    The day's ledger row is locked while reserving, so concurrent batches
+    can't hand out the same capacity twice. Fewer sends than requested are
+    granted when the quota is nearly used up.
+
+    Args:
+        count: Number of messages the batch wants to send
+        day: Local date, defaults to today in TIME_ZONE
+
+    Returns:
+        tuple: (day, granted) to pass to release_daily_quota() later
+    """
+    day = day or timezone.localdate()
+    if count <= 0:
+        return day, 0
+    with transaction.atomic():
+        quota = _lock_quota(day)
+        granted = max(min(count, settings.DAILY_EMAIL_LIMIT - quota.reserved), 0)
+        if granted:
+            quota.reserved += granted
+            quota.save(update_fields=['reserved'])
+    return day, granted
+
+
+def release_daily_quota(day, count):
+    """
+    Return unused reservations to the quota
+
+    Args:
+        day: Day the sends were reserved for
+        count: Reserved sends that were not sent
+    """
+    if count > 0:
+        DailySendQuota.objects.filter(day=day).update(reserved=Greatest(F('reserved') - count, 0))
+        logger.debug(f"Released {count} unused sends of the {day} quota")
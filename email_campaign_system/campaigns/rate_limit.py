@@ -0,0 +1,149 @@
+import logging
+from collections import namedtuple
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_KEY = 'email_campaign:rate_limit:{scope}:{period}'
+
+PERIOD_SECONDS = {
+    'second': 1,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+}
+
+Bucket = namedtuple('Bucket', ['key', 'capacity', 'rate'])
+
+# Takes tokens from every bucket or from none of them. Buckets refill
+# continuously at their rate up to their capacity; the server clock is used
+# so that workers with drifting clocks agree.
+#
+# KEYS: bucket keys
+# ARGV: tokens requested, then capacity and refill rate (tokens per second)
+#       for each key
+# Returns {1, 0} when the tokens were taken, or {0, seconds} with the time
+# until all buckets hold enough tokens
+TOKEN_BUCKET_SCRIPT = """
+local requested = tonumber(ARGV[1])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local levels = {}
+local wait = 0
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+    local level = tonumber(bucket[1])
+    if level == nil then
+        level = capacity
+    else
+        level = math.min(capacity, level + math.max(0, now - tonumber(bucket[2])) * rate)
+    end
+    levels[i] = level
+    if level < requested then
+        wait = math.max(wait, (requested - level) / rate)
+    end
+end
+
+if wait > 0 then
+    return {0, tostring(wait)}
+end
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', tostring(levels[i] - requested), 'updated', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return {1, '0'}
+"""
+
+
+class TokenBucketLimiter:
+    """
+    Send rate limits shared by every worker, kept in Redis
+
+    Each limit in SEND_RATE_LIMITS is a token bucket holding up to the
+    limit's number of sends and refilling evenly over its period, so a
+    per-hour limit of 3600 allows bursts of 3600 and one send per second
+    after that. Limits apply per sender account and across all accounts.
+    A send takes one token from each applicable bucket in one atomic Lua
+    script, so concurrent workers can't overdraw a bucket.
+
+    Limits of 0 are not enforced. If Redis can't be reached, sends are
+    allowed and a warning is logged.
+    """
+
+    def __init__(self, client=None, limits=None):
+        self.client = client or redis.Redis.from_url(settings.RATE_LIMIT_REDIS_URL)
+        self._limits = limits
+        self._script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    @property
+    def limits(self):
+        return settings.SEND_RATE_LIMITS if self._limits is None else self._limits
+
+    def buckets(self, account=None):
+        """
+        Get the buckets a send from an account draws from
+
+        Args:
+            account: Sender account, defaults to EMAIL_HOST_USER
+
+        Returns:
+            list: Bucket tuples
+        """
+        account = account or settings.EMAIL_HOST_USER
+        scopes = (('account', f'account:{account}'), ('global', 'global'))
+        buckets = []
+        for limit_name, scope in scopes:
+            for period, limit in self.limits.get(limit_name, {}).items():
+                if limit:
+                    buckets.append(Bucket(
+                        RATE_LIMIT_KEY.format(scope=scope, period=period),
+                        limit,
+                        limit / PERIOD_SECONDS[period]
+                    ))
+        return buckets
+
+    def acquire(self, tokens=1, account=None):
+        """
+        Take tokens for sending
+
+        Args:
+            tokens: Number of messages about to be sent
+            account: Sender account, defaults to EMAIL_HOST_USER
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds to wait
+            before they will be available
+        """
+        buckets = self.buckets(account)
+        if not buckets:
+            return 0.0
+
+        args = [tokens]
+        for bucket in buckets:
+            if tokens > bucket.capacity:
+                raise ValueError(f"Can't take {tokens} tokens from {bucket.key} holding at most {bucket.capacity}")
+            args.extend([bucket.capacity, bucket.rate])
+        try:
+            taken, wait = self._script(keys=[bucket.key for bucket in buckets], args=args)
+        except redis.RedisError as e:
+            logger.warning(f"Could not check send rate limits: {str(e)}")
+            return 0.0
+        return 0.0 if taken else float(wait)
+
+
+_limiter = None
+
+
+def get_rate_limiter():
+    """Get the send rate limiter, created on first use"""
+    global _limiter
+    if _limiter is None:
+        _limiter = TokenBucketLimiter()
+    return _limiter
@@ -0,0 +1,26 @@
+from django.conf import settings
+
+
+def task_priority(campaign_priority):
+    """Broker priority for the tasks of a campaign with the given priority"""
+    return settings.CAMPAIGN_TASK_PRIORITIES[campaign_priority]
+
+
+def send_task_options(campaign_priority):
+    """
+    Routing options for enqueueing send_campaign_emails
+
+    High priority campaigns go to their own queue so that large bulk
+    campaigns can't hold them up; all campaigns carry a broker priority
+    that orders them within a queue.
+
+    Args:
+        campaign_priority: Campaign.priority
+
+    Returns:
+        dict: ``queue`` and ``priority`` options for apply_async()
+    """
+    return {
+        'queue': settings.CAMPAIGN_SEND_QUEUES[campaign_priority],
+        'priority': task_priority(campaign_priority),
+    }
@@ -0,0 +1,199 @@
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+import redis
+from celery import group
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Campaign
+from .routing import send_task_options
+from .utils import invalidate_dashboard_stats
+
+logger = logging.getLogger(__name__)
+
+# Redis list the scheduler blocks on between due times; pushed to when a campaign is (re)scheduled
+SCHEDULER_WAKEUP_KEY = 'email_campaign:scheduler:wakeup'
+
+# Shortest wait, so that campaigns locked by another tick are not polled in a busy loop
+MIN_WAIT = 0.1
+
+# Seconds to wait before retrying a tick that failed, e.g. while the broker is down
+RETRY_WAIT = 5
+
+
+def dispatch_due_campaigns(now=None):
+    """
+    Claim the campaigns that are due and dispatch their send tasks
+
+    Due campaigns are claimed and marked active in one transaction, skipping
+    rows another scheduler has locked, and their send tasks are dispatched
+    as one group. This runs the same handful of queries however many
+    campaigns are due or however large their lists are.
+
+    If the tasks can't be published, the campaigns this call claimed are
+    set back to scheduled, so the next tick picks them up again, and the
+    error is re-raised.
+
+    Args:
+        now: Time to dispatch up to, defaults to the current time
+
+    Returns:
+        list: Ids of the dispatched campaigns
+    """
+    from .tasks import send_campaign_emails
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        # Find campaigns that are scheduled and their scheduled time has passed
+        due = dict(Campaign.objects.select_for_update(skip_locked=True).filter(
+            status='scheduled',
+            scheduled_time__lte=now
+        ).values_list('id', 'priority'))
+
+        # Mark them active together with the id of the task that sends them
+        task_ids = {campaign_id: str(uuid.uuid4()) for campaign_id in due}
+        Campaign.objects.bulk_update(
+            [
+                Campaign(pk=campaign_id, status='active', celery_task_id=task_id, updated_at=now)
+                for campaign_id, task_id in task_ids.items()
+            ],
+            ['status', 'celery_task_id', 'updated_at']
+        )
+
+    if task_ids:
+        # Bulk updates don't send post_save
+        invalidate_dashboard_stats()
+
+        # Dispatched once the status change is committed, each to its priority's queue
+        try:
+            group(
+                send_campaign_emails.si(str(campaign_id)).set(task_id=task_id, **send_task_options(due[campaign_id]))
+                for campaign_id, task_id in task_ids.items()
+            ).apply_async()
+        except Exception:
+            # Otherwise they would stay active with no task to send them; the
+            # task id tells this claim apart from later changes
+            Campaign.objects.filter(
+                pk__in=list(task_ids), status='active', celery_task_id__in=list(task_ids.values())
+            ).update(status='scheduled', celery_task_id=None, updated_at=timezone.now())
+            invalidate_dashboard_stats()
+            raise
+        logger.info(f"Dispatched {len(task_ids)} scheduled campaigns: {', '.join(str(campaign_id) for campaign_id in task_ids)}")
+    return list(due)
+
+
+def next_run_time():
+    """Time the next scheduled campaign falls due, read from the front of campaign_due_idx"""
+    return Campaign.objects.filter(
+        status='scheduled',
+        scheduled_time__isnull=False
+    ).order_by('scheduled_time').values_list('scheduled_time', flat=True).first()
+
+
+def schedule_next_run(campaign):
+    """
+    Re-arm a recurring campaign for its next run
+
+    The next run is ``recurring_days`` after the scheduled time of the run
+    that just finished, so runs don't drift by the time each send takes. A
+    run that would already be due is moved to ``recurring_days`` from now.
+
+    Returns:
+        datetime: Time of the next run
+    """
+    now = timezone.now()
+    interval = timedelta(days=campaign.recurring_days)
+    next_run = (campaign.scheduled_time or now) + interval
+    if next_run <= now:
+        next_run = now + interval
+
+    campaign.scheduled_time = next_run
+    campaign.status = 'scheduled'
+    campaign.save()
+    return next_run
+
+
+_client = None
+
+
+def get_scheduler_redis():
+    """Get the Redis client used for scheduler wake-ups, created on first use"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.SCHEDULER_REDIS_URL)
+    return _client
+
+
+def wake_scheduler(client=None):
+    """
+    Make the scheduler recompute its next due time now
+
+    Called when a campaign is scheduled, which may be earlier than the run
+    the scheduler is waiting for. If Redis is unavailable the scheduler
+    notices within SCHEDULER_MAX_SLEEP seconds.
+    """
+    client = client or get_scheduler_redis()
+    try:
+        # One pending wake-up is enough however many campaigns changed
+        pipe = client.pipeline(transaction=False)
+        pipe.lpush(SCHEDULER_WAKEUP_KEY, 1)
+        pipe.ltrim(SCHEDULER_WAKEUP_KEY, 0, 0)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not wake the campaign scheduler: {str(e)}")
+
+
+class CampaignScheduler:
+    """
+    Dispatches scheduled campaigns at the moment they fall due
+
+    Instead of polling the campaign table on a fixed interval, the scheduler
+    reads the next due time from the campaign_due_idx index and sleeps until
+    then. It is woken early through Redis when a campaign is scheduled, and
+    never sleeps longer than SCHEDULER_MAX_SLEEP so that a missed wake-up
+    only delays a run by that much. Recurring campaigns come back to it
+    through schedule_next_run().
+    """
+
+    def __init__(self, client=None, max_sleep=None):
+        self.client = client or get_scheduler_redis()
+        self.max_sleep = max_sleep or settings.SCHEDULER_MAX_SLEEP
+
+    def run_once(self):
+        """
+        Dispatch due campaigns
+
+        Returns:
+            float: Seconds until the next campaign falls due, at most max_sleep
+        """
+        now = timezone.now()
+        try:
+            dispatch_due_campaigns(now)
+        except Exception:
+            logger.exception("Could not dispatch scheduled campaigns, retrying")
+            return min(RETRY_WAIT, self.max_sleep)
+
+        next_run = next_run_time()
+        if next_run is None:
+            return self.max_sleep
+        return min(max((next_run - timezone.now()).total_seconds(), MIN_WAIT), self.max_sleep)
+
+    def wait(self, timeout):
+        """Block for ``timeout`` seconds or until the scheduler is woken"""
+        try:
+            self.client.blpop([SCHEDULER_WAKEUP_KEY], timeout=timeout)
+        except redis.RedisError as e:
+            logger.warning(f"Could not wait for scheduler wake-ups: {str(e)}")
+            time.sleep(timeout)
+
+    def run(self):
+        """Dispatch campaigns as they fall due, until interrupted"""
+        logger.info("Campaign scheduler started")
+        while True:
+            # Long-running process: drop database connections that went stale while waiting
+            close_old_connections()
+            self.wait(self.run_once())
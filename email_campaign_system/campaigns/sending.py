@@ -0,0 +1,123 @@
+import logging
+import time
+
+from django.conf import settings
+
+from .mime import get_message_factory
+from .smtp_pool import CONNECTION_ERRORS, get_smtp_pool
+from .templating import get_campaign_templates, recipient_context
+from .throttle import is_deferral
+
+logger = logging.getLogger(__name__)
+
+
+class CampaignRenderer:
+    """Renders a campaign's message for each recipient from templates compiled once"""
+
+    def __init__(self, campaign):
+        self.templates = get_campaign_templates(campaign)
+        from_header = f"{campaign.from_name} <{settings.EMAIL_HOST_USER}>" if campaign.from_name else settings.EMAIL_HOST_USER
+        self.message_factory = get_message_factory(from_header)
+
+    def render(self, recipient):
+        """
+        Build the personalized message for a recipient
+
+        Returns:
+            PreparedMessage: Envelope and flattened message
+        """
+        context = recipient_context(recipient)
+        return self.message_factory.render(
+            recipient.email,
+            self.templates.subject.render(context),
+            self.templates.body.render(context)
+        )
+
+
+class SendOutcome:
+    """What a sending engine did with a batch"""
+
+    def __init__(self):
+        self.sent = 0
+        self.errors = 0
+        self.deferred = 0
+        # Seconds until the rate limits allow the next message, if they stopped the batch
+        self.rate_limited_for = 0
+        # Recipients whose outcome was recorded
+        self.done = set()
+
+
+def take_token(rate_limiter):
+    """
+    Take a send token, waiting out pauses of up to RATE_LIMIT_MAX_WAIT
+
+    Returns:
+        float: 0 once a token was taken, otherwise the longer wait that
+        should be left to the next batch
+    """
+    wait = rate_limiter.acquire()
+    while 0 < wait <= settings.RATE_LIMIT_MAX_WAIT:
+        time.sleep(wait)
+        wait = rate_limiter.acquire()
+    return wait
+
+
+def send_serial(campaign, recipients, renderer, throttle, rate_limiter, log_writer, outcome):
+    """
+    Send messages one after another over a pooled blocking SMTP session
+
+    Stops at the first deferral the recipient should be retried for, or
+    when the rate limits ask for a longer pause.
+
+    Args:
+        campaign: Campaign object being sent
+        recipients: Recipient objects to send to, in order
+        renderer: CampaignRenderer for the campaign
+        throttle: ThroughputController for the SMTP provider
+        rate_limiter: TokenBucketLimiter
+        log_writer: EmailLogWriter receiving the outcomes
+        outcome: SendOutcome to update
+    """
+    smtp_pool = get_smtp_pool()
+    smtp_server = smtp_pool.acquire()
+    connection_broken = False
+
+    try:
+        for recipient in recipients:
+            # Wait out short rate limit pauses, and leave longer ones to the next batch
+            wait = take_token(rate_limiter)
+            if wait:
+                logger.info(f"Send rate limit reached, next token in {wait:.1f}s")
+                outcome.rate_limited_for = wait
+                break
+
+            try:
+                message = renderer.render(recipient)
+                smtp_server.sendmail(
+                    message.from_addr,
+                    message.to_addrs,
+                    message.data,
+                    message.mail_options
+                )
+                log_writer.record(campaign.id, recipient.id, 'sent')
+                outcome.sent += 1
+
+            except Exception as e:
+                if isinstance(e, CONNECTION_ERRORS):
+                    connection_broken = True
+                if is_deferral(e) and throttle.should_retry(campaign.id, recipient.id):
+                    # The provider is throttling us: stop here and retry this
+                    # recipient and the rest of the batch after backing off
+                    logger.warning(f"Sending to {recipient.email} deferred: {str(e)}")
+                    outcome.deferred += 1
+                    break
+
+                logger.error(f"Error sending to {recipient.email}: {str(e)}")
+                log_writer.record(campaign.id, recipient.id, 'error', str(e))
+                outcome.errors += 1
+            outcome.done.add(recipient.id)
+
+    finally:
+        # Return the SMTP session to the pool for the next batch
+        smtp_pool.release(smtp_server, discard=connection_broken)
+        logger.info(f"SMTP pool stats: {smtp_pool.stats}")
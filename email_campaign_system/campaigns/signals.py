@@ -1,9 +1,10 @@
 import logging
-from django.db.models.signals import post_save, pre_delete
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from django.utils import timezone
-from .models import Campaign, EmailLog
-from .tasks import send_campaign_emails
+from .models import Campaign, EmailLog, Recipient, RecipientList
+from .scheduler import wake_scheduler
+from .utils import invalidate_dashboard_stats
 from celery import current_app
 
 logger = logging.getLogger(__name__)
@@ -13,19 +14,11 @@ def handle_campaign_status_change(sender, instance, created, **kwargs):
     """
     Signal handler to schedule or cancel celery tasks when a campaign's status changes
     """
-    if created and instance.status == 'scheduled' and instance.scheduled_time:
-        # New campaign that is scheduled - create celery task
-        logger.info(f"Scheduling new campaign: {instance.name} (ID: {instance.id}) for {instance.scheduled_time}")
-        
-        # Schedule the task
-        result = send_campaign_emails.apply_async(
-            args=[str(instance.id)],
-            eta=instance.scheduled_time
-        )
-        
-        # Store the task ID
-        Campaign.objects.filter(id=instance.id).update(celery_task_id=result.id)
-        logger.info(f"Created celery task {result.id} for campaign {instance.id}")
+    if instance.status == 'scheduled' and instance.scheduled_time:
+        # The campaign scheduler dispatches it when due; wake it in case this
+        # run is due before the one it is waiting for
+        logger.info(f"Campaign {instance.name} (ID: {instance.id}) scheduled for {instance.scheduled_time}")
+        transaction.on_commit(wake_scheduler)
         
     elif not created:
         # Existing campaign - handle status updates
@@ -45,25 +38,37 @@ def handle_campaign_status_change(sender, instance, created, **kwargs):
             Campaign.objects.filter(id=instance.id).update(celery_task_id=None)
             logger.info(f"Removed scheduled task for draft campaign {instance.id}")
 
+@receiver(post_save, sender=Campaign)
+@receiver(post_delete, sender=Campaign)
+def invalidate_dashboard_on_campaign_change(sender, instance, **kwargs):
+    """
+    Signal handler to drop the cached dashboard statistics when a campaign changes
+    """
+    transaction.on_commit(invalidate_dashboard_stats)
+
 @receiver(post_save, sender=EmailLog)
-def update_campaign_status_on_completion(sender, instance, created, **kwargs):
+def update_campaign_counters(sender, instance, created, **kwargs):
     """
-    Signal handler to update campaign status when all emails are sent
+    Signal handler to keep campaign counters in sync with individually saved logs
+    
+    Bulk inserts by the email log writer don't send this signal and update the
+    counters themselves. Completion is decided once per batch by the writer.
     """
-    if created and instance.status == 'sent':
-        campaign = instance.campaign
-        
-        # Check if all recipients have received this campaign
-        recipient_count = campaign.recipient_list.recipients.count()
-        email_sent_count = EmailLog.objects.filter(campaign=campaign).count()
-        
-        # If all emails sent, mark campaign as completed
-        if email_sent_count >= recipient_count and campaign.status in ['active', 'scheduled']:
-            logger.info(f"All emails sent for campaign {campaign.id}. Marking as completed.")
-            Campaign.objects.filter(id=campaign.id).update(
-                status='completed',
-                updated_at=timezone.now()
-            )
+    if created:
+        Campaign.increment_counters(
+            instance.campaign_id,
+            sent=1 if instance.status == 'sent' else 0,
+            failed=1 if instance.status == 'error' else 0,
+            skipped=1 if instance.status == 'skipped' else 0
+        )
+
+@receiver(post_save, sender=Recipient)
+def update_recipient_list_count(sender, instance, created, **kwargs):
+    """
+    Signal handler to keep a list's recipient count in sync with individually created recipients
+    """
+    if created:
+        RecipientList.increment_recipient_count(instance.recipient_list_id, 1)
 
 @receiver(pre_delete, sender=Campaign)
 def cancel_campaign_tasks_on_delete(sender, instance, **kwargs):
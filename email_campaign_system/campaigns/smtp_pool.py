@@ -0,0 +1,249 @@
+import base64
+import logging
+import os
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the session is unusable and has to be re-established
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def open_smtp_connection():
+    """
+    Open and authenticate a new SMTP session
+
+    Uses OAuth2 (XOAUTH2) when a Google refresh token is configured and falls
+    back to basic authentication otherwise or when OAuth2 fails.
+
+    Returns:
+        smtplib.SMTP: Authenticated SMTP session
+    """
+    from .utils import get_gmail_oauth2_credentials
+
+    if getattr(settings, 'GOOGLE_REFRESH_TOKEN', None):
+        try:
+            smtp_server = smtplib.SMTP(settings.EMAIL_HOST, settings.EMAIL_PORT)
+            smtp_server.ehlo()
+            smtp_server.starttls()
+            smtp_server.ehlo()
+
+            creds = get_gmail_oauth2_credentials()
+            auth_string = f'user={settings.EMAIL_HOST_USER}\1auth=Bearer {creds["access_token"]}\1\1'
+            auth_string = base64.b64encode(auth_string.encode()).decode()
+            code, response = smtp_server.docmd('AUTH', f'XOAUTH2 {auth_string}')
+            if code != 235:
+                raise smtplib.SMTPAuthenticationError(code, response)
+
+            logger.info("Connected to SMTP using OAuth2")
+            return smtp_server
+        except Exception as e:
+            logger.error(f"OAuth2 authentication failed: {str(e)}")
+            logger.info("Falling back to basic auth")
+
+    smtp_server = smtplib.SMTP(settings.EMAIL_HOST, settings.EMAIL_PORT)
+    smtp_server.ehlo()
+    smtp_server.starttls()
+    smtp_server.ehlo()
+    smtp_server.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
+    logger.info("Connected to SMTP using basic auth")
+    return smtp_server
+
+
+class PooledSMTPConnection:
+    """An authenticated SMTP session checked out of a SMTPConnectionPool"""
+
+    def __init__(self, pool, smtp):
+        self.pool = pool
+        self.smtp = smtp
+        self.message_count = 0
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    @property
+    def exhausted(self):
+        return self.message_count >= self.pool.max_messages
+
+    @property
+    def idle_time(self):
+        return time.monotonic() - self.last_used
+
+    def is_healthy(self):
+        """Check the session with NOOP"""
+        try:
+            code, _ = self.smtp.noop()
+            return code == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+    def _reconnect(self):
+        self.close()
+        self.smtp = self.pool.connect()
+        self.message_count = 0
+        self.created_at = time.monotonic()
+
+    def _send(self, method, *args):
+        """
+        Call a sending method of the underlying session
+
+        Retires the session once it reaches the pool's message limit and
+        reconnects once if the server dropped the connection.
+        """
+        if self.exhausted:
+            self.pool._record('retired')
+            self._reconnect()
+
+        try:
+            result = getattr(self.smtp, method)(*args)
+        except CONNECTION_ERRORS as e:
+            logger.warning(f"SMTP connection lost ({str(e)}), reconnecting")
+            self.pool._record('reconnects')
+            self._reconnect()
+            result = getattr(self.smtp, method)(*args)
+
+        self.message_count += 1
+        self.last_used = time.monotonic()
+        return result
+
+    def send_message(self, msg):
+        """Send an email.message.Message over the pooled session"""
+        return self._send('send_message', msg)
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=()):
+        """Send already serialized message bytes over the pooled session"""
+        return self._send('sendmail', from_addr, to_addrs, msg, mail_options)
+
+
+class SMTPConnectionPool:
+    """
+    Per-process pool of authenticated SMTP sessions
+
+    Sessions are reused across batches and tasks. Idle sessions are checked
+    with NOOP before being handed out, sessions that have been idle for longer
+    than ``max_idle`` seconds are closed, and sessions are retired after
+    ``max_messages`` messages.
+    """
+
+    def __init__(self, connect=None, max_size=None, max_messages=None, max_idle=None):
+        self.connect = connect or open_smtp_connection
+        self.max_size = max_size if max_size is not None else settings.SMTP_POOL_SIZE
+        self.max_messages = max_messages if max_messages is not None else settings.SMTP_POOL_MAX_MESSAGES
+        self.max_idle = max_idle if max_idle is not None else settings.SMTP_POOL_MAX_IDLE
+        self._idle = []
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'reconnects': 0,
+            'retired': 0,
+            'discarded': 0,
+        }
+
+    def _record(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        return stats
+
+    def acquire(self):
+        """
+        Check out a healthy session, opening a new one if none is available
+
+        Returns:
+            PooledSMTPConnection: Session ready to send
+        """
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                break
+
+            if conn.exhausted:
+                self._record('retired')
+            elif conn.idle_time > self.max_idle or not conn.is_healthy():
+                self._record('discarded')
+            else:
+                self._record('hits')
+                return conn
+            conn.close()
+
+        self._record('misses')
+        return PooledSMTPConnection(self, self.connect())
+
+    def release(self, conn, discard=False):
+        """Return a session to the pool, or close it if it can't be reused"""
+        if discard or conn.exhausted:
+            self._record('discarded' if discard else 'retired')
+            conn.close()
+            return
+
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that acquires a session and releases it afterwards"""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.release(conn, discard=broken)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pool = None
+_pool_pid = None
+
+
+def get_smtp_pool():
+    """
+    Get the SMTP connection pool for the current worker process
+
+    A new pool is created after a fork so that child processes never share
+    sockets with their parent.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = SMTPConnectionPool()
+        _pool_pid = os.getpid()
+    return _pool
+
+
+@worker_process_shutdown.connect
+def close_smtp_pool(**kwargs):
+    """Close pooled SMTP sessions when a worker process exits"""
+    if _pool is not None and _pool_pid == os.getpid():
+        logger.info(f"Closing SMTP pool. Stats: {_pool.stats}")
+        _pool.close_all()
@@ -1,251 +1,435 @@
 import logging
-import smtplib
+import math
 import os
+import time
+import uuid
+from collections import namedtuple
 from datetime import timedelta
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from string import Template
 
-from celery import shared_task
+from celery import chord, shared_task
+from celery.exceptions import SoftTimeLimitExceeded
 from django.conf import settings
 from django.utils import timezone
-from django.db import transaction
-from django.db.models import Count
+from django.db.models import Count, Q
 
-from .models import Campaign, EmailLog, Recipient
-from .utils import get_gmail_oauth2_credentials
+from .dedup import skip_duplicate_recipients, skip_recipients_sent_by_siblings
+from .importer import RecipientImporter
+from .ledger import acquire_send_lease, claim_recipients, release_claims, release_send_lease
+from .log_writer import EmailLogWriter, recover_email_log_journals
+from .models import Campaign, EmailLog, RecipientImport
+from .quota import release_daily_quota, reserve_daily_quota
+from .rate_limit import get_rate_limiter
+from .routing import send_task_options, task_priority
+from .scheduler import dispatch_due_campaigns, schedule_next_run
+from .sending import CampaignRenderer, SendOutcome, send_serial
+from .thread_engine import send_threaded
+from .throttle import SLOT_RETRY_DELAY, ThroughputController
+from .utils import local_day_range
 
 # Setup logger
 logger = logging.getLogger(__name__)
 
+# Overdue draft campaigns named in the scheduler's warning
+OVERDUE_DRAFTS_LOGGED = 10
+
+BatchResult = namedtuple('BatchResult', ['status', 'sent', 'errors', 'last_done', 'delay'])
+
+
+def send_batch(campaign, scanned, throttle):
+    """
+    Send a campaign to one batch of recipients
+    
+    The batch is reserved from the daily quota and takes one of the
+    provider's concurrency slots. The campaign's sending engine (or
+    SMTP_SEND_ENGINE) then sends it, drawing a token from the shared rate
+    limits per message. Quota the batch doesn't use is released.
+    
+    Recipients are claimed in the send ledger first; those claimed by a
+    batch that is still sending are passed over like logged ones. Those
+    that a campaign with the same message has sent to are skipped.
+    
+    Args:
+        campaign: Campaign object being sent
+        scanned: Recipient objects in id order; those that already have an
+            email log for the campaign are passed over
+        throttle: ThroughputController for the SMTP provider
+    
+    Returns:
+        BatchResult: Status ('sent', 'quota_exceeded' or 'no_slot'), messages
+        sent and failed, the last recipient with an outcome (a cursor may
+        move up to it), and seconds to wait before the next batch
+    """
+    # Recipients that already have an outcome (skipped duplicates, or sent
+    # by a batch that died before moving the cursor) are passed over
+    logged = set(EmailLog.objects.filter(
+        campaign=campaign,
+        recipient_id__in=[recipient.id for recipient in scanned]
+    ).values_list('recipient_id', flat=True))
+    pending = [recipient for recipient in scanned if recipient.id not in logged]
+    
+    # Addresses a campaign with the same message sent to in the meantime
+    pending, covered = skip_recipients_sent_by_siblings(campaign, pending)
+    logged |= covered
+    claim_batch, pending = claim_recipients(campaign.pk, pending)
+    
+    # Templates and the MIME skeleton are built once, not per recipient
+    renderer = CampaignRenderer(campaign)
+    
+    # Reserve the batch's sends from the daily quota
+    quota_day, reserved = reserve_daily_quota(len(pending))
+    if pending and not reserved:
+        logger.warning(f"Daily email quota of {settings.DAILY_EMAIL_LIMIT} exceeded.")
+        release_claims(campaign.pk, claim_batch)
+        return BatchResult('quota_exceeded', 0, 0, None, 0)
+    
+    # Limit batch size to the reserved quota
+    pending = pending[:reserved]
+    
+    # Stay within the provider's maximum concurrency
+    slot = throttle.acquire_slot()
+    if slot is None:
+        release_daily_quota(quota_day, reserved)
+        release_claims(campaign.pk, claim_batch)
+        return BatchResult('no_slot', 0, 0, None, SLOT_RETRY_DELAY)
+    
+    engine = campaign.send_engine or settings.SMTP_SEND_ENGINE
+    if engine == 'async':
+        # The ORM can't be used from the event loop: outcomes are journaled
+        # as they arrive and written once the batch is done
+        log_writer = EmailLogWriter(flush_size=len(pending) + 1, flush_interval=math.inf)
+    else:
+        log_writer = EmailLogWriter()
+    outcome = SendOutcome()
+    send_started = time.monotonic()
+    
+    try:
+        if engine == 'async':
+            # Imported here so that the other engines don't need aiosmtplib
+            from .async_engine import send_async
+            send_async(campaign, pending, renderer, throttle, get_rate_limiter(), log_writer, outcome)
+        elif engine == 'threads':
+            send_threaded(campaign, pending, renderer, throttle, get_rate_limiter(), log_writer, outcome)
+        else:
+            send_serial(campaign, pending, renderer, throttle, get_rate_limiter(), log_writer, outcome)
+    finally:
+        throttle.release_slot(slot)
+        
+        # Failed, deferred and unattempted sends go back to the quota
+        release_daily_quota(quota_day, reserved - outcome.sent)
+        
+        # Write the batch's outcomes in bulk
+        log_writer.close()
+        
+        # Logged recipients are passed over from here on and the others may
+        # be claimed again. Claims stay if the outcomes couldn't be written.
+        release_claims(campaign.pk, claim_batch)
+    
+    # A cursor may pass every recipient up to the first one left without an outcome
+    last_done = None
+    for recipient in scanned:
+        if recipient.id not in logged and recipient.id not in outcome.done:
+            break
+        last_done = recipient
+    
+    delay = throttle.record_batch(
+        sent=outcome.sent + outcome.errors,
+        deferred=outcome.deferred,
+        elapsed=time.monotonic() - send_started
+    )
+    # Paced to the provider's rate and the shared rate limits; immediately
+    # if nothing was sent
+    return BatchResult('sent', outcome.sent, outcome.errors, last_done, max(delay, outcome.rate_limited_for))
+
+
+def finish_campaign_run(campaign, lease=None):
+    """
+    Schedule the next run of a recurring campaign, or mark the campaign as completed
+    
+    The send lease is released, so the next run takes a new one.
+    """
+    if campaign.schedule_type == 'recurring' and campaign.recurring_days:
+        # The campaign scheduler dispatches the next run when it is due
+        schedule_next_run(campaign)
+    else:
+        # Mark one-time campaign as completed if all emails sent
+        campaign.status = 'completed'
+        campaign.save()
+    release_send_lease(campaign.pk, lease)
+
+
+def fanout_shard_count(campaign):
+    """Number of parallel shards to send a campaign's list in; 1 sends it as one chain"""
+    shards = math.ceil(campaign.total_recipients / settings.CAMPAIGN_FANOUT_MIN_SHARD_SIZE)
+    return max(min(settings.CAMPAIGN_FANOUT_SHARDS, shards), 1)
+
+
+def fan_out_campaign(campaign, shards, lease=None):
+    """
+    Send a campaign as parallel shards of its recipient list
+    
+    Recipient ids are random UUIDs, so equal ranges of the id space give
+    shards of about the same size without scanning the list. Each shard is
+    a chain of send_campaign_shard tasks with its own cursor and SMTP
+    session; a chord runs complete_campaign_fanout once all have finished.
+    The shards and the callback share the caller's send lease and carry
+    the campaign's broker priority.
+    
+    Args:
+        campaign: Campaign object about to send its first batch
+        shards: Number of key ranges
+        lease: Send lease token held by the caller
+    
+    Returns:
+        AsyncResult: Result of the chord callback
+    """
+    bounds = [None] + [str(uuid.UUID(int=i * (1 << 128) // shards)) for i in range(1, shards)] + [None]
+    priority = task_priority(campaign.priority)
+    header = [
+        send_campaign_shard.si(str(campaign.pk), bounds[i], bounds[i + 1], lease=lease).set(priority=priority)
+        for i in range(shards)
+    ]
+    return chord(header)(complete_campaign_fanout.s(str(campaign.pk), lease).set(priority=priority))
+
+
 @shared_task
-def send_campaign_emails(campaign_id):
+def send_campaign_emails(campaign_id, lease=None):
     """
     Send emails for a campaign to all recipients in the associated list
+    
+    Each task sends one batch and enqueues the next one with its send lease
+    token. Tasks enqueued without a token (by the scheduler, the views or
+    the signals) only send if no other chain holds the campaign's lease.
     """
+    campaign = None
     try:
         campaign = Campaign.objects.get(pk=campaign_id)
         
         # Check if campaign should be active
         if campaign.status not in ['active', 'scheduled']:
             logger.warning(f"Campaign {campaign.name} is not active or scheduled. Status: {campaign.status}")
+            release_send_lease(campaign.pk, lease)
             return f"Campaign {campaign.name} is not active or scheduled."
         
+        # Only one task chain (or one set of shards) sends a campaign at a time
+        lease = acquire_send_lease(campaign.pk, lease)
+        if lease is None:
+            logger.info(f"Campaign {campaign.name} is already being sent by another task")
+            return f"Campaign {campaign.name} is already being sent."
+        
         # Update campaign status to active
         campaign.status = 'active'
         campaign.save()
         
-        # Get recipients who haven't received this campaign yet
-        recipient_ids = campaign.recipient_list.recipients.exclude(
-            email_logs__campaign=campaign
-        ).values_list('id', flat=True)
+        # Write outcomes left behind by workers that died mid-batch
+        recover_email_log_journals()
+        
+        if campaign.started_at is None:
+            # Skip addresses that an earlier campaign with the same message covers
+            skip_duplicate_recipients(campaign)
+            
+            # Large lists are sent by parallel shards instead of this chain
+            shards = fanout_shard_count(campaign)
+            if shards > 1:
+                fan_out_campaign(campaign, shards, lease)
+                return f"Campaign '{campaign.name}' fanned out to {shards} shards."
+        
+        # Batch size adapts to the provider's latency and deferrals
+        throttle = ThroughputController()
+        
+        # Continue after the send cursor; once it reaches the end of the list,
+        # sweep once for recipients added behind it
+        scanned = campaign.next_recipients(throttle.plan_batch().size)
+        from_cursor = bool(scanned)
+        if not from_cursor:
+            scanned = list(campaign.unsent_recipients()[:throttle.plan_batch().size])
         
         # If all emails sent, mark campaign as completed
-        if not recipient_ids:
+        if not scanned:
             campaign.status = 'completed'
             campaign.save()
+            release_send_lease(campaign.pk, lease)
             return f"Campaign {campaign.name} completed. All emails sent."
         
-        # Check daily quota
-        today_sent_count = EmailLog.objects.filter(
-            status='sent',
-            sent_at__date=timezone.now().date()
-        ).count()
-        
-        remaining_quota = settings.DAILY_EMAIL_LIMIT - today_sent_count
-        if remaining_quota <= 0:
-            logger.warning(f"Daily email quota exceeded. Sent {today_sent_count} emails today.")
+        batch = send_batch(campaign, scanned, throttle)
+        if batch.status == 'quota_exceeded':
+            release_send_lease(campaign.pk, lease)
             return "Daily email quota exceeded."
+        if batch.status == 'no_slot':
+            acquire_send_lease(campaign.pk, lease, hold_for=batch.delay)
+            send_campaign_emails.apply_async(
+                args=[campaign_id, lease],
+                countdown=batch.delay,
+                **send_task_options(campaign.priority)
+            )
+            return f"Campaign '{campaign.name}' is waiting for a free SMTP slot."
         
-        # Limit batch size to remaining quota
-        batch_size = min(50, remaining_quota)  # Process in small batches
-        recipients_batch = Recipient.objects.filter(id__in=recipient_ids[:batch_size])
-        
-        # Setup email connection
-        if hasattr(settings, 'GOOGLE_REFRESH_TOKEN') and settings.GOOGLE_REFRESH_TOKEN:
-            # Use OAuth2 if configured
-            try:
-                smtp_server = smtplib.SMTP('smtp.gmail.com', 587)
-                smtp_server.ehlo()
-                smtp_server.starttls()
-                
-                creds = get_gmail_oauth2_credentials()
-                auth_string = f'user={settings.EMAIL_HOST_USER}\1auth=Bearer {creds["access_token"]}\1\1'
-                smtp_server.docmd('AUTH', f'XOAUTH2 {auth_string}')
-                
-                logger.info("Connected to Gmail SMTP using OAuth2")
-            except Exception as e:
-                logger.error(f"OAuth2 authentication failed: {str(e)}")
-                # Fallback to basic auth
-                smtp_server = smtplib.SMTP('smtp.gmail.com', 587)
-                smtp_server.ehlo()
-                smtp_server.starttls()
-                smtp_server.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
-                logger.info("Fallback to basic auth successful")
-        else:
-            # Use basic authentication
-            smtp_server = smtplib.SMTP('smtp.gmail.com', 587)
-            smtp_server.ehlo()
-            smtp_server.starttls()
-            smtp_server.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
-            logger.info("Connected to Gmail SMTP using basic auth")
-        
-        sent_count = 0
-        error_count = 0
-        
-        try:
-            for recipient in recipients_batch:
-                try:
-                    # Replace template variables in content
-                    content_template = Template(campaign.content)
-                    personalized_content = content_template.safe_substitute(
-                        name=recipient.name,
-                        email=recipient.email
-                    )
-                    
-                    # Create email message
-                    msg = MIMEMultipart('alternative')
-                    msg['Subject'] = campaign.subject
-                    from_header = f"{campaign.from_name} <{settings.EMAIL_HOST_USER}>" if campaign.from_name else settings.EMAIL_HOST_USER
-                    msg['From'] = from_header
-                    msg['To'] = recipient.email
-                    
-                    # Attach HTML content
-                    html_part = MIMEText(personalized_content, 'html')
-                    msg.attach(html_part)
-                    
-                    # Send email
-                    smtp_server.send_message(msg)
-                    
-                    # Log success
-                    with transaction.atomic():
-                        EmailLog.objects.create(
-                            campaign=campaign,
-                            recipient=recipient,
-                            status='sent',
-                            sent_at=timezone.now()
-                        )
-                    
-                    sent_count += 1
-                    
-                except Exception as e:
-                    # Log error
-                    logger.error(f"Error sending to {recipient.email}: {str(e)}")
-                    with transaction.atomic():
-                        EmailLog.objects.create(
-                            campaign=campaign,
-                            recipient=recipient,
-                            status='error',
-                            error_message=str(e),
-                            sent_at=timezone.now()
-                        )
-                    error_count += 1
-        
-        finally:
-            # Close SMTP connection
-            smtp_server.quit()
+        # Outcomes are written, so the batch can't be handed out again
+        if from_cursor and batch.last_done is not None:
+            Campaign.advance_send_cursor(campaign.pk, batch.last_done.id)
         
         # Schedule next batch if needed
-        remaining_recipients = recipient_ids.count() - batch_size
+        campaign.refresh_from_db(fields=['emails_sent', 'emails_failed', 'emails_skipped'])
+        campaign.recipient_list.refresh_from_db(fields=['recipient_count'])
+        remaining_recipients = campaign.remaining_count
         if remaining_recipients > 0:
+            # Hold the lease until the next batch runs
+            acquire_send_lease(campaign.pk, lease, hold_for=batch.delay)
             send_campaign_emails.apply_async(
-                args=[campaign_id],
-                countdown=300  # 5 minutes between batches to avoid rate limits
-            )
-        elif campaign.schedule_type == 'recurring' and campaign.recurring_days:
-            # Schedule next run for recurring campaigns
-            next_run = timezone.now() + timedelta(days=campaign.recurring_days)
-            campaign.scheduled_time = next_run
-            campaign.save()
-            
-            # Schedule the next recurring task
-            send_campaign_emails.apply_async(
-                args=[campaign_id],
-                eta=next_run
+                args=[campaign_id, lease],
+                countdown=batch.delay,
+                **send_task_options(campaign.priority)
             )
         else:
-            # Mark one-time campaign as completed if all emails sent
-            campaign.status = 'completed'
-            campaign.save()
+            finish_campaign_run(campaign, lease)
         
-        return f"Campaign '{campaign.name}' processed. Sent: {sent_count}, Errors: {error_count}, Remaining: {remaining_recipients}"
+        return f"Campaign '{campaign.name}' processed. Sent: {batch.sent}, Errors: {batch.errors}, Remaining: {remaining_recipients}"
     
+    except SoftTimeLimitExceeded:
+        # The batch's outcomes are written; the next batch passes over them
+        logger.warning(f"Campaign {campaign_id} batch hit the task's time limit, continuing in a new task")
+        options = send_task_options(campaign.priority) if campaign is not None else {}
+        send_campaign_emails.apply_async(args=[campaign_id, lease], **options)
+        return f"Campaign {campaign_id} batch stopped at the time limit."
     except Campaign.DoesNotExist:
         logger.error(f"Campaign with ID {campaign_id} does not exist")
         return f"Campaign with ID {campaign_id} does not exist"
     except Exception as e:
         logger.error(f"Error in send_campaign_emails task: {str(e)}")
+        # The chain ends here, so the campaign can be sent again
+        release_send_lease(campaign_id, lease)
         return f"Error: {str(e)}"
 
+@shared_task(bind=True)
+def send_campaign_shard(self, campaign_id, after, upto, sent=0, errors=0, lease=None):
+    """
+    Send one key range of a fanned-out campaign, a batch per task
+    
+    The shard holds recipients with ids after ``after`` up to and including
+    ``upto``; None is the start or end of the id space. After each batch the
+    task replaces itself with the next one, so the chord waits for the
+    whole range. Every task renews the send lease shared by the shards.
+    
+    Returns:
+        dict: Messages sent and failed by the shard
+    """
+    totals = {'sent': sent, 'errors': errors}
+    try:
+        campaign = Campaign.objects.select_related('recipient_list').get(pk=campaign_id)
+        if campaign.status != 'active':
+            return totals
+        if lease and acquire_send_lease(campaign.pk, lease) is None:
+            # The lease expired and another chain took over the campaign
+            return totals
+        
+        throttle = ThroughputController()
+        scanned = campaign.recipients_in_range(after, upto, throttle.plan_batch().size)
+        if not scanned:
+            return totals
+        
+        batch = send_batch(campaign, scanned, throttle)
+        if batch.status == 'quota_exceeded':
+            return totals
+    except Exception as e:
+        # Whatever the shard didn't send is picked up after the chord
+        logger.error(f"Error in send_campaign_shard task: {str(e)}")
+        return totals
+    
+    if batch.status == 'sent':
+        totals = {'sent': sent + batch.sent, 'errors': errors + batch.errors}
+        if batch.last_done is not None:
+            after = str(batch.last_done.id)
+    if lease:
+        acquire_send_lease(campaign_id, lease, hold_for=batch.delay)
+    return self.replace(
+        send_campaign_shard.si(campaign_id, after, upto, lease=lease, **totals).set(
+            countdown=batch.delay,
+            priority=task_priority(campaign.priority)
+        )
+    )
+
+@shared_task
+def complete_campaign_fanout(results, campaign_id, lease=None):
+    """
+    Add up the results of a fanned-out campaign's shards and finish it
+    
+    Recipients the shards left unsent (daily quota, a failed shard, or
+    added during the send) are handed to the regular batch chain, which
+    sweeps for them from the end of the list.
+    """
+    sent = sum(result['sent'] for result in results)
+    errors = sum(result['errors'] for result in results)
+    try:
+        campaign = Campaign.objects.select_related('recipient_list').get(pk=campaign_id)
+    except Campaign.DoesNotExist:
+        logger.error(f"Campaign with ID {campaign_id} does not exist")
+        return f"Campaign with ID {campaign_id} does not exist"
+    
+    if campaign.status not in ['active', 'completed']:
+        release_send_lease(campaign.pk, lease)
+        return f"Campaign {campaign.name} is {campaign.status}. Sent: {sent}, Errors: {errors}"
+    
+    remaining_recipients = campaign.remaining_count
+    if remaining_recipients > 0:
+        last_recipient = campaign.recipient_list.recipients.order_by('-id').values_list('id', flat=True).first()
+        Campaign.advance_send_cursor(campaign.pk, last_recipient)
+        send_campaign_emails.apply_async(args=[campaign_id, lease], **send_task_options(campaign.priority))
+    else:
+        finish_campaign_run(campaign, lease)
+    
+    return f"Campaign '{campaign.name}' processed by {len(results)} shards. Sent: {sent}, Errors: {errors}, Remaining: {remaining_recipients}"
+
 @shared_task
 def check_scheduled_campaigns():
     """
     Check for campaigns that need to be sent based on their scheduled time
+    
+    The campaign scheduler (the run_campaign_scheduler command) dispatches
+    campaigns as they fall due; this task runs one such tick and reports
+    draft campaigns whose scheduled time has passed. Beat runs it every few
+    minutes so that campaigns are still sent, later, if the scheduler is
+    not running. Campaigns are claimed with row locks, so it never
+    dispatches a campaign the scheduler already has.
     """
     now = timezone.now()
     logger.info(f"Checking for scheduled campaigns at {now}")
-    
-    # Find campaigns that are scheduled and their scheduled time has passed
-    scheduled_campaigns = Campaign.objects.filter(
-        status='scheduled',
-        scheduled_time__lte=now
-    )
-    
-    logger.info(f"Found {scheduled_campaigns.count()} campaigns due for sending")
-    
-    for campaign in scheduled_campaigns:
-        # Schedule the send_campaign_emails task for this campaign
-        logger.info(f"Processing scheduled campaign: {campaign.name} (ID: {campaign.id})")
-        logger.info(f"  Scheduled for: {campaign.scheduled_time}, Current time: {now}")
-        logger.info(f"  Schedule type: {campaign.schedule_type}, Recipients: {campaign.recipient_list.recipients.count()}")
-        
-        # Explicitly mark as active to ensure it's processed
-        campaign.status = 'active'
-        campaign.save()
-        
-        # Directly trigger the email task
-        result = send_campaign_emails.apply_async(
-            args=[str(campaign.id)],
-            countdown=5  # Start in 5 seconds to allow the status change to be saved
-        )
-        
-        # Update the task ID
-        campaign.celery_task_id = result.id
-        campaign.save()
-        
-        # Log that we've scheduled this campaign
-        logger.info(f"Scheduled campaign '{campaign.name}' (ID: {campaign.id}) for immediate sending with task ID {result.id}")
+    dispatched = dispatch_due_campaigns(now)
     
     # Check for draft campaigns that have scheduled times in the past
-    draft_campaigns_due = Campaign.objects.filter(
+    overdue_drafts = list(Campaign.objects.filter(
         status='draft',
         scheduled_time__lte=now,
         scheduled_time__isnull=False
-    )
+    ).values_list('id', 'name', 'scheduled_time')[:OVERDUE_DRAFTS_LOGGED + 1])
     
-    if draft_campaigns_due.count() > 0:
-        logger.warning(f"Found {draft_campaigns_due.count()} draft campaigns with past scheduled times that were not sent")
-        for campaign in draft_campaigns_due:
-            logger.warning(f"Draft campaign not sent: {campaign.name} (ID: {campaign.id}), scheduled for {campaign.scheduled_time}")
+    if overdue_drafts:
+        more = " (and more)" if len(overdue_drafts) > OVERDUE_DRAFTS_LOGGED else ""
+        logger.warning(f"Found draft campaigns with past scheduled times that were not sent{more}")
+        for campaign_id, name, scheduled_time in overdue_drafts[:OVERDUE_DRAFTS_LOGGED]:
+            logger.warning(f"Draft campaign not sent: {name} (ID: {campaign_id}), scheduled for {scheduled_time}")
     
-    return f"Checked for scheduled campaigns. Found {scheduled_campaigns.count()} to process."
+    return f"Checked for scheduled campaigns. Found {len(dispatched)} to process."
 
 @shared_task
 def generate_daily_report():
     """
     Generate a daily report of email sending activity
     """
-    yesterday = timezone.now().date() - timedelta(days=1)
+    yesterday = timezone.localdate() - timedelta(days=1)
+    start, end = local_day_range(yesterday)
     
     # Get statistics for yesterday
-    logs = EmailLog.objects.filter(sent_at__date=yesterday)
-    sent_count = logs.filter(status='sent').count()
-    error_count = logs.filter(status='error').count()
+    logs = EmailLog.objects.filter(sent_at__gte=start, sent_at__lt=end)
+    totals = logs.aggregate(
+        sent=Count('id', filter=Q(status='sent')),
+        errors=Count('id', filter=Q(status='error'))
+    )
+    sent_count = totals['sent']
+    error_count = totals['errors']
     
     # Campaign performance
     campaign_stats = logs.values('campaign__name').annotate(
-        sent=Count('id', filter={'status': 'sent'}),
-        errors=Count('id', filter={'status': 'error'})
+        sent=Count('id', filter=Q(status='sent')),
+        errors=Count('id', filter=Q(status='error'))
     ).order_by('-sent')
     
     # Create report message
@@ -259,3 +443,43 @@ def generate_daily_report():
     
     logger.info(report)
     return report
+
+@shared_task
+def import_recipients(import_id):
+    """
+    Import an uploaded recipient CSV in the background
+    
+    Progress counters are stored on the RecipientImport after every chunk so
+    that the upload page can poll them. The stored upload is removed once
+    the import has finished.
+    """
+    try:
+        recipient_import = RecipientImport.objects.select_related('recipient_list').get(pk=import_id)
+    except RecipientImport.DoesNotExist:
+        logger.error(f"Recipient import with ID {import_id} does not exist")
+        return f"Recipient import with ID {import_id} does not exist"
+    
+    if recipient_import.is_finished:
+        return f"Recipient import {import_id} already {recipient_import.status}."
+    
+    RecipientImport.objects.filter(pk=import_id).update(status='running')
+    importer = RecipientImporter(recipient_import.recipient_list, progress=recipient_import.record_progress)
+    try:
+        with open(recipient_import.file_path, 'rb') as csv_file:
+            importer.run(csv_file)
+    except Exception as e:
+        logger.error(f"Error importing recipients from {recipient_import.file_name}: {str(e)}")
+        importer.error_messages.append(f"Error processing CSV: {str(e)}")
+        recipient_import.record_progress(importer, status='failed')
+        return f"Error: {str(e)}"
+    finally:
+        try:
+            os.remove(recipient_import.file_path)
+        except FileNotFoundError:
+            pass
+    
+    recipient_import.record_progress(importer, status='completed')
+    return (
+        f"Imported {recipient_import.file_name}: {importer.inserted} inserted, "
+        f"{importer.updated} updated, {importer.rejected} rejected"
+    )
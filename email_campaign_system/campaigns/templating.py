@@ -0,0 +1,111 @@
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from string import Template
+
+# Number of compiled campaigns kept per process
+CAMPAIGN_TEMPLATE_CACHE_SIZE = 64
+
+CampaignTemplates = namedtuple('CampaignTemplates', ['subject', 'body'])
+
+
+class CompiledTemplate:
+    """
+    A string.Template parsed once into literal segments and placeholder slots
+
+    Rendering follows ``Template.safe_substitute`` exactly: ``$$`` becomes
+    ``$``, placeholders missing from the context are left untouched and
+    invalid placeholders are kept as literal text.
+    """
+
+    def __init__(self, template_string):
+        self.template = template_string
+        self.segments = []
+        self.slots = []
+
+        literal = []
+        position = 0
+        for match in Template.pattern.finditer(template_string):
+            literal.append(template_string[position:match.start()])
+            position = match.end()
+
+            name = match.group('named') or match.group('braced')
+            if name is not None:
+                self.segments.append(''.join(literal))
+                literal = []
+                self.slots.append((len(self.segments), name))
+                self.segments.append(match.group())
+            elif match.group('escaped') is not None:
+                literal.append(Template.delimiter)
+            else:
+                literal.append(match.group())
+        literal.append(template_string[position:])
+        self.segments.append(''.join(literal))
+
+    def render(self, context):
+        """
+        Render the template for one recipient
+
+        Args:
+            context: Mapping of placeholder names to values
+
+        Returns:
+            str: Rendered text
+        """
+        if not self.slots:
+            return self.segments[0]
+
+        parts = self.segments.copy()
+        for index, name in self.slots:
+            if name in context:
+                parts[index] = str(context[name])
+        return ''.join(parts)
+
+
+@lru_cache(maxsize=128)
+def compile_template(template_string):
+    """Compile a template string, reusing earlier compilations of the same text"""
+    return CompiledTemplate(template_string)
+
+
+_campaign_templates = OrderedDict()
+_campaign_templates_lock = threading.Lock()
+
+
+def get_campaign_templates(campaign):
+    """
+    Get the compiled subject and body templates for a campaign
+
+    Compiled templates are cached per process by campaign id and
+    ``updated_at``, so editing a campaign invalidates its entry.
+
+    Args:
+        campaign: Campaign object
+
+    Returns:
+        CampaignTemplates: Compiled subject and body templates
+    """
+    key = (campaign.pk, campaign.updated_at)
+    with _campaign_templates_lock:
+        templates = _campaign_templates.get(key)
+        if templates is not None:
+            _campaign_templates.move_to_end(key)
+            return templates
+
+    templates = CampaignTemplates(
+        subject=CompiledTemplate(campaign.subject),
+        body=CompiledTemplate(campaign.content),
+    )
+    with _campaign_templates_lock:
+        _campaign_templates[key] = templates
+        while len(_campaign_templates) > CAMPAIGN_TEMPLATE_CACHE_SIZE:
+            _campaign_templates.popitem(last=False)
+    return templates
+
+
+def recipient_context(recipient):
+    """Placeholder values available to campaign templates"""
+    return {
+        'name': recipient.name,
+        'email': recipient.email,
+    }
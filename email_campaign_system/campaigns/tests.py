@@ -1,9 +1,83 @@
-from django.test import TestCase
+import io
+import json
+import os
+import random
+import shutil
+import smtplib
+import socket
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from string import Template
+from unittest import mock, skipUnless
+
+import aiosmtplib
+import redis
+from celery.exceptions import SoftTimeLimitExceeded
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401 (fakeredis needs it for Lua scripts)
+except ImportError:
+    fakeredis = None
+try:
+    from aiosmtpd.controller import Controller as SMTPController
+except ImportError:
+    SMTPController = None
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.utils import timezone
 
-from .models import Campaign, RecipientList, Recipient, EmailLog
+from email_campaign_system.celery import app as celery_app
+
+from .async_engine import is_async_deferral
+from .dedup import skip_duplicate_recipients, skip_recipients_sent_by_siblings
+from .forms import CSVUploadForm
+from .models import (
+    Campaign, CampaignSendLease, DailySendQuota, RecipientList, Recipient, EmailLog, RecipientImport, SendClaim
+)
+from .importer import MAX_IMPORT_ERROR_MESSAGES, RecipientImporter, create_recipient_import
+from .ledger import acquire_send_lease, claim_recipients, release_claims, release_send_lease
+from .log_writer import EmailLogWriter, recover_email_log_journals
+from .mime import CampaignMessageFactory, build_message, flatten_message
+from .quota import release_daily_quota, reserve_daily_quota
+from .rate_limit import TokenBucketLimiter
+from .scheduler import RETRY_WAIT, SCHEDULER_WAKEUP_KEY, CampaignScheduler, next_run_time, wake_scheduler
+from .smtp_pool import SMTPConnectionPool
+from .tasks import (
+    check_scheduled_campaigns, finish_campaign_run, generate_daily_report, import_recipients, send_batch,
+    send_campaign_emails
+)
+from .templating import CompiledTemplate, get_campaign_templates
+from .thread_engine import ThreadedSender
+from .throttle import ProviderLimits, ThroughputController, is_deferral
+from .utils import (
+    MAX_DAILY_STATS_DAYS, OAUTH2_REFRESH_LOCK_KEY, OAUTH2_TOKEN_CACHE_KEY,
+    annotate_campaign_stats, get_campaign_stats, get_daily_stats, get_dashboard_stats, get_gmail_oauth2_credentials,
+    invalidate_dashboard_stats, local_day_range, process_csv_file
+)
+
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+THROUGHPUT = {
+    'default': {'rate': 10.0, 'burst': 50, 'max_concurrency': 2},
+}
 
 
 class ModelTestCase(TestCase):
@@ -108,3 +182,1866 @@ class ViewTestCase(TestCase):
         response = self.client.get(reverse('dashboard'))
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'campaigns/dashboard.html')
+
+
+    def test_rescheduling_a_sending_campaign_keeps_its_send_task(self):
+        Campaign.objects.filter(pk=self.campaign.pk).update(status='active', celery_task_id='send-task')
+        self.client.login(username='testuser', password='testpassword')
+        scheduled_time = timezone.localtime() + timedelta(hours=2)
+        
+        with mock.patch.object(celery_app.control, 'revoke') as revoke, mock.patch('campaigns.signals.wake_scheduler'):
+            response = self.client.post(reverse('campaign_edit', args=[self.campaign.id]), {
+                'name': 'Test Campaign',
+                'subject': 'Test Subject',
+                'content': 'Hello {{name}}',
+                'from_name': 'Test Sender',
+                'status': 'scheduled',
+                'schedule_type': 'one_time',
+                'scheduled_time': scheduled_time.strftime('%Y-%m-%dT%H:%M'),
+                'priority': 'normal',
+                'recipient_list': self.recipient_list.pk,
+            })
+        
+        self.assertRedirects(response, reverse('campaign_detail', args=[self.campaign.id]))
+        self.assertFalse(revoke.called)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'scheduled')
+
+class FakeSMTP:
+    """Stand-in for smtplib.SMTP that records what was sent"""
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+        self.noop_code = 250
+        self.drop_next_send = False
+        self.reply_codes = {}
+
+    def noop(self):
+        if self.closed:
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        return self.noop_code, b'OK'
+
+    def send_message(self, msg):
+        if self.drop_next_send:
+            self.drop_next_send = False
+            self.closed = True
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        self.sent.append(msg)
+        return {}
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=()):
+        refused = {addr: (self.reply_codes[addr], b'Refused') for addr in to_addrs if addr in self.reply_codes}
+        if refused:
+            raise smtplib.SMTPRecipientsRefused(refused)
+        self.sent.append(msg)
+        return {}
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class LocalSMTPHandler:
+    """aiosmtpd handler that accepts everything except addresses given a reply code"""
+    def __init__(self):
+        self.messages = []
+        self.reply_codes = {}
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        code = self.reply_codes.get(address)
+        if code:
+            return f'{code} Refused'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos, envelope.content))
+        return '250 Message accepted'
+
+
+def start_local_smtp_server(test_case):
+    """Run an aiosmtpd server on a free local port for the duration of a test"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    handler = LocalSMTPHandler()
+    controller = SMTPController(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    test_case.addCleanup(controller.stop)
+    return handler, port
+
+
+class SMTPConnectionPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        self.connections = []
+        
+        def connect():
+            smtp = FakeSMTP()
+            self.connections.append(smtp)
+            return smtp
+        
+        self.pool = SMTPConnectionPool(connect=connect, max_size=2, max_messages=3, max_idle=60)
+
+    def test_session_reused_across_checkouts(self):
+        with self.pool.connection() as conn:
+            conn.send_message('first')
+        with self.pool.connection() as conn:
+            conn.send_message('second')
+        
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.connections[0].sent, ['first', 'second'])
+        self.assertEqual(self.pool.stats['hits'], 1)
+        self.assertEqual(self.pool.stats['misses'], 1)
+
+    def test_unhealthy_session_replaced(self):
+        with self.pool.connection():
+            pass
+        self.connections[0].noop_code = 421
+        
+        with self.pool.connection() as conn:
+            conn.send_message('hello')
+        
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(self.connections[1].sent, ['hello'])
+        self.assertEqual(self.pool.stats['discarded'], 1)
+
+    def test_reconnects_when_server_drops_connection(self):
+        with self.pool.connection() as conn:
+            self.connections[0].drop_next_send = True
+            conn.send_message('hello')
+        
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(self.connections[1].sent, ['hello'])
+        self.assertEqual(self.pool.stats['reconnects'], 1)
+
+    def test_session_retired_after_max_messages(self):
+        with self.pool.connection() as conn:
+            for i in range(5):
+                conn.send_message(i)
+        
+        self.assertEqual(self.connections[0].sent, [0, 1, 2])
+        self.assertEqual(self.connections[1].sent, [3, 4])
+        self.assertTrue(self.connections[0].closed)
+        self.assertEqual(self.pool.stats['retired'], 1)
+
+
+class FakeTokenEndpoint(BaseHTTPRequestHandler):
+    """OAuth2 token endpoint that hands out numbered access tokens"""
+    requests = 0
+
+    def do_POST(self):
+        FakeTokenEndpoint.requests += 1
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = json.dumps({
+            'access_token': f'token-{FakeTokenEndpoint.requests}',
+            'expires_in': 3600,
+            'token_type': 'Bearer',
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class OAuth2TokenCacheTestCase(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), FakeTokenEndpoint)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        FakeTokenEndpoint.requests = 0
+        cache.clear()
+        settings_override = override_settings(
+            GOOGLE_REFRESH_TOKEN='refresh-token',
+            GOOGLE_CLIENT_ID='client-id',
+            GOOGLE_CLIENT_SECRET='client-secret',
+            GOOGLE_TOKEN_URI=f'http://127.0.0.1:{self.server.server_port}/token',
+            GOOGLE_TOKEN_REFRESH_MARGIN=300,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        if fakeredis:
+            self.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        else:
+            self.redis = redis.Redis.from_url('redis://127.0.0.1:1/0')
+        lock_patcher = mock.patch('campaigns.utils.get_oauth2_lock_redis', return_value=self.redis)
+        lock_patcher.start()
+        self.addCleanup(lock_patcher.stop)
+
+    def test_token_is_cached(self):
+        first = get_gmail_oauth2_credentials()
+        second = get_gmail_oauth2_credentials()
+        
+        self.assertEqual(first['access_token'], 'token-1')
+        self.assertEqual(second['access_token'], 'token-1')
+        self.assertEqual(FakeTokenEndpoint.requests, 1)
+
+    def test_token_refreshed_before_expiry(self):
+        cache.set(OAUTH2_TOKEN_CACHE_KEY, {'access_token': 'old', 'expires_at': time.time() + 60})
+        
+        token = get_gmail_oauth2_credentials()
+        
+        self.assertEqual(token['access_token'], 'token-1')
+        self.assertEqual(cache.get(OAUTH2_TOKEN_CACHE_KEY)['access_token'], 'token-1')
+
+    @skipUnless(fakeredis, "fakeredis[lua] is not installed")
+    def test_current_token_used_while_another_process_refreshes(self):
+        cache.set(OAUTH2_TOKEN_CACHE_KEY, {'access_token': 'old', 'expires_at': time.time() + 60})
+        self.redis.set(OAUTH2_REFRESH_LOCK_KEY, 'other-process')
+        
+        token = get_gmail_oauth2_credentials()
+        
+        self.assertEqual(token['access_token'], 'old')
+        self.assertEqual(FakeTokenEndpoint.requests, 0)
+
+    @skipUnless(fakeredis, "fakeredis[lua] is not installed")
+    def test_slow_refresh_keeps_lock_taken_over_by_another_process(self):
+        from .utils import refresh_gmail_access_token
+        
+        def slow_refresh():
+            # The lock expired during the refresh and another process took it
+            self.redis.set(OAUTH2_REFRESH_LOCK_KEY, 'other-process')
+            return refresh_gmail_access_token()
+        
+        with mock.patch('campaigns.utils.refresh_gmail_access_token', side_effect=slow_refresh):
+            token = get_gmail_oauth2_credentials()
+        
+        self.assertEqual(token['access_token'], 'token-1')
+        self.assertEqual(self.redis.get(OAUTH2_REFRESH_LOCK_KEY), b'other-process')
+
+    @skipUnless(fakeredis, "fakeredis[lua] is not installed")
+    def test_lock_released_after_refresh(self):
+        get_gmail_oauth2_credentials()
+        
+        self.assertIsNone(self.redis.get(OAUTH2_REFRESH_LOCK_KEY))
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:1/0',
+    }})
+    def test_token_refreshed_directly_when_redis_is_down(self):
+        with mock.patch('campaigns.utils.get_oauth2_lock_redis', return_value=redis.Redis.from_url('redis://127.0.0.1:1/0')):
+            with self.assertLogs('campaigns.utils', level='WARNING'):
+                token = get_gmail_oauth2_credentials()
+        
+        self.assertEqual(token['access_token'], 'token-1')
+
+
+class TemplatingTestCase(TestCase):
+    def test_matches_safe_substitute(self):
+        templates = [
+            'Hello $name <${email}>',
+            'Costs $$10, $missing and ${missing} stay, $ and $9 are literal',
+            'No placeholders at all',
+            '',
+        ]
+        context = {'name': 'Test User', 'email': 'test@example.com'}
+        
+        for template in templates:
+            self.assertEqual(
+                CompiledTemplate(template).render(context),
+                Template(template).safe_substitute(context)
+            )
+
+    def test_campaign_templates_recompiled_after_edit(self):
+        recipient_list = RecipientList.objects.create(name='Test List')
+        campaign = Campaign.objects.create(
+            name='Test Campaign',
+            subject='Hi $name',
+            content='Hello $name',
+            recipient_list=recipient_list
+        )
+        
+        templates = get_campaign_templates(campaign)
+        self.assertIs(get_campaign_templates(campaign), templates)
+        self.assertEqual(templates.subject.render({'name': 'Ann'}), 'Hi Ann')
+        
+        campaign.content = 'Goodbye $name'
+        campaign.save()
+        
+        self.assertEqual(get_campaign_templates(campaign).body.render({'name': 'Ann'}), 'Goodbye Ann')
+
+
+class MessageFactoryTestCase(SimpleTestCase):
+    def assertMatchesEmailPackage(self, factory, to, subject, body):
+        message = factory.render(to, subject, body)
+        expected = build_message(factory.from_header, to, subject, body)
+        expected.set_boundary(factory.boundary)
+        self.assertEqual(message.data, flatten_message(expected))
+
+    def test_output_matches_email_package(self):
+        factory = CampaignMessageFactory('Test Sender <sender@example.com>')
+        
+        self.assertMatchesEmailPackage(factory, 'test@example.com', 'Hello', '<p>Hello</p>')
+        self.assertMatchesEmailPackage(factory, 'test@example.com', 'Long subject ' * 10, 'From here\nto\r\nthere\r')
+        self.assertMatchesEmailPackage(factory, 'test@example.com', 'Привет', '<p>Привет, мир</p>' * 20)
+        self.assertMatchesEmailPackage(factory, 'Test User <test@example.com>', '', '')
+
+    def test_non_ascii_sender_name(self):
+        factory = CampaignMessageFactory('Отправитель <sender@example.com>')
+        
+        self.assertMatchesEmailPackage(factory, 'test@example.com', 'Hello', '<p>Hello</p>')
+
+    def test_envelope(self):
+        factory = CampaignMessageFactory('Test Sender <sender@example.com>')
+        
+        message = factory.render('test@example.com', 'Hello', '<p>Hello</p>')
+        
+        self.assertEqual(message.from_addr, 'sender@example.com')
+        self.assertEqual(message.to_addrs, ['test@example.com'])
+        self.assertEqual(message.mail_options, ())
+
+
+class JournalDirMixin:
+    """Point the email log journal at a temporary directory"""
+    def setUp(self):
+        super().setUp()
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir, ignore_errors=True)
+        settings_override = override_settings(EMAIL_LOG_JOURNAL_DIR=self.journal_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+def run_next_batch(apply_async):
+    """Run the send_campaign_emails task the last batch enqueued, with its send lease"""
+    return send_campaign_emails(*apply_async.call_args.kwargs['args'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SMTP_PROVIDER_THROUGHPUT=THROUGHPUT, SEND_RATE_LIMITS={})
+class SendCampaignEmailsTestCase(JournalDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+        for i in range(3):
+            Recipient.objects.create(
+                email=f'user{i}@example.com',
+                name=f'User {i}',
+                recipient_list=self.recipient_list
+            )
+        self.campaign = Campaign.objects.create(
+            name='Test Campaign',
+            subject='Hi $name',
+            content='<p>Hello $name</p>',
+            from_name='Test Sender',
+            status='active',
+            recipient_list=self.recipient_list
+        )
+        
+        self.smtp = FakeSMTP()
+        pool = SMTPConnectionPool(connect=lambda: self.smtp, max_size=1, max_messages=100, max_idle=60)
+        pool_patcher = mock.patch('campaigns.sending.get_smtp_pool', return_value=pool)
+        pool_patcher.start()
+        self.addCleanup(pool_patcher.stop)
+        
+        async_patcher = mock.patch.object(send_campaign_emails, 'apply_async')
+        self.apply_async = async_patcher.start()
+        self.addCleanup(async_patcher.stop)
+
+    def test_sends_personalized_messages(self):
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertEqual(len(self.smtp.sent), 3)
+        message = next(data for data in self.smtp.sent if b'To: user0@example.com' in data)
+        self.assertIn(b'Subject: Hi User 0', message)
+        self.assertIn(b'<p>Hello User 0</p>', message)
+        self.assertEqual(EmailLog.objects.filter(campaign=self.campaign, status='sent').count(), 3)
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'completed')
+        self.assertEqual(self.campaign.emails_sent, 3)
+        self.assertEqual(self.campaign.emails_failed, 0)
+
+    def test_address_sent_once_across_overlapping_lists(self):
+        send_campaign_emails(str(self.campaign.id))
+        other_list = RecipientList.objects.create(name='Other List')
+        Recipient.objects.create(email='USER0@example.com', name='User 0', recipient_list=other_list)
+        Recipient.objects.create(email='new@example.com', name='New', recipient_list=other_list)
+        other_campaign = Campaign.objects.create(
+            name='Test Campaign (other list)',
+            subject=self.campaign.subject,
+            content=self.campaign.content,
+            status='active',
+            recipient_list=other_list
+        )
+        
+        send_campaign_emails(str(other_campaign.id))
+        
+        self.assertEqual(len(self.smtp.sent), 4)
+        self.assertIn(b'To: new@example.com', self.smtp.sent[-1])
+        other_campaign.refresh_from_db()
+        self.assertEqual((other_campaign.emails_sent, other_campaign.emails_skipped), (1, 1))
+        self.assertEqual(other_campaign.status, 'completed')
+
+    def test_deferred_recipient_is_retried_after_backing_off(self):
+        first, second, third = Recipient.objects.order_by('id')
+        self.smtp.reply_codes[second.email] = 451
+        
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertEqual(len(self.smtp.sent), 1)
+        self.assertIn(f'To: {first.email}'.encode(), self.smtp.sent[0])
+        self.assertFalse(EmailLog.objects.filter(recipient__in=[second, third]).exists())
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.send_cursor, first.id)
+        self.assertGreater(self.apply_async.call_args.kwargs['countdown'], 0)
+        
+        del self.smtp.reply_codes[second.email]
+        run_next_batch(self.apply_async)
+        
+        self.assertEqual(len(self.smtp.sent), 3)
+        self.assertEqual(Campaign.objects.get(pk=self.campaign.pk).status, 'completed')
+
+    @override_settings(SMTP_MAX_DEFERRALS=2)
+    def test_recipient_deferred_too_often_is_logged_as_error(self):
+        second = Recipient.objects.order_by('id')[1]
+        self.smtp.reply_codes[second.email] = 452
+        
+        send_campaign_emails(str(self.campaign.id))
+        run_next_batch(self.apply_async)
+        
+        log = EmailLog.objects.get(recipient=second)
+        self.assertEqual(log.status, 'error')
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.emails_sent, self.campaign.emails_failed), (2, 1))
+
+    def test_permanent_rejection_is_logged_without_backing_off(self):
+        second = Recipient.objects.order_by('id')[1]
+        self.smtp.reply_codes[second.email] = 550
+        
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertEqual(len(self.smtp.sent), 2)
+        self.assertEqual(EmailLog.objects.get(recipient=second).status, 'error')
+        self.assertEqual(Campaign.objects.get(pk=self.campaign.pk).status, 'completed')
+
+    @skipUnless(fakeredis, "fakeredis[lua] is not installed")
+    def test_rate_limit_reschedules_when_tokens_run_out(self):
+        limiter = TokenBucketLimiter(fakeredis.FakeRedis(server=fakeredis.FakeServer()), {'account': {'day': 2}})
+        
+        with mock.patch('campaigns.tasks.get_rate_limiter', return_value=limiter):
+            result = send_campaign_emails(str(self.campaign.id))
+        
+        self.assertEqual(len(self.smtp.sent), 2)
+        self.assertIn('Remaining: 1', result)
+        self.assertGreater(self.apply_async.call_args.kwargs['countdown'], 40000)
+
+    @override_settings(DAILY_EMAIL_LIMIT=2)
+    def test_batch_is_limited_to_reserved_quota(self):
+        result = send_campaign_emails(str(self.campaign.id))
+        
+        self.assertEqual(len(self.smtp.sent), 2)
+        self.assertIn('Remaining: 1', result)
+        self.assertEqual(run_next_batch(self.apply_async), "Daily email quota exceeded.")
+        self.assertEqual(len(self.smtp.sent), 2)
+
+    @override_settings(DAILY_EMAIL_LIMIT=2)
+    def test_priority_campaign_continues_on_priority_queue(self):
+        Campaign.objects.filter(pk=self.campaign.pk).update(priority='high')
+        
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertEqual(self.apply_async.call_args.kwargs['queue'], 'priority')
+        self.assertEqual(self.apply_async.call_args.kwargs['priority'], 0)
+
+    @override_settings(DAILY_EMAIL_LIMIT=3)
+    def test_failed_sends_return_their_quota(self):
+        second = Recipient.objects.order_by('id')[1]
+        self.smtp.reply_codes[second.email] = 550
+        
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertEqual(DailySendQuota.objects.get(day=timezone.localdate()).reserved, 2)
+
+    def test_waits_for_a_free_concurrency_slot(self):
+        throttle = ThroughputController()
+        slots = [throttle.acquire_slot(), throttle.acquire_slot()]
+        
+        result = send_campaign_emails(str(self.campaign.id))
+        
+        self.assertIn('waiting for a free SMTP slot', result)
+        self.assertEqual(self.smtp.sent, [])
+        self.assertTrue(self.apply_async.called)
+        
+        throttle.release_slot(slots[0])
+        run_next_batch(self.apply_async)
+        self.assertEqual(len(self.smtp.sent), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SMTP_PROVIDER_THROUGHPUT=THROUGHPUT, SEND_RATE_LIMITS={})
+class KeysetBatchingTestCase(JournalDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+        for i in range(170):
+            Recipient.objects.create(email=f'user{i}@example.com', name=f'User {i}', recipient_list=self.recipient_list)
+        self.campaign = Campaign.objects.create(
+            name='Test Campaign',
+            subject='Hi $name',
+            content='Hello $name',
+            status='active',
+            recipient_list=self.recipient_list
+        )
+        
+        self.smtp = FakeSMTP()
+        pool = SMTPConnectionPool(connect=lambda: self.smtp, max_size=1, max_messages=1000, max_idle=60)
+        pool_patcher = mock.patch('campaigns.sending.get_smtp_pool', return_value=pool)
+        pool_patcher.start()
+        self.addCleanup(pool_patcher.stop)
+        
+        async_patcher = mock.patch.object(send_campaign_emails, 'apply_async')
+        self.apply_async = async_patcher.start()
+        self.addCleanup(async_patcher.stop)
+
+    def run_batch(self):
+        with CaptureQueriesContext(connection) as queries:
+            if self.apply_async.called:
+                result = run_next_batch(self.apply_async)
+            else:
+                result = send_campaign_emails(str(self.campaign.id))
+        return result, len(queries)
+
+    def test_batches_follow_cursor_with_constant_queries(self):
+        remaining = []
+        queries = []
+        for _ in range(4):
+            result, count = self.run_batch()
+            remaining.append(int(result.rsplit('Remaining: ', 1)[1]))
+            queries.append(count)
+        
+        self.assertEqual(remaining, [120, 70, 20, 0])
+        self.assertEqual(queries[1], queries[2])
+        self.assertEqual(len(self.smtp.sent), 170)
+        self.assertEqual(EmailLog.objects.filter(campaign=self.campaign).count(), 170)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'completed')
+        self.assertEqual(self.campaign.send_cursor, max(Recipient.objects.values_list('id', flat=True)))
+
+    def test_cursor_survives_stale_save_and_never_moves_back(self):
+        stale = Campaign.objects.get(pk=self.campaign.pk)
+        send_campaign_emails(str(self.campaign.id))
+        cursor = Campaign.objects.get(pk=self.campaign.pk).send_cursor
+        
+        stale.name = 'Renamed'
+        stale.save()
+        Campaign.advance_send_cursor(self.campaign.pk, Recipient.objects.order_by('id').first().id)
+        
+        self.assertEqual(Campaign.objects.get(pk=self.campaign.pk).send_cursor, cursor)
+
+    def test_recipient_added_behind_cursor_is_swept_at_the_end(self):
+        for _ in range(4):
+            self.run_batch()
+        self.assertEqual(len(self.smtp.sent), 170)
+        
+        # Reopen the campaign and add a recipient whose id sorts before the cursor
+        Campaign.objects.filter(pk=self.campaign.pk).update(status='active')
+        late = Recipient.objects.create(
+            id='00000000-0000-4000-8000-000000000000',
+            email='late@example.com', name='Late', recipient_list=self.recipient_list
+        )
+        
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertIn(b'To: late@example.com', self.smtp.sent[-1])
+        self.assertTrue(EmailLog.objects.filter(campaign=self.campaign, recipient=late).exists())
+        self.assertEqual(Campaign.objects.get(pk=self.campaign.pk).status, 'completed')
+
+    def test_batch_of_passed_over_recipients_continues_immediately(self):
+        first_batch = Recipient.objects.order_by('id')[:50]
+        for recipient in first_batch:
+            EmailLog.objects.create(campaign=self.campaign, recipient=recipient, status='skipped')
+        
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertEqual(self.smtp.sent, [])
+        self.assertEqual(self.apply_async.call_args.kwargs['countdown'], 0)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.send_cursor, first_batch[49].id)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SMTP_BATCH_MAX_SECONDS=10)
+class ThroughputControllerTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.throttle = ThroughputController('smtp.example.com', ProviderLimits(rate=10.0, burst=40, max_concurrency=2))
+
+    def test_first_batch_uses_configured_burst_and_rate(self):
+        self.assertEqual(tuple(self.throttle.plan_batch()), (40, 10.0))
+
+    def test_delay_paces_batches_to_rate(self):
+        self.assertAlmostEqual(self.throttle.record_batch(sent=20, deferred=0, elapsed=0.5), 1.5)
+        self.assertEqual(self.throttle.record_batch(sent=0, deferred=0, elapsed=0.1), 0)
+
+    def test_slow_server_shrinks_batches(self):
+        self.throttle.record_batch(sent=10, deferred=0, elapsed=5.0)
+        
+        self.assertEqual(self.throttle.plan_batch().size, 20)
+
+    def test_deferrals_halve_rate_and_clean_batches_recover_it(self):
+        delay = self.throttle.record_batch(sent=9, deferred=1, elapsed=0)
+        self.assertEqual(self.throttle.plan_batch().rate, 5.0)
+        self.assertAlmostEqual(delay, 2.0)
+        
+        for _ in range(3):
+            self.throttle.record_batch(sent=10, deferred=0, elapsed=0)
+        self.assertAlmostEqual(self.throttle.plan_batch().rate, 8.0)
+        
+        for _ in range(10):
+            self.throttle.record_batch(sent=10, deferred=0, elapsed=0)
+        self.assertAlmostEqual(self.throttle.plan_batch().rate, 10.0)
+
+    def test_rate_is_shared_by_active_senders(self):
+        self.throttle.acquire_slot()
+        self.throttle.acquire_slot()
+        
+        self.assertAlmostEqual(self.throttle.record_batch(sent=10, deferred=0, elapsed=0), 2.0)
+
+    def test_concurrency_slots(self):
+        slots = [self.throttle.acquire_slot(), self.throttle.acquire_slot()]
+        
+        self.assertIsNone(self.throttle.acquire_slot())
+        self.throttle.release_slot(slots[0])
+        self.assertIsNotNone(self.throttle.acquire_slot())
+
+    def test_is_deferral(self):
+        self.assertTrue(is_deferral(smtplib.SMTPResponseException(421, b'Too many connections')))
+        self.assertTrue(is_deferral(smtplib.SMTPRecipientsRefused({'a@example.com': (450, b'Try later')})))
+        self.assertFalse(is_deferral(smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'No such user')})))
+        self.assertFalse(is_deferral(smtplib.SMTPServerDisconnected('Connection unexpectedly closed')))
+
+
+@skipUnless(fakeredis, "fakeredis[lua] is not installed")
+class TokenBucketLimiterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+    def limiter(self, limits):
+        return TokenBucketLimiter(self.client, limits)
+
+    def test_bucket_allows_burst_then_paces(self):
+        limiter = self.limiter({'account': {'second': 5}})
+        
+        self.assertEqual([limiter.acquire() for _ in range(5)], [0.0] * 5)
+        wait = limiter.acquire()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.2)
+        
+        time.sleep(wait)
+        self.assertEqual(limiter.acquire(), 0.0)
+
+    def test_global_limit_is_shared_by_accounts(self):
+        limiter = self.limiter({'account': {'day': 2}, 'global': {'hour': 3}})
+        
+        self.assertEqual([limiter.acquire(account='a@example.com') for _ in range(2)], [0.0, 0.0])
+        self.assertAlmostEqual(limiter.acquire(account='a@example.com'), 43200, delta=1)
+        self.assertEqual(limiter.acquire(account='b@example.com'), 0.0)
+        self.assertAlmostEqual(limiter.acquire(account='b@example.com'), 1200, delta=1)
+
+    def test_denied_send_takes_no_tokens(self):
+        limiter = self.limiter({'account': {'day': 5}, 'global': {'day': 1}})
+        limiter.acquire(account='a@example.com')
+        
+        self.assertGreater(limiter.acquire(account='a@example.com'), 0)
+        
+        tokens = float(self.client.hget('email_campaign:rate_limit:account:a@example.com:day', 'tokens'))
+        self.assertAlmostEqual(tokens, 4, places=2)
+
+    def test_zero_limits_are_not_enforced(self):
+        limiter = self.limiter({'account': {'second': 0, 'day': 0}})
+        
+        self.assertEqual([limiter.acquire() for _ in range(10)], [0.0] * 10)
+        self.assertEqual(self.client.keys(), [])
+
+    def test_request_larger_than_bucket_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.limiter({'global': {'second': 2}}).acquire(3)
+
+    def test_unreachable_redis_allows_sending(self):
+        client = mock.Mock()
+        client.register_script.return_value = mock.Mock(side_effect=redis.ConnectionError('Connection refused'))
+        
+        self.assertEqual(TokenBucketLimiter(client, {'global': {'second': 1}}).acquire(), 0.0)
+
+
+class DailySendQuotaTestCase(TestCase):
+    def test_reservations_stop_at_daily_limit(self):
+        with self.settings(DAILY_EMAIL_LIMIT=5):
+            day, granted = reserve_daily_quota(3)
+            self.assertEqual(granted, 3)
+            self.assertEqual(reserve_daily_quota(3), (day, 2))
+            self.assertEqual(reserve_daily_quota(1), (day, 0))
+            
+            release_daily_quota(day, 2)
+            self.assertEqual(reserve_daily_quota(3), (day, 2))
+
+    def test_ledger_starts_from_emails_already_sent_today(self):
+        recipient_list = RecipientList.objects.create(name='Test List')
+        campaign = Campaign.objects.create(name='Test', subject='Hi', content='Hello', recipient_list=recipient_list)
+        for i in range(3):
+            recipient = Recipient.objects.create(email=f'user{i}@example.com', name=f'User {i}', recipient_list=recipient_list)
+            EmailLog.objects.create(campaign=campaign, recipient=recipient, status='sent' if i else 'error')
+        
+        with self.settings(DAILY_EMAIL_LIMIT=5):
+            self.assertEqual(reserve_daily_quota(5)[1], 3)
+
+    def test_days_have_separate_quotas(self):
+        today = timezone.localdate()
+        with self.settings(DAILY_EMAIL_LIMIT=2):
+            reserve_daily_quota(2, day=today - timedelta(days=1))
+            
+            self.assertEqual(reserve_daily_quota(2, day=today), (today, 2))
+
+    def test_release_never_goes_negative(self):
+        day, _ = reserve_daily_quota(1)
+        release_daily_quota(day, 5)
+        
+        self.assertEqual(DailySendQuota.objects.get(day=day).reserved, 0)
+
+
+class ChaosSMTP(FakeSMTP):
+    """FakeSMTP that lets a hook interfere while a message is being sent"""
+    def __init__(self, hook):
+        super().__init__()
+        self.hook = hook
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=()):
+        self.hook(to_addrs[0])
+        return super().sendmail(from_addr, to_addrs, msg, mail_options)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SMTP_PROVIDER_THROUGHPUT=THROUGHPUT, SEND_RATE_LIMITS={})
+class SendLedgerTestCase(JournalDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+        for i in range(60):
+            Recipient.objects.create(email=f'user{i}@example.com', name=f'User {i}', recipient_list=self.recipient_list)
+        self.campaign = Campaign.objects.create(
+            name='Test Campaign',
+            subject='Hi $name',
+            content='Hello $name',
+            status='active',
+            recipient_list=self.recipient_list
+        )
+        
+        self.hook = lambda address: None
+        self.smtp = ChaosSMTP(lambda address: self.hook(address))
+        pool = SMTPConnectionPool(connect=lambda: self.smtp, max_size=2, max_messages=1000, max_idle=60)
+        pool_patcher = mock.patch('campaigns.sending.get_smtp_pool', return_value=pool)
+        pool_patcher.start()
+        self.addCleanup(pool_patcher.stop)
+        
+        async_patcher = mock.patch.object(send_campaign_emails, 'apply_async')
+        self.apply_async = async_patcher.start()
+        self.addCleanup(async_patcher.stop)
+
+    def test_one_lease_holder_at_a_time(self):
+        lease = acquire_send_lease(self.campaign.pk)
+        
+        self.assertIsNotNone(lease)
+        self.assertIsNone(acquire_send_lease(self.campaign.pk))
+        self.assertEqual(acquire_send_lease(self.campaign.pk, lease), lease)
+        
+        release_send_lease(self.campaign.pk, lease)
+        self.assertIsNone(acquire_send_lease(self.campaign.pk, lease))
+        self.assertIsNotNone(acquire_send_lease(self.campaign.pk))
+
+    def test_expired_lease_is_taken_over(self):
+        lease = acquire_send_lease(self.campaign.pk)
+        CampaignSendLease.objects.filter(campaign=self.campaign).update(expires_at=timezone.now() - timedelta(seconds=1))
+        
+        takeover = acquire_send_lease(self.campaign.pk)
+        
+        self.assertNotIn(takeover, (None, lease))
+        self.assertIsNone(acquire_send_lease(self.campaign.pk, lease))
+
+    def test_trigger_while_chain_holds_lease_sends_nothing(self):
+        with override_settings(DAILY_EMAIL_LIMIT=10):
+            send_campaign_emails(str(self.campaign.id))
+        
+        result = send_campaign_emails(str(self.campaign.id))
+        
+        self.assertIn('already being sent', result)
+        self.assertEqual(len(self.smtp.sent), 10)
+        self.assertEqual(self.apply_async.call_count, 1)
+
+    def test_claimed_recipients_are_passed_over_until_released(self):
+        recipients = list(Recipient.objects.order_by('id')[:5])
+        batch, claimed = claim_recipients(self.campaign.pk, recipients[:3])
+        
+        _, overlapping = claim_recipients(self.campaign.pk, recipients)
+        
+        self.assertEqual(claimed, recipients[:3])
+        self.assertEqual(overlapping, recipients[3:])
+        release_claims(self.campaign.pk, batch)
+        self.assertEqual(claim_recipients(self.campaign.pk, recipients[:3])[1], recipients[:3])
+
+    def test_stale_claim_is_taken_over(self):
+        recipient = Recipient.objects.order_by('id').first()
+        claim_recipients(self.campaign.pk, [recipient])
+        SendClaim.objects.update(claimed_at=timezone.now() - timedelta(seconds=settings.CAMPAIGN_SEND_LEASE_TIMEOUT + 1))
+        
+        self.assertEqual(claim_recipients(self.campaign.pk, [recipient])[1], [recipient])
+
+    def test_concurrent_triggers_and_batches_send_exactly_once(self):
+        rng = random.Random(20)
+        interference = {'trigger': 0, 'batch': 0, 'deferral': 0}
+        deferred = set()
+        
+        def interfere(address):
+            # Runs while a batch is sending: repeated triggers from the
+            # scheduler or the views, a second batch over the same range
+            # (as after a lease takeover), and provider deferrals
+            if rng.random() < 0.1 and address not in deferred:
+                deferred.add(address)
+                interference['deferral'] += 1
+                raise smtplib.SMTPRecipientsRefused({address: (451, b'Try again later')})
+            if self.hook is not interfere or rng.random() > 0.3:
+                return
+            self.hook = lambda address: None
+            try:
+                if rng.random() < 0.5:
+                    interference['trigger'] += 1
+                    self.assertIn('already being sent', send_campaign_emails(str(self.campaign.id)))
+                else:
+                    interference['batch'] += 1
+                    campaign = Campaign.objects.get(pk=self.campaign.pk)
+                    send_batch(campaign, list(campaign.unsent_recipients()[:20]), ThroughputController())
+            finally:
+                self.hook = interfere
+        self.hook = interfere
+        
+        send_campaign_emails(str(self.campaign.id))
+        for _ in range(50):
+            if not self.apply_async.called:
+                break
+            args = self.apply_async.call_args.kwargs['args']
+            self.apply_async.reset_mock()
+            send_campaign_emails(*args)
+        
+        self.assertTrue(all(interference.values()), interference)
+        recipients_sent = [
+            next(line for line in message.split(b'\r\n') if line.startswith(b'To: '))[4:].decode()
+            for message in self.smtp.sent
+        ]
+        self.assertEqual(sorted(recipients_sent), sorted(Recipient.objects.values_list('email', flat=True)))
+        self.assertEqual(EmailLog.objects.filter(campaign=self.campaign, status='sent').count(), 60)
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.status, self.campaign.emails_sent), ('completed', 60))
+        self.assertFalse(SendClaim.objects.exists())
+        self.assertIsNone(CampaignSendLease.objects.get(campaign=self.campaign).token)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CampaignSchedulerTestCase(TestCase):
+    def setUp(self):
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+        past = timezone.now() - timedelta(minutes=1)
+        self.due = [
+            Campaign.objects.create(
+                name=f'Due {i}',
+                subject='Test Subject',
+                content='Test Content',
+                scheduled_time=past,
+                recipient_list=self.recipient_list
+            )
+            for i in range(3)
+        ]
+        self.later = Campaign.objects.create(
+            name='Later',
+            subject='Test Subject',
+            content='Test Content',
+            scheduled_time=timezone.now() + timedelta(hours=1),
+            recipient_list=self.recipient_list
+        )
+        # Scheduled without the signal enqueueing an ETA task
+        Campaign.objects.filter(pk__in=[c.pk for c in self.due] + [self.later.pk]).update(status='scheduled')
+        Campaign.objects.create(
+            name='Overdue draft',
+            subject='Test Subject',
+            content='Test Content',
+            scheduled_time=past,
+            recipient_list=self.recipient_list
+        )
+        
+        group_patcher = mock.patch('campaigns.scheduler.group')
+        self.group = group_patcher.start()
+        self.addCleanup(group_patcher.stop)
+
+    def test_due_campaigns_claimed_and_dispatched_as_one_group(self):
+        # Claim, bulk update, overdue drafts, plus the transaction's savepoint
+        with self.assertNumQueries(5):
+            result = check_scheduled_campaigns()
+        
+        self.assertIn('Found 3 to process', result)
+        self.group.return_value.apply_async.assert_called_once_with()
+        signatures = list(self.group.call_args.args[0])
+        self.assertEqual(sorted(sig.args[0] for sig in signatures), sorted(str(c.id) for c in self.due))
+        for campaign in self.due:
+            campaign.refresh_from_db()
+            self.assertEqual(campaign.status, 'active')
+            self.assertIn(campaign.celery_task_id, [sig.options['task_id'] for sig in signatures])
+        self.assertEqual(Campaign.objects.get(pk=self.later.pk).status, 'scheduled')
+
+    def test_campaigns_dispatched_to_their_priority_queue(self):
+        Campaign.objects.filter(pk=self.due[0].pk).update(priority='high')
+        
+        check_scheduled_campaigns()
+        
+        options = {sig.args[0]: sig.options for sig in self.group.call_args.args[0]}
+        self.assertEqual((options[str(self.due[0].id)]['queue'], options[str(self.due[0].id)]['priority']), ('priority', 0))
+        self.assertEqual((options[str(self.due[1].id)]['queue'], options[str(self.due[1].id)]['priority']), ('campaigns', 5))
+        # Housekeeping, imports and reports have queues of their own
+        route = celery_app.amqp.router.route
+        self.assertEqual(route({}, 'campaigns.tasks.send_campaign_shard')['queue'].name, 'shards')
+        self.assertEqual(route({}, 'campaigns.tasks.import_recipients')['queue'].name, 'imports')
+        self.assertEqual(route({}, 'campaigns.tasks.generate_daily_report')['queue'].name, 'reports')
+
+    def test_claims_returned_to_schedule_when_dispatch_fails(self):
+        self.group.return_value.apply_async.side_effect = redis.ConnectionError('Connection refused')
+        
+        with self.assertRaises(redis.ConnectionError):
+            check_scheduled_campaigns()
+        
+        for campaign in self.due:
+            campaign.refresh_from_db()
+            self.assertEqual(campaign.status, 'scheduled')
+            self.assertIsNone(campaign.celery_task_id)
+        
+        # The scheduler retries shortly instead of polling the broker in a loop
+        with self.assertLogs('campaigns.scheduler', level='ERROR'):
+            self.assertEqual(CampaignScheduler(client=mock.Mock(), max_sleep=60).run_once(), RETRY_WAIT)
+        
+        self.group.return_value.apply_async.side_effect = None
+        self.assertIn('Found 3 to process', check_scheduled_campaigns())
+        self.assertEqual(Campaign.objects.filter(status='active').count(), 3)
+
+    def test_beat_runs_a_fallback_tick(self):
+        entry = settings.CELERY_BEAT_SCHEDULE['check-scheduled-campaigns']
+        
+        self.assertEqual(celery_app.tasks[entry['task']], check_scheduled_campaigns)
+        self.assertLessEqual(entry['schedule'], 3600)
+
+    def test_claimed_campaigns_are_not_dispatched_again(self):
+        check_scheduled_campaigns()
+        self.group.reset_mock()
+        
+        self.assertIn('Found 0 to process', check_scheduled_campaigns())
+        self.assertFalse(self.group.called)
+
+    def test_scheduler_sleeps_until_next_due_campaign(self):
+        scheduler = CampaignScheduler(client=mock.Mock(), max_sleep=7200)
+        
+        wait = scheduler.run_once()
+        
+        self.assertEqual(len(list(self.group.call_args.args[0])), 3)
+        self.assertAlmostEqual(wait, (self.later.scheduled_time - timezone.now()).total_seconds(), delta=5)
+        self.assertEqual(CampaignScheduler(client=mock.Mock(), max_sleep=60).run_once(), 60)
+        
+        Campaign.objects.filter(pk=self.later.pk).update(status='paused')
+        self.assertEqual(scheduler.run_once(), 7200)
+
+    def test_recurring_campaign_is_rearmed_for_the_scheduler(self):
+        campaign = self.due[0]
+        Campaign.objects.filter(pk=campaign.pk).update(status='active', schedule_type='recurring', recurring_days=7)
+        campaign.refresh_from_db()
+        scheduled_time = campaign.scheduled_time
+        
+        finish_campaign_run(campaign)
+        
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, 'scheduled')
+        self.assertEqual(campaign.scheduled_time, scheduled_time + timedelta(days=7))
+        self.assertEqual(next_run_time(), self.due[1].scheduled_time)
+        check_scheduled_campaigns()
+        self.assertEqual(Campaign.objects.get(pk=campaign.pk).status, 'scheduled')
+
+    def test_scheduling_a_campaign_wakes_the_scheduler(self):
+        with mock.patch('campaigns.signals.wake_scheduler') as wake:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.later.refresh_from_db()
+                self.later.scheduled_time = timezone.now() + timedelta(minutes=5)
+                self.later.save()
+        
+        wake.assert_called_once_with()
+
+    @skipUnless(fakeredis, "fakeredis is not installed")
+    def test_wake_up_ends_the_wait_early(self):
+        client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        scheduler = CampaignScheduler(client=client)
+        wake_scheduler(client)
+        wake_scheduler(client)
+        
+        started = time.monotonic()
+        scheduler.wait(5)
+        
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(client.llen(SCHEDULER_WAKEUP_KEY), 0)
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES, SMTP_PROVIDER_THROUGHPUT=THROUGHPUT, SEND_RATE_LIMITS={},
+    CAMPAIGN_FANOUT_SHARDS=4, CAMPAIGN_FANOUT_MIN_SHARD_SIZE=5
+)
+class CampaignFanoutTestCase(JournalDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+        for i in range(40):
+            Recipient.objects.create(email=f'user{i}@example.com', name=f'User {i}', recipient_list=self.recipient_list)
+        self.campaign = Campaign.objects.create(
+            name='Test Campaign',
+            subject='Hi $name',
+            content='Hello $name',
+            status='active',
+            recipient_list=self.recipient_list
+        )
+        
+        self.smtp = FakeSMTP()
+        pool = SMTPConnectionPool(connect=lambda: self.smtp, max_size=1, max_messages=1000, max_idle=60)
+        pool_patcher = mock.patch('campaigns.sending.get_smtp_pool', return_value=pool)
+        pool_patcher.start()
+        self.addCleanup(pool_patcher.stop)
+        
+        # Run the chord and the shards' replacement tasks in process
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+        
+        async_patcher = mock.patch.object(send_campaign_emails, 'apply_async')
+        self.apply_async = async_patcher.start()
+        self.addCleanup(async_patcher.stop)
+
+    def test_shards_cover_list_once_and_complete_campaign(self):
+        with mock.patch('campaigns.tasks.send_batch', wraps=send_batch) as batches:
+            result = send_campaign_emails(str(self.campaign.id))
+        
+        self.assertIn('fanned out to 4 shards', result)
+        self.assertEqual(len(self.smtp.sent), 40)
+        self.assertEqual(len(set(self.smtp.sent)), 40)
+        self.assertGreaterEqual(batches.call_count, 4)
+        self.assertFalse(self.apply_async.called)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'completed')
+        self.assertEqual(self.campaign.emails_sent, 40)
+
+    @override_settings(CAMPAIGN_FANOUT_MIN_SHARD_SIZE=100)
+    def test_small_list_is_sent_by_one_chain(self):
+        result = send_campaign_emails(str(self.campaign.id))
+        
+        self.assertIn('Remaining: 0', result)
+        self.assertEqual(len(self.smtp.sent), 40)
+
+    @override_settings(DAILY_EMAIL_LIMIT=30)
+    def test_unsent_recipients_are_handed_to_the_chain(self):
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertEqual(len(self.smtp.sent), 30)
+        # The chain continues with the lease the shards held
+        lease = str(CampaignSendLease.objects.get(campaign=self.campaign).token)
+        self.apply_async.assert_called_once_with(args=[str(self.campaign.id), lease], queue='campaigns', priority=5)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'active')
+        self.assertEqual(self.campaign.send_cursor, max(Recipient.objects.values_list('id', flat=True)))
+        self.assertEqual(self.campaign.unsent_recipients().count(), 10)
+
+
+@skipUnless(SMTPController, "aiosmtpd is not installed")
+@override_settings(CACHES=LOCMEM_CACHES, SMTP_PROVIDER_THROUGHPUT=THROUGHPUT, SEND_RATE_LIMITS={}, SMTP_ASYNC_SESSIONS=3)
+class AsyncSendingEngineTestCase(JournalDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+        for i in range(10):
+            Recipient.objects.create(email=f'user{i}@example.com', name=f'User {i}', recipient_list=self.recipient_list)
+        self.campaign = Campaign.objects.create(
+            name='Test Campaign',
+            subject='Hi $name',
+            content='Hello $name',
+            status='active',
+            send_engine='async',
+            recipient_list=self.recipient_list
+        )
+        
+        self.server, port = start_local_smtp_server(self)
+        
+        async def connect():
+            smtp = aiosmtplib.SMTP(hostname='127.0.0.1', port=port, start_tls=False)
+            await smtp.connect()
+            return smtp
+        connect_patcher = mock.patch('campaigns.async_engine.open_async_smtp_connection', connect)
+        connect_patcher.start()
+        self.addCleanup(connect_patcher.stop)
+        
+        async_patcher = mock.patch.object(send_campaign_emails, 'apply_async')
+        self.apply_async = async_patcher.start()
+        self.addCleanup(async_patcher.stop)
+
+    def test_sends_batch_over_concurrent_sessions(self):
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertEqual(len(self.server.messages), 10)
+        rcpt_tos, content = next(message for message in self.server.messages if message[0] == ['user3@example.com'])
+        self.assertIn(b'Subject: Hi User 3', content)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.emails_sent, 10)
+        self.assertEqual(self.campaign.status, 'completed')
+
+    def test_deferral_stops_batch_and_cursor(self):
+        recipients = list(Recipient.objects.order_by('id'))
+        self.server.reply_codes[recipients[4].email] = 451
+        
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertFalse(EmailLog.objects.filter(recipient=recipients[4]).exists())
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.send_cursor, recipients[3].id)
+        self.assertLess(self.campaign.emails_sent, 10)
+        
+        del self.server.reply_codes[recipients[4].email]
+        run_next_batch(self.apply_async)
+        
+        self.assertEqual(EmailLog.objects.filter(campaign=self.campaign, status='sent').count(), 10)
+
+    def test_permanent_rejection_is_logged(self):
+        self.server.reply_codes['user2@example.com'] = 550
+        
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertEqual(EmailLog.objects.get(recipient__email='user2@example.com').status, 'error')
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.emails_sent, self.campaign.emails_failed), (9, 1))
+
+    def test_is_async_deferral(self):
+        refused = aiosmtplib.SMTPRecipientRefused(450, 'Try later', 'a@example.com')
+        
+        self.assertTrue(is_async_deferral(aiosmtplib.SMTPRecipientsRefused([refused])))
+        self.assertTrue(is_async_deferral(aiosmtplib.SMTPResponseException(421, 'Too many connections')))
+        self.assertFalse(is_async_deferral(aiosmtplib.SMTPResponseException(550, 'No such user')))
+
+
+class SlowFakeSMTP(FakeSMTP):
+    """FakeSMTP that takes a moment per message, like a real server round trip"""
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=()):
+        time.sleep(0.01)
+        return super().sendmail(from_addr, to_addrs, msg, mail_options)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SMTP_PROVIDER_THROUGHPUT=THROUGHPUT, SEND_RATE_LIMITS={}, SMTP_SEND_THREADS=3)
+class ThreadedSendingEngineTestCase(JournalDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+        for i in range(10):
+            Recipient.objects.create(email=f'user{i}@example.com', name=f'User {i}', recipient_list=self.recipient_list)
+        self.campaign = Campaign.objects.create(
+            name='Test Campaign',
+            subject='Hi $name',
+            content='Hello $name',
+            status='active',
+            send_engine='threads',
+            recipient_list=self.recipient_list
+        )
+        
+        # Every session refuses the same addresses
+        self.reply_codes = {}
+        self.sessions = []
+        
+        def connect():
+            smtp = SlowFakeSMTP()
+            smtp.reply_codes = self.reply_codes
+            self.sessions.append(smtp)
+            return smtp
+        pool = SMTPConnectionPool(connect=connect, max_size=3, max_messages=1000, max_idle=60)
+        pool_patcher = mock.patch('campaigns.thread_engine.get_smtp_pool', return_value=pool)
+        pool_patcher.start()
+        self.addCleanup(pool_patcher.stop)
+        
+        async_patcher = mock.patch.object(send_campaign_emails, 'apply_async')
+        self.apply_async = async_patcher.start()
+        self.addCleanup(async_patcher.stop)
+
+    def sent_count(self):
+        return sum(len(smtp.sent) for smtp in self.sessions)
+
+    def test_sends_batch_over_one_session_per_thread(self):
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertEqual(len(self.sessions), 3)
+        self.assertEqual(self.sent_count(), 10)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.emails_sent, 10)
+        self.assertEqual(self.campaign.status, 'completed')
+        
+        # Sessions go back to the pool for the next batch
+        send_campaign_emails(str(self.campaign.id))
+        self.assertEqual(len(self.sessions), 3)
+
+    def test_deferral_stops_batch_and_cursor(self):
+        recipients = list(Recipient.objects.order_by('id'))
+        self.reply_codes[recipients[4].email] = 451
+        
+        send_campaign_emails(str(self.campaign.id))
+        
+        self.assertFalse(EmailLog.objects.filter(recipient=recipients[4]).exists())
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.send_cursor, recipients[3].id)
+        self.assertLess(self.campaign.emails_sent, 10)
+        
+        del self.reply_codes[recipients[4].email]
+        run_next_batch(self.apply_async)
+        
+        self.assertEqual(EmailLog.objects.filter(campaign=self.campaign, status='sent').count(), 10)
+
+    def test_time_limit_stops_threads_and_keeps_outcomes(self):
+        record = ThreadedSender._record
+        
+        def interrupted(sender, result):
+            record(sender, result)
+            if sender.outcome.sent == 3:
+                raise SoftTimeLimitExceeded()
+        
+        with mock.patch.object(ThreadedSender, '_record', interrupted):
+            result = send_campaign_emails(str(self.campaign.id))
+        
+        self.assertIn('time limit', result)
+        self.assertFalse([thread for thread in threading.enumerate() if thread.name.startswith('smtp-sender')])
+        # Messages in flight when the limit hit were logged, the rest left for the next task
+        self.assertLess(self.sent_count(), 10)
+        self.assertEqual(EmailLog.objects.filter(campaign=self.campaign, status='sent').count(), self.sent_count())
+        self.apply_async.assert_called_once_with(args=[str(self.campaign.id), mock.ANY], queue='campaigns', priority=5)
+
+
+class EmailLogWriterTestCase(JournalDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+        self.recipients = [
+            Recipient.objects.create(
+                email=f'user{i}@example.com',
+                name=f'User {i}',
+                recipient_list=self.recipient_list
+            )
+            for i in range(5)
+        ]
+        self.campaign = Campaign.objects.create(
+            name='Test Campaign',
+            subject='Test Subject',
+            content='Hello $name',
+            recipient_list=self.recipient_list
+        )
+
+    def test_flushes_in_bulk(self):
+        writer = EmailLogWriter(flush_size=3, flush_interval=60)
+        
+        # One flush: savepoint, lock campaign, existing pairs, bulk insert, counters, release
+        with self.assertNumQueries(6):
+            for recipient in self.recipients[:3]:
+                writer.record(self.campaign.id, recipient.id, 'sent')
+        self.assertEqual(EmailLog.objects.count(), 3)
+        
+        writer.record(self.campaign.id, self.recipients[3].id, 'error', 'Mailbox full')
+        self.assertEqual(EmailLog.objects.count(), 3)
+        
+        writer.close()
+        self.assertEqual(EmailLog.objects.count(), 4)
+        self.assertEqual(EmailLog.objects.get(status='error').error_message, 'Mailbox full')
+        self.assertEqual(os.listdir(self.journal_dir), [])
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.emails_sent, 3)
+        self.assertEqual(self.campaign.emails_failed, 1)
+
+    def test_duplicate_outcomes_ignored(self):
+        with EmailLogWriter() as writer:
+            writer.record(self.campaign.id, self.recipients[0].id, 'sent')
+        with EmailLogWriter() as writer:
+            writer.record(self.campaign.id, self.recipients[0].id, 'error', 'Duplicate')
+        
+        self.assertEqual(EmailLog.objects.get().status, 'sent')
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.emails_sent, 1)
+        self.assertEqual(self.campaign.emails_failed, 0)
+
+    def test_outcomes_recovered_after_crash(self):
+        writer = EmailLogWriter(flush_size=100, flush_interval=60)
+        for recipient in self.recipients:
+            writer.record(self.campaign.id, recipient.id, 'sent')
+        
+        # A live writer's journal is left alone
+        self.assertEqual(recover_email_log_journals(), 0)
+        
+        # The worker dies without flushing, releasing its journal lock
+        writer._journal.close()
+        
+        self.assertEqual(recover_email_log_journals(), 5)
+        self.assertEqual(EmailLog.objects.filter(campaign=self.campaign, status='sent').count(), 5)
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+
+class CampaignCountersTestCase(TestCase):
+    def setUp(self):
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+        self.recipients = [
+            Recipient.objects.create(
+                email=f'user{i}@example.com',
+                name=f'User {i}',
+                recipient_list=self.recipient_list
+            )
+            for i in range(2)
+        ]
+        self.campaign = Campaign.objects.create(
+            name='Test Campaign',
+            subject='Test Subject',
+            content='Hello $name',
+            status='active',
+            recipient_list=self.recipient_list
+        )
+
+    def test_counters_updated_without_recount(self):
+        with self.assertNumQueries(2):  # insert, counter update
+            EmailLog.objects.create(campaign=self.campaign, recipient=self.recipients[0], status='sent')
+        EmailLog.objects.create(campaign=self.campaign, recipient=self.recipients[1], status='error')
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.emails_sent, 1)
+        self.assertEqual(self.campaign.emails_failed, 1)
+
+    def test_stale_save_keeps_counters(self):
+        stale = Campaign.objects.get(pk=self.campaign.pk)
+        Campaign.increment_counters(self.campaign.pk, sent=2)
+        
+        stale.name = 'Renamed'
+        stale.save()
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.name, 'Renamed')
+        self.assertEqual(self.campaign.emails_sent, 2)
+
+    def test_completion_decided_from_counters(self):
+        Campaign.increment_counters(self.campaign.pk, sent=1)
+        self.assertFalse(Campaign.complete_if_finished(self.campaign.pk))
+        
+        Campaign.increment_counters(self.campaign.pk, failed=1)
+        self.assertTrue(Campaign.complete_if_finished(self.campaign.pk))
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'completed')
+
+
+class CampaignListQueriesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpassword'
+        )
+        self.client.login(username='testuser', password='testpassword')
+
+    def create_campaign(self, index):
+        recipient_list = RecipientList.objects.create(name=f'List {index}')
+        recipient = Recipient.objects.create(
+            email=f'user{index}@example.com',
+            name=f'User {index}',
+            recipient_list=recipient_list
+        )
+        campaign = Campaign.objects.create(
+            name=f'Campaign {index}',
+            subject='Test Subject',
+            content='Hello $name',
+            recipient_list=recipient_list
+        )
+        EmailLog.objects.create(campaign=campaign, recipient=recipient, status='sent')
+        return campaign
+
+    def test_counters_rebuilt_from_logs(self):
+        campaign = self.create_campaign(0)
+        Campaign.objects.filter(pk=campaign.pk).update(emails_sent=42)
+        RecipientList.objects.filter(pk=campaign.recipient_list_id).update(recipient_count=0)
+        
+        call_command('rebuild_campaign_counters', stdout=io.StringIO())
+        
+        campaign = Campaign.objects.get(pk=campaign.pk)
+        self.assertEqual(campaign.sent_count, 1)
+        self.assertEqual(campaign.total_recipients, 1)
+        self.assertEqual(campaign.completion_percentage, 100)
+
+    def test_list_pages_query_count_is_constant(self):
+        self.create_campaign(0)
+        
+        for url in (reverse('campaign_list'), reverse('analytics')):
+            with CaptureQueriesContext(connection) as one_campaign:
+                self.client.get(url)
+            
+            for index in range(1, 6):
+                self.create_campaign(index)
+            with CaptureQueriesContext(connection) as more_campaigns:
+                response = self.client.get(url)
+            
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(one_campaign), len(more_campaigns), url)
+
+    def test_campaign_stats_annotations(self):
+        campaign = self.create_campaign(0)
+        for index in range(1, 4):
+            recipient = Recipient.objects.create(
+                email=f'extra{index}@example.com',
+                name=f'Extra {index}',
+                recipient_list=campaign.recipient_list
+            )
+            EmailLog.objects.create(campaign=campaign, recipient=recipient, status='error' if index == 3 else 'sent')
+        
+        with CaptureQueriesContext(connection) as queries:
+            annotated = annotate_campaign_stats(Campaign.objects.filter(pk=campaign.pk)).get()
+            self.assertEqual(annotated.recipient_list.name, 'List 0')
+        
+        # Served from the stored counters, without touching the email logs
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn(EmailLog._meta.db_table, queries[0]['sql'])
+        self.assertEqual(annotated.recipients_total, 4)
+        self.assertEqual(annotated.sent_total, 3)
+        self.assertEqual(annotated.errors_total, 1)
+        self.assertEqual(annotated.completion, 75)
+
+
+class DailyStatsTestCase(TestCase):
+    def setUp(self):
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+        self.campaign = Campaign.objects.create(
+            name='Test Campaign',
+            subject='Test Subject',
+            content='Hello $name',
+            recipient_list=self.recipient_list
+        )
+        self.count = 0
+
+    def log(self, sent_at, status='sent'):
+        self.count += 1
+        recipient = Recipient.objects.create(
+            email=f'user{self.count}@example.com',
+            name=f'User {self.count}',
+            recipient_list=self.recipient_list
+        )
+        EmailLog.objects.create(campaign=self.campaign, recipient=recipient, status=status, sent_at=sent_at)
+
+    def test_single_query_with_missing_days_filled(self):
+        today = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0)
+        self.log(today)
+        self.log(today, status='error')
+        self.log(today - timezone.timedelta(days=2))
+        self.log(today - timezone.timedelta(days=30))
+        
+        with self.assertNumQueries(1):
+            stats = get_daily_stats(days=3)
+        
+        self.assertEqual(stats['sent'], [1, 0, 1])
+        self.assertEqual(stats['errors'], [0, 0, 1])
+        self.assertEqual(len(stats['labels']), 3)
+
+    def test_days_bucketed_in_configured_time_zone(self):
+        # 23:30 UTC yesterday is already today in Moscow (UTC+3)
+        today = timezone.localdate()
+        yesterday = today - timedelta(days=1)
+        late_evening_utc = datetime(yesterday.year, yesterday.month, yesterday.day, 23, 30, tzinfo=dt_timezone.utc)
+        self.log(late_evening_utc)
+        
+        stats = get_daily_stats(days=2)
+        
+        self.assertEqual(stats['sent'], [0, 1])
+
+    def test_day_range_in_configured_time_zone(self):
+        start, end = local_day_range(datetime(2026, 3, 1).date())
+        
+        self.assertEqual(start, datetime(2026, 2, 28, 21, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(end - start, timedelta(days=1))
+
+    def test_daily_report_counts_yesterday(self):
+        yesterday = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        self.log(yesterday)
+        self.log(yesterday, status='error')
+        self.log(yesterday + timedelta(days=1))
+        
+        report = generate_daily_report()
+        
+        self.assertIn("Total emails sent: 1\n", report)
+        self.assertIn("Total errors: 1\n", report)
+        self.assertIn("- Test Campaign: Sent 1, Errors 1", report)
+
+    def test_days_capped(self):
+        self.assertEqual(len(get_daily_stats(days=100000)['labels']), MAX_DAILY_STATS_DAYS)
+        self.assertEqual(len(get_daily_stats(days=0)['labels']), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DashboardStatsTestCase(JournalDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+        self.recipients = [
+            Recipient.objects.create(email=f'user{i}@example.com', name=f'User {i}', recipient_list=self.recipient_list)
+            for i in range(3)
+        ]
+        self.campaign = Campaign.objects.create(
+            name='Test Campaign',
+            subject='Test Subject',
+            content='Hello $name',
+            status='active',
+            recipient_list=self.recipient_list
+        )
+        Campaign.objects.create(name='Draft', subject='Subject', content='Content', recipient_list=self.recipient_list)
+
+    def test_stats_computed_with_constant_queries_and_cached(self):
+        with EmailLogWriter(journal_dir=self.journal_dir) as writer:
+            writer.record(self.campaign.pk, self.recipients[0].pk, 'sent')
+            writer.record(self.campaign.pk, self.recipients[1].pk, 'error', 'Refused')
+        
+        with self.assertNumQueries(3):
+            stats = get_dashboard_stats()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dashboard_stats(), stats)
+        
+        self.assertEqual(stats['today_sent'], 1)
+        self.assertEqual(stats['today_errors'], 1)
+        self.assertEqual(stats['total_campaigns'], 2)
+        self.assertEqual(stats['total_recipients'], 3)
+        self.assertEqual(stats['total_sent'], 1)
+        self.assertEqual(stats['status_counts']['active'], 1)
+        self.assertEqual(stats['status_counts']['draft'], 1)
+        self.assertEqual(stats['status_counts']['paused'], 0)
+
+    def test_finished_batch_invalidates_stats(self):
+        self.assertEqual(get_dashboard_stats()['total_sent'], 0)
+        
+        with EmailLogWriter(journal_dir=self.journal_dir) as writer:
+            writer.record(self.campaign.pk, self.recipients[0].pk, 'sent')
+        
+        self.assertEqual(get_dashboard_stats()['total_sent'], 1)
+
+    def test_campaign_change_invalidates_stats_on_commit(self):
+        self.assertEqual(get_dashboard_stats()['status_counts']['paused'], 0)
+        
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.campaign.status = 'paused'
+            self.campaign.save()
+        
+        self.assertIn(invalidate_dashboard_stats, callbacks)
+        self.assertEqual(get_dashboard_stats()['status_counts']['paused'], 1)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:1/0',
+    }})
+    def test_stats_computed_when_cache_is_down(self):
+        with self.assertLogs('campaigns.utils', level='WARNING'):
+            stats = get_dashboard_stats()
+        
+        self.assertEqual(stats['total_campaigns'], 2)
+        self.assertEqual(stats['total_recipients'], 3)
+
+
+class RecipientImportTestCase(TestCase):
+    def setUp(self):
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+
+    def csv_file(self, rows, header='name,email'):
+        lines = [header] + rows
+        return io.BytesIO(('\r\n'.join(lines) + '\r\n').encode('utf-8'))
+
+    def test_rows_upserted_in_chunks(self):
+        Recipient.objects.create(email='user0@example.com', name='Old Name', recipient_list=self.recipient_list)
+        rows = [f'User {i},user{i}@example.com' for i in range(10)]
+        progress = []
+        
+        # Per chunk: lock, existing lookup, upsert, counter update and the savepoint pair
+        with self.assertNumQueries(3 * 6):
+            importer = RecipientImporter(
+                self.recipient_list, chunk_size=4,
+                progress=lambda importer: progress.append(importer.processed)
+            ).run(self.csv_file(rows))
+        
+        self.assertEqual(progress, [4, 8, 10])
+        self.assertEqual((importer.processed, importer.inserted, importer.updated, importer.rejected), (10, 9, 1, 0))
+        self.assertEqual(Recipient.objects.get(email='user0@example.com').name, 'User 0')
+        self.recipient_list.refresh_from_db()
+        self.assertEqual(self.recipient_list.recipient_count, 10)
+
+    def test_invalid_rows_rejected(self):
+        rows = [',missing-name@example.com', 'No Email,', 'Bad,not-an-email', 'Dup,dup@example.com', 'Dup Again,dup@example.com']
+        
+        success_count, error_count, error_messages = process_csv_file(self.csv_file(rows), self.recipient_list)
+        
+        self.assertEqual((success_count, error_count), (3, 2))
+        self.assertEqual(error_messages, ["Row 3: Email is required", "Row 4: Invalid email address: not-an-email"])
+        self.assertEqual(Recipient.objects.get(email='missing-name@example.com').name, 'missing-name')
+        self.assertEqual(Recipient.objects.get(email='dup@example.com').name, 'Dup Again')
+
+    def test_error_messages_capped(self):
+        rows = ['No Email,'] * (MAX_IMPORT_ERROR_MESSAGES + 5)
+        
+        importer = RecipientImporter(self.recipient_list).run(self.csv_file(rows))
+        
+        self.assertEqual(importer.rejected, MAX_IMPORT_ERROR_MESSAGES + 5)
+        self.assertEqual(len(importer.error_messages), MAX_IMPORT_ERROR_MESSAGES)
+
+    def test_missing_column_rejects_file(self):
+        success_count, error_count, error_messages = process_csv_file(
+            self.csv_file(['user@example.com'], header='email'), self.recipient_list
+        )
+        
+        self.assertEqual((success_count, error_count), (0, 1))
+        self.assertIn("CSV missing required fields: name", error_messages[0])
+        self.assertFalse(Recipient.objects.exists())
+
+    def test_byte_order_mark_and_multibyte_text(self):
+        csv_file = io.BytesIO('\ufeffname,email\nJosé,jose@example.com\n'.encode('utf-8'))
+        
+        RecipientImporter(self.recipient_list, chunk_size=1).run(csv_file)
+        
+        self.assertEqual(Recipient.objects.get(email='jose@example.com').name, 'José')
+        self.assertFalse(csv_file.closed)
+
+
+class RecipientImportJobTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        self.recipient_list = RecipientList.objects.create(name='Test List')
+        self.import_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.import_dir, ignore_errors=True)
+        settings_override = override_settings(RECIPIENT_IMPORT_DIR=self.import_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, content, name='recipients.csv'):
+        return SimpleUploadedFile(name, content.encode('utf-8'), content_type='text/csv')
+
+    def test_header_validation_reads_only_first_line(self):
+        csv_file = self.upload('email,phone\n' + 'user@example.com,1\n' * 1000)
+        csv_file.file = mock.Mock(wraps=csv_file.file)
+        form = CSVUploadForm(data={'recipient_list': self.recipient_list.pk}, files={'csv_file': csv_file})
+        
+        self.assertFalse(form.is_valid())
+        self.assertIn("CSV missing required fields: name", form.errors['csv_file'][0])
+        csv_file.file.read.assert_not_called()
+        csv_file.file.readline.assert_called_once_with()
+
+    def test_upload_queues_background_import(self):
+        with mock.patch.object(import_recipients, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('recipient_upload'), {
+                'recipient_list': self.recipient_list.pk,
+                'csv_file': self.upload('name,email\nUser,user@example.com\n'),
+            })
+        
+        recipient_import = RecipientImport.objects.get()
+        self.assertRedirects(response, reverse('recipient_import_detail', args=[recipient_import.id]))
+        delay.assert_called_once_with(str(recipient_import.id))
+        self.assertEqual(recipient_import.status, 'pending')
+        self.assertEqual(recipient_import.file_name, 'recipients.csv')
+        with open(recipient_import.file_path) as stored:
+            self.assertEqual(stored.read(), 'name,email\nUser,user@example.com\n')
+        self.assertFalse(Recipient.objects.exists())
+
+    @override_settings(RECIPIENT_IMPORT_CHUNK_SIZE=2)
+    def test_task_reports_progress(self):
+        Recipient.objects.create(email='user0@example.com', name='Old Name', recipient_list=self.recipient_list)
+        rows = ''.join(f'User {i},user{i}@example.com\n' for i in range(4))
+        recipient_import = create_recipient_import(self.upload('name,email\n' + rows + 'Bad,\n'), self.recipient_list)
+        progress = []
+        record_progress = RecipientImport.record_progress
+        
+        def spy(instance, importer, status=None):
+            record_progress(instance, importer, status)
+            progress.append(RecipientImport.objects.values_list('status', 'rows_processed').get(pk=instance.pk))
+        
+        with mock.patch.object(RecipientImport, 'record_progress', spy):
+            import_recipients(recipient_import.id)
+        
+        self.assertEqual(progress, [('running', 2), ('running', 4), ('running', 5), ('completed', 5)])
+        recipient_import.refresh_from_db()
+        self.assertEqual(
+            (recipient_import.rows_inserted, recipient_import.rows_updated, recipient_import.rows_rejected),
+            (3, 1, 1)
+        )
+        self.assertEqual(recipient_import.error_messages, ["Row 6: Email is required"])
+        self.assertIsNotNone(recipient_import.finished_at)
+        self.assertFalse(os.path.exists(recipient_import.file_path))
+        
+        response = self.client.get(reverse('recipient_import_status', args=[recipient_import.id]))
+        self.assertEqual(response.json()['inserted'], 3)
+        self.assertTrue(response.json()['finished'])
+        
+        # A redelivered task leaves a finished import alone
+        self.assertIn("already completed", import_recipients(recipient_import.id))
+
+    def test_task_marks_unreadable_file_failed(self):
+        recipient_import = create_recipient_import(self.upload('name,email\n'), self.recipient_list)
+        with open(recipient_import.file_path, 'wb') as stored:
+            stored.write(b'name,email\n\xff,user@example.com\n')
+        
+        import_recipients(recipient_import.id)
+        
+        recipient_import.refresh_from_db()
+        self.assertEqual(recipient_import.status, 'failed')
+        self.assertIn("Error processing CSV", recipient_import.error_messages[-1])
+        
+        response = self.client.get(reverse('recipient_import_detail', args=[recipient_import.id]))
+        self.assertContains(response, 'Failed')
+
+
+class RecipientDeduplicationTestCase(JournalDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.first_list = RecipientList.objects.create(name='First List')
+        self.second_list = RecipientList.objects.create(name='Second List')
+        for i in range(5):
+            Recipient.objects.create(email=f'user{i}@example.com', name=f'User {i}', recipient_list=self.first_list)
+        for i in range(3, 8):
+            Recipient.objects.create(email=f' User{i}@Example.com', name=f'User {i}', recipient_list=self.second_list)
+        self.first = self.campaign(self.first_list)
+        self.second = self.campaign(self.second_list)
+
+    def campaign(self, recipient_list, **kwargs):
+        fields = {'name': recipient_list.name, 'subject': 'Offer', 'content': 'Hello $name', 'status': 'active'}
+        fields.update(kwargs)
+        return Campaign.objects.create(recipient_list=recipient_list, **fields)
+
+    def test_email_normalized_on_save_and_unique_per_list(self):
+        recipient = Recipient.objects.get(recipient_list=self.second_list, email_normalized='user3@example.com')
+        self.assertEqual(recipient.email, ' User3@Example.com')
+        
+        with self.assertRaises(IntegrityError):
+            Recipient.objects.create(email='USER3@example.com ', name='Again', recipient_list=self.second_list)
+
+    def test_import_matches_existing_recipients_ignoring_case(self):
+        csv_file = io.BytesIO(b'name,email\nRenamed,user3@EXAMPLE.com\nNew,New@example.com\nNew Again,new@example.com \n')
+        
+        importer = RecipientImporter(self.second_list).run(csv_file)
+        
+        self.assertEqual((importer.inserted, importer.updated), (1, 2))
+        self.assertEqual(Recipient.objects.get(recipient_list=self.second_list, email_normalized='user3@example.com').name, 'Renamed')
+        self.assertEqual(Recipient.objects.get(recipient_list=self.second_list, email_normalized='new@example.com').email, 'new@example.com')
+
+    def log(self, campaign, addresses, status='sent'):
+        for recipient in Recipient.objects.filter(recipient_list=campaign.recipient_list, email_normalized__in=addresses):
+            EmailLog.objects.create(campaign=campaign, recipient=recipient, status=status)
+
+    def test_later_campaign_skips_addresses_sent_by_earlier_one(self):
+        self.assertEqual(skip_duplicate_recipients(self.first), 0)
+        self.log(self.first, ['user3@example.com'])
+        self.log(self.first, ['user4@example.com'], status='error')
+        
+        # Claim, one semi-join, then one bulk write per chunk of duplicates
+        with self.assertNumQueries(11):
+            self.assertEqual(skip_duplicate_recipients(self.second), 1)
+        
+        # Only addresses the earlier campaign actually sent to are skipped
+        skipped = set(EmailLog.objects.filter(campaign=self.second, status='skipped').values_list('recipient__email_normalized', flat=True))
+        self.assertEqual(skipped, {'user3@example.com'})
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.emails_skipped, 1)
+        self.assertIsNotNone(self.second.started_at)
+        
+        # Deduplication runs once per campaign
+        self.assertEqual(skip_duplicate_recipients(self.second), 0)
+        self.assertEqual(EmailLog.objects.filter(campaign=self.second).count(), 1)
+
+    def test_only_sends_of_the_same_message_count(self):
+        other_message = self.campaign(self.first_list, content='Something else')
+        self.log(other_message, ['user3@example.com'])
+        listed_only = self.campaign(self.first_list)
+        Campaign.objects.filter(pk=listed_only.pk).update(started_at=timezone.now(), status='paused')
+        
+        self.assertEqual(skip_duplicate_recipients(self.second), 0)
+        
+        # A sibling cancelled after sending still reached the address
+        cancelled = self.campaign(self.first_list, status='cancelled')
+        self.log(cancelled, ['user3@example.com', 'user4@example.com'])
+        Campaign.objects.filter(pk=self.second.pk).update(started_at=None)
+        self.assertEqual(skip_duplicate_recipients(self.second), 2)
+
+    def test_batch_skips_addresses_a_sibling_sent_after_start(self):
+        skip_duplicate_recipients(self.first)
+        skip_duplicate_recipients(self.second)
+        self.log(self.first, ['user4@example.com'])
+        batch = list(Recipient.objects.filter(recipient_list=self.second_list).order_by('email_normalized'))
+        
+        remaining, skipped = skip_recipients_sent_by_siblings(self.second, batch)
+        
+        self.assertEqual([r.email_normalized for r in remaining], ['user3@example.com', 'user5@example.com', 'user6@example.com', 'user7@example.com'])
+        self.assertEqual(EmailLog.objects.get(campaign=self.second, status='skipped').recipient_id, skipped.pop())
+
+    def test_skipped_recipients_count_towards_completion(self):
+        skip_duplicate_recipients(self.first)
+        self.log(self.first, ['user3@example.com', 'user4@example.com'])
+        skip_duplicate_recipients(self.second)
+        self.log(self.second, ['user5@example.com', 'user6@example.com', 'user7@example.com'])
+        
+        self.assertTrue(Campaign.complete_if_finished(self.second.pk))
+        self.assertEqual(get_campaign_stats(Campaign.objects.get(pk=self.second.pk))['remaining'], 0)
+
+
+class NormalizeEmailsMigrationTestCase(TransactionTestCase):
+    migrate_from = [('campaigns', '0005_recipient_import')]
+    migrate_to = [('campaigns', '0006_recipient_email_normalized')]
+
+    def setUp(self):
+        self.addCleanup(self.migrate_to_latest)
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.apps = executor.loader.project_state(self.migrate_from).apps
+
+    def migrate_to_latest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_send_history_moved_to_kept_recipient(self):
+        RecipientList = self.apps.get_model('campaigns', 'RecipientList')
+        Recipient = self.apps.get_model('campaigns', 'Recipient')
+        Campaign = self.apps.get_model('campaigns', 'Campaign')
+        EmailLog = self.apps.get_model('campaigns', 'EmailLog')
+        recipient_list = RecipientList.objects.create(name='Test List')
+        kept = Recipient.objects.create(email='User@Example.com', name='User', recipient_list=recipient_list)
+        duplicate = Recipient.objects.create(email='user@example.com ', name='User', recipient_list=recipient_list)
+        both = Campaign.objects.create(name='Both', subject='Offer', content='Hello', recipient_list=recipient_list)
+        duplicate_only = Campaign.objects.create(name='Duplicate', subject='Offer', content='Hello', recipient_list=recipient_list)
+        EmailLog.objects.create(campaign=both, recipient=kept, status='error', error_message='Refused')
+        EmailLog.objects.create(campaign=both, recipient=duplicate, status='sent')
+        EmailLog.objects.create(campaign=duplicate_only, recipient=duplicate, status='sent')
+        
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        apps = executor.loader.project_state(self.migrate_to).apps
+        Recipient = apps.get_model('campaigns', 'Recipient')
+        Campaign = apps.get_model('campaigns', 'Campaign')
+        EmailLog = apps.get_model('campaigns', 'EmailLog')
+        
+        self.assertEqual(list(Recipient.objects.values_list('pk', flat=True)), [kept.pk])
+        self.assertEqual(
+            set(EmailLog.objects.values_list('campaign_id', 'recipient_id', 'status')),
+            {(both.pk, kept.pk, 'sent'), (duplicate_only.pk, kept.pk, 'sent')}
+        )
+        self.assertEqual(Campaign.objects.get(pk=both.pk).emails_sent, 1)
+        self.assertEqual(Campaign.objects.get(pk=both.pk).emails_failed, 0)
+        self.assertEqual(Campaign.objects.get(pk=duplicate_only.pk).emails_sent, 1)
@@ -0,0 +1,161 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .sending import take_token
+from .smtp_pool import CONNECTION_ERRORS, get_smtp_pool
+from .throttle import is_deferral
+
+logger = logging.getLogger(__name__)
+
+# Seconds the coordinating thread waits for an outcome before checking on the workers
+RESULT_POLL_INTERVAL = 0.2
+
+
+class ThreadedSender:
+    """
+    Sends a batch from a bounded thread pool, one SMTP session per thread
+
+    Each thread checks its own session out of the process's SMTP pool and
+    takes the next recipient from a shared queue as soon as its previous
+    message is accepted. Outcomes are handed back to the calling thread,
+    which is the only one touching the log writer and the database.
+
+    Sending stops at the first deferral the recipient should be retried
+    for, or when the rate limits ask for a longer pause; messages already
+    in flight on other threads finish. If the calling thread is interrupted
+    (e.g. by the task's soft time limit), the threads are told to stop, the
+    pool is shut down once in-flight messages are done, their outcomes are
+    recorded and the exception is re-raised.
+    """
+
+    def __init__(self, campaign, renderer, throttle, rate_limiter, log_writer, outcome, threads=None, smtp_pool=None):
+        self.campaign = campaign
+        self.renderer = renderer
+        self.throttle = throttle
+        self.rate_limiter = rate_limiter
+        self.log_writer = log_writer
+        self.outcome = outcome
+        self.threads = threads or settings.SMTP_SEND_THREADS
+        self.smtp_pool = smtp_pool or get_smtp_pool()
+        self._stopped = threading.Event()
+
+    def _send(self, smtp_server, recipient, results):
+        """Send to one recipient; returns False when the batch should stop"""
+        try:
+            message = self.renderer.render(recipient)
+            smtp_server.sendmail(
+                message.from_addr,
+                message.to_addrs,
+                message.data,
+                message.mail_options
+            )
+            results.put(('sent', recipient, None))
+
+        except Exception as e:
+            if is_deferral(e) and self.throttle.should_retry(self.campaign.id, recipient.id):
+                logger.warning(f"Sending to {recipient.email} deferred: {str(e)}")
+                results.put(('deferred', recipient, None))
+                return False
+
+            logger.error(f"Error sending to {recipient.email}: {str(e)}")
+            results.put(('error', recipient, str(e)))
+            if isinstance(e, CONNECTION_ERRORS):
+                raise
+        return True
+
+    def _worker(self, recipients, results):
+        smtp_server = None
+        connection_broken = False
+        try:
+            while not self._stopped.is_set() and not recipients.empty():
+                wait = take_token(self.rate_limiter)
+                if wait:
+                    logger.info(f"Send rate limit reached, next token in {wait:.1f}s")
+                    results.put(('rate_limited', None, wait))
+                    self._stopped.set()
+                    return
+                if self._stopped.is_set():
+                    return
+                try:
+                    recipient = recipients.get_nowait()
+                except queue.Empty:
+                    return
+
+                if smtp_server is None:
+                    smtp_server = self.smtp_pool.acquire()
+                try:
+                    if not self._send(smtp_server, recipient, results):
+                        self._stopped.set()
+                except CONNECTION_ERRORS:
+                    # The pooled session reconnects for the next message
+                    connection_broken = True
+        finally:
+            if smtp_server is not None:
+                self.smtp_pool.release(smtp_server, discard=connection_broken)
+
+    def _record(self, result):
+        status, recipient, detail = result
+        if status == 'rate_limited':
+            self.outcome.rate_limited_for = max(self.outcome.rate_limited_for, detail)
+        elif status == 'deferred':
+            self.outcome.deferred += 1
+        else:
+            self.log_writer.record(self.campaign.id, recipient.id, status, detail)
+            if status == 'sent':
+                self.outcome.sent += 1
+            else:
+                self.outcome.errors += 1
+            self.outcome.done.add(recipient.id)
+
+    def _drain(self, results):
+        while True:
+            try:
+                self._record(results.get_nowait())
+            except queue.Empty:
+                return
+
+    def run(self, recipients):
+        pending = queue.Queue()
+        for recipient in recipients:
+            pending.put_nowait(recipient)
+        results = queue.Queue()
+        threads = min(self.threads, len(recipients))
+        if not threads:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='smtp-sender')
+        try:
+            workers = [executor.submit(self._worker, pending, results) for _ in range(threads)]
+            while not all(worker.done() for worker in workers):
+                try:
+                    self._record(results.get(timeout=RESULT_POLL_INTERVAL))
+                except queue.Empty:
+                    pass
+        except BaseException:
+            self._stopped.set()
+            logger.warning(f"Stopping SMTP sender threads for campaign {self.campaign.id}")
+            raise
+        finally:
+            # Let in-flight messages finish and keep their outcomes
+            executor.shutdown(wait=True, cancel_futures=True)
+            self._drain(results)
+
+        # A worker that couldn't open a session fails the batch like the blocking loop does
+        for worker in workers:
+            worker.result()
+
+
+def send_threaded(campaign, recipients, renderer, throttle, rate_limiter, log_writer, outcome, threads=None, smtp_pool=None):
+    """
+    Send a batch with ThreadedSender; same arguments as send_serial()
+
+    Args:
+        threads: Sender threads, defaults to SMTP_SEND_THREADS
+        smtp_pool: SMTPConnectionPool to check sessions out of
+    """
+    sender = ThreadedSender(campaign, renderer, throttle, rate_limiter, log_writer, outcome, threads, smtp_pool)
+    sender.run(recipients)
@@ -0,0 +1,192 @@
+import logging
+import smtplib
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+THROUGHPUT_STATE_CACHE_KEY = 'smtp_throughput:{provider}'
+CONCURRENCY_SLOT_CACHE_KEY = 'smtp_slot:{provider}:{slot}'
+DEFERRAL_CACHE_KEY = 'smtp_deferrals:{campaign_id}:{recipient_id}'
+
+# Additive increase per clean batch and multiplicative decrease per deferring
+# batch, as fractions of the configured rate
+RATE_INCREASE = 0.1
+RATE_DECREASE = 0.5
+MIN_RATE_FRACTION = 0.05
+
+# Weight of the newest batch in the latency average
+LATENCY_SMOOTHING = 0.3
+
+# How long adaptive state and slot leases live without being refreshed
+STATE_TIMEOUT = 24 * 60 * 60  # seconds
+SLOT_TIMEOUT = 15 * 60  # seconds
+
+# Seconds before a task retries when every concurrency slot is taken
+SLOT_RETRY_DELAY = 10
+
+ProviderLimits = namedtuple('ProviderLimits', ['rate', 'burst', 'max_concurrency'])
+BatchPlan = namedtuple('BatchPlan', ['size', 'rate'])
+
+
+def get_provider_limits(provider=None):
+    """
+    Get the configured throughput for an SMTP provider
+
+    Args:
+        provider: SMTP host, defaults to EMAIL_HOST
+
+    Returns:
+        ProviderLimits: Messages per second, burst size and maximum concurrency
+    """
+    provider = provider or settings.EMAIL_HOST
+    limits = settings.SMTP_PROVIDER_THROUGHPUT.get(provider, settings.SMTP_PROVIDER_THROUGHPUT['default'])
+    return ProviderLimits(float(limits['rate']), int(limits['burst']), int(limits['max_concurrency']))
+
+
+def is_deferral(exc):
+    """Whether a send error is a temporary (4xx) rejection worth retrying later"""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exc.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 400 <= exc.smtp_code < 500
+    return False
+
+
+class ThroughputController:
+    """
+    Adapts batch size and inter-batch delay to how the SMTP provider behaves
+
+    The send rate starts at the provider's configured rate. It is halved
+    after a batch that was deferred (4xx) and grows back by a tenth of the
+    configured rate after every clean batch. Batches are at most ``burst``
+    messages and are shrunk when SMTP latency would make them run longer
+    than SMTP_BATCH_MAX_SECONDS. The delay before the next batch spreads the
+    provider's rate over the tasks currently sending.
+
+    The rate and latency average are shared by all workers through the
+    cache. Concurrent updates may overwrite each other, which only makes
+    the adaptation slightly slower. When the cache is unavailable the
+    configured limits are used as they are.
+    """
+
+    def __init__(self, provider=None, limits=None):
+        self.provider = provider or settings.EMAIL_HOST
+        self.limits = limits or get_provider_limits(self.provider)
+        self._state_key = THROUGHPUT_STATE_CACHE_KEY.format(provider=self.provider)
+        self._slot_keys = [
+            CONCURRENCY_SLOT_CACHE_KEY.format(provider=self.provider, slot=slot)
+            for slot in range(self.limits.max_concurrency)
+        ]
+
+    def _load_state(self):
+        try:
+            state = cache.get(self._state_key)
+        except Exception as e:
+            logger.warning(f"Could not load SMTP throughput state: {str(e)}")
+            state = None
+        return state or {'rate': self.limits.rate, 'latency': None}
+
+    def _save_state(self, state):
+        try:
+            cache.set(self._state_key, state, timeout=STATE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Could not store SMTP throughput state: {str(e)}")
+
+    def acquire_slot(self):
+        """
+        Take one of the provider's concurrency slots
+
+        Slots are cache entries that expire on their own, so a worker that
+        dies while sending frees its slot after SLOT_TIMEOUT.
+
+        Returns:
+            str: Slot to pass to release_slot(), '' if the cache is
+            unavailable, or None when all slots are taken
+        """
+        try:
+            for key in self._slot_keys:
+                if cache.add(key, 1, timeout=SLOT_TIMEOUT):
+                    return key
+        except Exception as e:
+            logger.warning(f"Could not acquire SMTP concurrency slot: {str(e)}")
+            return ''
+        return None
+
+    def release_slot(self, slot):
+        if slot:
+            try:
+                cache.delete(slot)
+            except Exception as e:
+                logger.warning(f"Could not release SMTP concurrency slot: {str(e)}")
+
+    def _active_senders(self):
+        try:
+            return max(len(cache.get_many(self._slot_keys)), 1)
+        except Exception:
+            return 1
+
+    def plan_batch(self):
+        """
+        Decide how many messages the next batch sends
+
+        Returns:
+            BatchPlan: Batch size and the current provider rate
+        """
+        state = self._load_state()
+        size = self.limits.burst
+        if state['latency']:
+            size = min(size, int(settings.SMTP_BATCH_MAX_SECONDS / state['latency']))
+        return BatchPlan(max(size, 1), state['rate'])
+
+    def record_batch(self, sent, deferred, elapsed):
+        """
+        Adapt to a finished batch and get the delay before the next one
+
+        Args:
+            sent: Messages the server accepted or rejected permanently
+            deferred: Messages the server deferred with a 4xx reply
+            elapsed: Seconds spent sending the batch
+
+        Returns:
+            float: Seconds to wait before the next batch
+        """
+        state = self._load_state()
+        if sent:
+            latency = elapsed / (sent + deferred)
+            state['latency'] = latency if state['latency'] is None else (
+                LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * state['latency']
+            )
+
+        if deferred:
+            state['rate'] = max(state['rate'] * RATE_DECREASE, self.limits.rate * MIN_RATE_FRACTION)
+            logger.warning(f"SMTP provider {self.provider} deferred {deferred} messages, slowing to {state['rate']:.2f}/s")
+        elif sent:
+            state['rate'] = min(state['rate'] + self.limits.rate * RATE_INCREASE, self.limits.rate)
+        self._save_state(state)
+
+        if not sent and not deferred:
+            return 0
+        # Space batches so that all active senders together stay at the rate
+        share = state['rate'] / self._active_senders()
+        return max((sent + deferred) / share - elapsed, 0)
+
+    def should_retry(self, campaign_id, recipient_id):
+        """
+        Count a deferral for a recipient
+
+        Returns:
+            bool: True if the recipient should be retried later, False once it
+            has been deferred SMTP_MAX_DEFERRALS times
+        """
+        key = DEFERRAL_CACHE_KEY.format(campaign_id=campaign_id, recipient_id=recipient_id)
+        try:
+            cache.add(key, 0, timeout=STATE_TIMEOUT)
+            attempts = cache.incr(key)
+        except Exception as e:
+            logger.warning(f"Could not count SMTP deferral: {str(e)}")
+            return False
+        return attempts < settings.SMTP_MAX_DEFERRALS
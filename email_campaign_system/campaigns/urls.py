@@ -24,6 +24,7 @@ urlpatterns = [
     path('recipients/lists/', views.recipient_list_create, name='recipient_list_create'),
     path('recipients/lists/<uuid:list_id>/', views.recipient_list_detail, name='recipient_list_detail'),
     path('recipients/upload/', views.recipient_upload, name='recipient_upload'),
+    path('recipients/imports/<uuid:import_id>/', views.recipient_import_detail, name='recipient_import_detail'),
     path('recipients/lists/<uuid:list_id>/delete/', views.recipient_list_delete, name='recipient_list_delete'),
     
     # Logs and analytics
@@ -33,4 +34,5 @@ urlpatterns = [
     # API endpoints for charts
     path('api/campaign-stats/<uuid:campaign_id>/', views.campaign_stats, name='campaign_stats'),
     path('api/daily-stats/', views.daily_stats, name='daily_stats'),
+    path('api/recipient-imports/<uuid:import_id>/', views.recipient_import_status, name='recipient_import_status'),
 ]
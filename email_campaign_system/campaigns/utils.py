@@ -1,12 +1,13 @@
-import csv
-import io
 import logging
 import base64
 import json
-from datetime import datetime, timedelta
+import secrets
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
 
+import redis
 from django.conf import settings
-from django.db import transaction
+from django.core.cache import cache
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import Flow
@@ -14,10 +15,29 @@ from googleapiclient.discovery import build
 
 logger = logging.getLogger(__name__)
 
+OAUTH2_TOKEN_CACHE_KEY = 'gmail_oauth2_token'
+OAUTH2_REFRESH_LOCK_KEY = 'email_campaign:gmail_oauth2_token_refresh_lock'
+OAUTH2_REFRESH_LOCK_TIMEOUT = 30  # seconds
+
+# Deletes the refresh lock only if it still holds the caller's token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Upper limit for the number of days returned by get_daily_stats
+MAX_DAILY_STATS_DAYS = 366
+
+DASHBOARD_STATS_CACHE_KEY = 'dashboard_stats'
+
 def process_csv_file(csv_file, recipient_list):
     """
     Process uploaded CSV file and create recipients
     
+    Rows are streamed and upserted in chunks, see RecipientImporter.
+    
     Args:
         csv_file: File object containing CSV data
         recipient_list: RecipientList object to associate recipients with
@@ -25,82 +45,149 @@ def process_csv_file(csv_file, recipient_list):
     Returns:
         tuple: (success_count, error_count, error_messages)
     """
-    from .models import Recipient
-    
-    success_count = 0
-    error_count = 0
-    error_messages = []
+    from .importer import RecipientImporter
     
+    importer = RecipientImporter(recipient_list)
     try:
-        # Read CSV file
-        csv_data = csv_file.read().decode('utf-8')
-        csv_io = io.StringIO(csv_data)
-        reader = csv.DictReader(csv_io)
-        
-        with transaction.atomic():
-            for row in reader:
-                try:
-                    email = row.get('email', '').strip()
-                    name = row.get('name', '').strip()
-                    
-                    # Validate data
-                    if not email:
-                        error_count += 1
-                        error_messages.append(f"Row {reader.line_num}: Email is required")
-                        continue
-                    
-                    # Create or update recipient
-                    recipient, created = Recipient.objects.update_or_create(
-                        email=email,
-                        recipient_list=recipient_list,
-                        defaults={'name': name or email.split('@')[0]}
-                    )
-                    
-                    success_count += 1
-                    
-                except Exception as e:
-                    error_count += 1
-                    error_messages.append(f"Row {reader.line_num}: {str(e)}")
-                    
-        return success_count, error_count, error_messages
-        
+        importer.run(csv_file)
     except Exception as e:
         logger.error(f"Error processing CSV: {str(e)}")
-        return 0, 1, [f"Error processing CSV: {str(e)}"]
+        return importer.inserted + importer.updated, importer.rejected + 1, importer.error_messages + [f"Error processing CSV: {str(e)}"]
+    
+    return importer.inserted + importer.updated, importer.rejected, importer.error_messages
 
 def get_gmail_oauth2_credentials():
     """
-    Get Gmail OAuth2 credentials using the refresh token
+    Get a Gmail OAuth2 access token, refreshing it only when needed
+    
+    The token is cached in the shared cache so that every worker process
+    reuses it. It is refreshed shortly before it expires, and only by the
+    process that holds the refresh lock; other processes keep using the
+    current token while it is still valid. If Redis is unavailable the token
+    is refreshed directly.
     
     Returns:
-        dict: Dictionary containing access token
+        dict: Dictionary containing access token and its expiry timestamp
     """
-    try:
-        # If no refresh token, return empty dict
-        if not settings.GOOGLE_REFRESH_TOKEN:
+    # If no refresh token, return empty dict
+    if not settings.GOOGLE_REFRESH_TOKEN:
+        return {}
+    
+    margin = settings.GOOGLE_TOKEN_REFRESH_MARGIN
+    cached = _get_cached_token()
+    if _token_valid_for(cached, margin):
+        return cached
+    
+    client = get_oauth2_lock_redis()
+    deadline = time.time() + OAUTH2_REFRESH_LOCK_TIMEOUT
+    lock_token = secrets.token_hex(16)
+    while True:
+        try:
+            locked = client.set(OAUTH2_REFRESH_LOCK_KEY, lock_token, nx=True, ex=OAUTH2_REFRESH_LOCK_TIMEOUT)
+        except redis.RedisError as e:
+            logger.warning(f"Could not take the Gmail OAuth2 refresh lock, refreshing without it: {str(e)}")
+            return refresh_gmail_access_token() or (cached if _token_valid_for(cached) else {})
+        
+        if locked:
+            try:
+                # Another process may have refreshed while we waited for the lock
+                cached = _get_cached_token()
+                if _token_valid_for(cached, margin):
+                    return cached
+                return refresh_gmail_access_token() or (cached if _token_valid_for(cached) else {})
+            finally:
+                _release_refresh_lock(client, lock_token)
+        
+        # Another process is refreshing; keep using the current token while it is valid
+        if _token_valid_for(cached):
+            return cached
+        
+        if time.time() >= deadline:
+            logger.warning("Timed out waiting for Gmail OAuth2 token refresh")
             return {}
-            
+        time.sleep(0.1)
+        cached = _get_cached_token()
+
+_lock_client = None
+
+def get_oauth2_lock_redis():
+    """Get the Redis client holding the token refresh lock, created on first use"""
+    global _lock_client
+    if _lock_client is None:
+        _lock_client = redis.Redis.from_url(settings.OAUTH2_LOCK_REDIS_URL)
+    return _lock_client
+
+def _release_refresh_lock(client, lock_token):
+    """
+    Release the token refresh lock if the caller still holds it
+    
+    A refresh that outlives OAUTH2_REFRESH_LOCK_TIMEOUT may find the lock
+    taken over by another process, whose lock must be left alone, so the
+    check and the delete run as one script.
+    """
+    try:
+        client.eval(RELEASE_LOCK_SCRIPT, 1, OAUTH2_REFRESH_LOCK_KEY, lock_token)
+    except redis.RedisError as e:
+        # The lock expires on its own
+        logger.warning(f"Could not release the Gmail OAuth2 refresh lock: {str(e)}")
+
+def _get_cached_token():
+    """Get the cached access token, or None if there is none or the cache is unavailable"""
+    try:
+        return cache.get(OAUTH2_TOKEN_CACHE_KEY)
+    except Exception as e:
+        logger.warning(f"Could not read the cached Gmail OAuth2 token: {str(e)}")
+        return None
+
+def _token_valid_for(token, seconds=0):
+    """Check that a cached token is still valid for at least the given number of seconds"""
+    return bool(token) and token['expires_at'] - time.time() > seconds
+
+def refresh_gmail_access_token():
+    """
+    Exchange the refresh token for a new access token and cache it
+    
+    Returns:
+        dict: Dictionary containing access token and its expiry timestamp,
+        or an empty dict if the refresh failed
+    """
+    try:
         # Create credentials object
         credentials = Credentials(
             None,  # No access token initially
             refresh_token=settings.GOOGLE_REFRESH_TOKEN,
             client_id=settings.GOOGLE_CLIENT_ID,
             client_secret=settings.GOOGLE_CLIENT_SECRET,
-            token_uri='https://oauth2.googleapis.com/token',
+            token_uri=settings.GOOGLE_TOKEN_URI,
             scopes=['https://mail.google.com/']
         )
         
         # Refresh the token
         credentials.refresh(Request())
         
-        return {
-            'access_token': credentials.token,
-            'expires_in': credentials.expiry.timestamp() if credentials.expiry else None
-        }
-        
     except Exception as e:
         logger.error(f"Error getting Gmail OAuth2 credentials: {str(e)}")
         return {}
+    
+    # google-auth reports expiry as a naive UTC datetime
+    if credentials.expiry:
+        expires_at = credentials.expiry.replace(tzinfo=dt_timezone.utc).timestamp()
+    else:
+        expires_at = time.time() + 3600
+    
+    token = {
+        'access_token': credentials.token,
+        'expires_at': expires_at,
+    }
+    timeout = int(expires_at - time.time())
+    if timeout > 0:
+        try:
+            cache.set(OAUTH2_TOKEN_CACHE_KEY, token, timeout=timeout)
+        except Exception as e:
+            logger.warning(f"Could not cache the Gmail OAuth2 token: {str(e)}")
+    
+    logger.info("Refreshed Gmail OAuth2 access token")
+    return token
 
 def format_template_content(content, recipient):
     """
@@ -113,13 +200,8 @@ def format_template_content(content, recipient):
     Returns:
         str: Formatted content
     """
-    from string import Template
-    template = Template(content)
-    context = {
-        'name': recipient.name,
-        'email': recipient.email,
-    }
-    return template.safe_substitute(context)
+    from .templating import compile_template, recipient_context
+    return compile_template(content).render(recipient_context(recipient))
 
 def get_campaign_stats(campaign):
     """
@@ -131,37 +213,103 @@ def get_campaign_stats(campaign):
     Returns:
         dict: Campaign statistics
     """
-    from .models import EmailLog
-    
-    sent_count = EmailLog.objects.filter(campaign=campaign, status='sent').count()
-    error_count = EmailLog.objects.filter(campaign=campaign, status='error').count()
-    total_recipients = campaign.recipient_list.recipients.count()
-    remaining = total_recipients - (sent_count + error_count)
+    sent_count = campaign.sent_count
+    error_count = campaign.error_count
+    skipped_count = campaign.skipped_count
+    total_recipients = campaign.total_recipients
+    remaining = campaign.remaining_count
     
     return {
         'sent': sent_count,
         'errors': error_count,
+        'skipped': skipped_count,
         'total': total_recipients,
         'remaining': remaining,
         'completion_percentage': int((sent_count / total_recipients) * 100) if total_recipients > 0 else 0
     }
 
+def annotate_campaign_stats(queryset):
+    """
+    Annotate campaigns with their recipient, sent and error counts in one query
+    
+    The counts are read from the stored campaign counters and the recipient
+    list's recipient_count, so listing campaigns never joins the email logs.
+    
+    Args:
+        queryset: Campaign queryset
+    
+    Returns:
+        QuerySet: Campaigns with recipients_total, sent_total, errors_total
+        and completion annotations
+    """
+    from django.db.models import Case, F, IntegerField, Value, When
+    
+    return queryset.select_related('recipient_list').annotate(
+        recipients_total=F('recipient_list__recipient_count'),
+        sent_total=F('emails_sent'),
+        errors_total=F('emails_failed'),
+    ).annotate(
+        completion=Case(
+            When(recipients_total=0, then=Value(0)),
+            default=F('sent_total') * 100 / F('recipients_total'),
+            output_field=IntegerField()
+        )
+    )
+
+def local_day_range(day):
+    """
+    Get the bounds of a calendar day in the configured TIME_ZONE
+    
+    Filtering on ``sent_at__gte=start, sent_at__lt=end`` instead of
+    ``sent_at__date=day`` lets the database use the indexes on sent_at.
+    
+    Args:
+        day: Date to get the bounds for
+    
+    Returns:
+        tuple: Aware start (inclusive) and end (exclusive) datetimes
+    """
+    from django.utils import timezone
+    
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+    return start, end
+
 def get_daily_stats(days=7):
     """
     Get email statistics for the last n days
     
+    Days are bucketed in the configured TIME_ZONE and counted with a single
+    grouped query; days without any email are filled in with zeros.
+    
     Args:
-        days: Number of days to include in statistics
+        days: Number of days to include in statistics, capped at MAX_DAILY_STATS_DAYS
     
     Returns:
         dict: Daily statistics
     """
     from .models import EmailLog
-    from django.db.models import Count
+    from django.db.models import Count, Q
+    from django.db.models.functions import TruncDate
     from django.utils import timezone
     
-    end_date = timezone.now().date()
+    days = max(1, min(days, MAX_DAILY_STATS_DAYS))
+    
+    end_date = timezone.localdate()
     start_date = end_date - timedelta(days=days-1)
+    start, _ = local_day_range(start_date)
+    _, end = local_day_range(end_date)
+    
+    daily_counts = EmailLog.objects.filter(
+        sent_at__gte=start,
+        sent_at__lt=end
+    ).annotate(
+        day=TruncDate('sent_at', tzinfo=timezone.get_current_timezone())
+    ).values('day').annotate(
+        sent=Count('id', filter=Q(status='sent')),
+        errors=Count('id', filter=Q(status='error'))
+    ).order_by()
+    counts_by_day = {row['day']: row for row in daily_counts}
     
     # Initialize result with all dates
     result = {
@@ -170,16 +318,76 @@ def get_daily_stats(days=7):
         'errors': []
     }
     
-    # Create a dictionary for each date
     current_date = start_date
     while current_date <= end_date:
+        counts = counts_by_day.get(current_date, {})
         result['labels'].append(current_date.strftime('%b %d'))
-        
-        # Get logs for this date
-        day_logs = EmailLog.objects.filter(sent_at__date=current_date)
-        result['sent'].append(day_logs.filter(status='sent').count())
-        result['errors'].append(day_logs.filter(status='error').count())
-        
+        result['sent'].append(counts.get('sent', 0))
+        result['errors'].append(counts.get('errors', 0))
         current_date += timedelta(days=1)
     
     return result
+
+def get_dashboard_stats():
+    """
+    Get the dashboard statistics, served from the cache when possible
+    
+    Campaign status counts and the sent total come from one grouped query
+    over the campaign counters, today's outcomes from one conditional
+    aggregate. The result is cached for DASHBOARD_STATS_CACHE_TIMEOUT seconds
+    and dropped by invalidate_dashboard_stats() when a batch finishes or a
+    campaign changes.
+    
+    Returns:
+        dict: Dashboard statistics
+    """
+    from .models import Campaign, EmailLog, RecipientList
+    from django.db.models import Count, Q, Sum
+    from django.utils import timezone
+    
+    today = timezone.localdate()
+    cache_key = f"{DASHBOARD_STATS_CACHE_KEY}:{today.isoformat()}"
+    try:
+        stats = cache.get(cache_key)
+    except Exception as e:
+        # The cache is only an optimization; compute the stats without it
+        logger.warning(f"Could not read cached dashboard stats: {str(e)}")
+        stats = None
+    if stats is not None:
+        return stats
+    
+    status_counts = {status: 0 for status, _ in Campaign.STATUS_CHOICES}
+    total_sent = 0
+    for row in Campaign.objects.values('status').annotate(total=Count('id'), sent=Sum('emails_sent')).order_by():
+        status_counts[row['status']] = row['total']
+        total_sent += row['sent'] or 0
+    
+    today_start, today_end = local_day_range(today)
+    today_counts = EmailLog.objects.filter(sent_at__gte=today_start, sent_at__lt=today_end).aggregate(
+        sent=Count('id', filter=Q(status='sent')),
+        errors=Count('id', filter=Q(status='error'))
+    )
+    
+    stats = {
+        'today_sent': today_counts['sent'],
+        'today_errors': today_counts['errors'],
+        'total_campaigns': sum(status_counts.values()),
+        'total_recipients': RecipientList.objects.aggregate(total=Sum('recipient_count'))['total'] or 0,
+        'total_sent': total_sent,
+        'status_counts': status_counts,
+    }
+    try:
+        cache.set(cache_key, stats, timeout=settings.DASHBOARD_STATS_CACHE_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Could not cache dashboard stats: {str(e)}")
+    return stats
+
+def invalidate_dashboard_stats():
+    """Drop the cached dashboard statistics"""
+    from django.utils import timezone
+    
+    try:
+        cache.delete(f"{DASHBOARD_STATS_CACHE_KEY}:{timezone.localdate().isoformat()}")
+    except Exception as e:
+        # The cache is only an optimization; entries expire on their own
+        logger.warning(f"Could not invalidate dashboard stats: {str(e)}")
@@ -5,14 +5,16 @@ from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse, HttpResponse
 from django.contrib import messages
+from django.db import transaction
 from django.utils import timezone
 from django.views.decorators.http import require_POST
 from django_celery_beat.models import PeriodicTask, CrontabSchedule
 
-from .models import Campaign, RecipientList, Recipient, EmailLog
+from .models import Campaign, RecipientList, Recipient, EmailLog, RecipientImport
 from .forms import CustomAuthenticationForm, CampaignForm, RecipientListForm, CSVUploadForm
-from .tasks import send_campaign_emails
-from .utils import process_csv_file, get_campaign_stats, get_daily_stats
+from .importer import create_recipient_import
+from .tasks import import_recipients
+from .utils import get_campaign_stats, get_daily_stats, annotate_campaign_stats, get_dashboard_stats
 
 logger = logging.getLogger(__name__)
 
@@ -44,41 +46,12 @@ def login_view(request):
 def dashboard_view(request):
     """Display dashboard with campaign statistics"""
     # Get recent campaigns
-    recent_campaigns = Campaign.objects.all().order_by('-created_at')[:5]
-    
-    # Get today's email statistics
-    today = timezone.now().date()
-    today_sent = EmailLog.objects.filter(
-        sent_at__date=today, 
-        status='sent'
-    ).count()
-    today_errors = EmailLog.objects.filter(
-        sent_at__date=today, 
-        status='error'
-    ).count()
-    
-    # Get total statistics
-    total_campaigns = Campaign.objects.count()
-    total_recipients = Recipient.objects.count()
-    total_sent = EmailLog.objects.filter(status='sent').count()
-    
-    # Get campaign counts by status
-    status_counts = {
-        'draft': Campaign.objects.filter(status='draft').count(),
-        'scheduled': Campaign.objects.filter(status='scheduled').count(),
-        'active': Campaign.objects.filter(status='active').count(),
-        'completed': Campaign.objects.filter(status='completed').count(),
-        'paused': Campaign.objects.filter(status='paused').count(),
-    }
+    recent_campaigns = Campaign.objects.select_related('recipient_list').order_by('-created_at')[:5]
     
+    # Statistics are cached and invalidated when campaigns or batches change
     context = {
         'recent_campaigns': recent_campaigns,
-        'today_sent': today_sent,
-        'today_errors': today_errors,
-        'total_campaigns': total_campaigns,
-        'total_recipients': total_recipients,
-        'total_sent': total_sent,
-        'status_counts': status_counts,
+        **get_dashboard_stats(),
     }
     
     return render(request, 'campaigns/dashboard.html', context)
@@ -87,7 +60,7 @@ def dashboard_view(request):
 @login_required
 def campaign_list(request):
     """Display list of all campaigns"""
-    campaigns = Campaign.objects.all().order_by('-created_at')
+    campaigns = annotate_campaign_stats(Campaign.objects.all()).order_by('-created_at')
     return render(request, 'campaigns/campaign_list.html', {'campaigns': campaigns})
 
 @login_required
@@ -96,18 +69,9 @@ def campaign_create(request):
     if request.method == 'POST':
         form = CampaignForm(request.POST)
         if form.is_valid():
+            # Scheduled campaigns are dispatched by the campaign scheduler when due
             campaign = form.save()
             
-            # Schedule the campaign if it's set to scheduled status
-            if campaign.status == 'scheduled' and campaign.scheduled_time:
-                # Schedule the task
-                result = send_campaign_emails.apply_async(
-                    args=[str(campaign.id)],
-                    eta=campaign.scheduled_time
-                )
-                campaign.celery_task_id = result.id
-                campaign.save()
-                
             messages.success(request, f"Campaign '{campaign.name}' created successfully!")
             return redirect('campaign_detail', campaign_id=campaign.id)
     else:
@@ -140,24 +104,11 @@ def campaign_edit(request, campaign_id):
     if request.method == 'POST':
         form = CampaignForm(request.POST, instance=campaign)
         if form.is_valid():
+            # The campaign scheduler picks up the new scheduled time. No task
+            # is queued for the old one; celery_task_id is the send task the
+            # scheduler dispatched, which must not be killed mid-batch.
             updated_campaign = form.save()
             
-            # Update scheduling if needed
-            if updated_campaign.status == 'scheduled' and updated_campaign.scheduled_time:
-                # Cancel existing task if any
-                if updated_campaign.celery_task_id:
-                    # Attempt to revoke the task if it exists
-                    from celery import current_app
-                    current_app.control.revoke(updated_campaign.celery_task_id, terminate=True)
-                
-                # Schedule new task
-                result = send_campaign_emails.apply_async(
-                    args=[str(updated_campaign.id)],
-                    eta=updated_campaign.scheduled_time
-                )
-                updated_campaign.celery_task_id = result.id
-                updated_campaign.save()
-            
             messages.success(request, f"Campaign '{updated_campaign.name}' updated successfully!")
             return redirect('campaign_detail', campaign_id=campaign.id)
     else:
@@ -219,24 +170,12 @@ def campaign_activate(request, campaign_id):
     campaign = get_object_or_404(Campaign, pk=campaign_id)
     
     if campaign.status == 'paused':
-        # Update status
+        # Hand the campaign back to the campaign scheduler: it is sent at its
+        # scheduled time, or right away if that has passed or was never set
         campaign.status = 'scheduled'
+        campaign.scheduled_time = campaign.scheduled_time or timezone.now()
         campaign.save()
         
-        # Schedule new task if scheduled time is in the future
-        if campaign.scheduled_time and campaign.scheduled_time > timezone.now():
-            result = send_campaign_emails.apply_async(
-                args=[str(campaign.id)],
-                eta=campaign.scheduled_time
-            )
-            campaign.celery_task_id = result.id
-            campaign.save()
-        else:
-            # Schedule immediately
-            result = send_campaign_emails.apply_async(args=[str(campaign.id)])
-            campaign.celery_task_id = result.id
-            campaign.save()
-        
         messages.success(request, f"Campaign '{campaign.name}' activated successfully!")
     else:
         messages.error(request, f"Campaign '{campaign.name}' is not paused!")
@@ -251,7 +190,7 @@ def recipient_list(request):
     
     # Add recipient count to each list
     for recipient_list in lists:
-        recipient_list.count = recipient_list.recipients.count()
+        recipient_list.count = recipient_list.recipient_count
     
     return render(request, 'campaigns/recipient_list.html', {'lists': lists})
 
@@ -310,23 +249,26 @@ def recipient_upload(request):
             csv_file = request.FILES['csv_file']
             recipient_list = form.cleaned_data['recipient_list']
             
-            # Process the CSV file
-            success_count, error_count, error_messages = process_csv_file(csv_file, recipient_list)
-            
-            if success_count > 0:
-                messages.success(request, f"Successfully imported {success_count} recipients!")
+            # Store the file and import it in the background
+            recipient_import = create_recipient_import(csv_file, recipient_list)
+            transaction.on_commit(lambda: import_recipients.delay(str(recipient_import.id)))
             
-            if error_count > 0:
-                messages.error(request, f"Failed to import {error_count} recipients! See below for details.")
-                for error in error_messages:
-                    messages.warning(request, error)
-                    
-            return redirect('recipient_list_detail', list_id=recipient_list.id)
+            messages.info(request, f"Importing {recipient_import.file_name} into {recipient_list.name}...")
+            return redirect('recipient_import_detail', import_id=recipient_import.id)
     else:
         form = CSVUploadForm()
     
     return render(request, 'campaigns/recipient_upload.html', {'form': form})
 
+@login_required
+def recipient_import_detail(request, import_id):
+    """Display the progress of a recipient import"""
+    recipient_import = get_object_or_404(RecipientImport.objects.select_related('recipient_list'), pk=import_id)
+    
+    return render(request, 'campaigns/recipient_import_detail.html', {
+        'recipient_import': recipient_import
+    })
+
 # Logs and analytics views
 @login_required
 def email_logs(request):
@@ -356,8 +298,8 @@ def email_logs(request):
 @login_required
 def analytics_view(request):
     """Display analytics dashboard"""
-    # Get all campaigns for statistics
-    campaigns = Campaign.objects.all().order_by('-created_at')
+    # Get all campaigns with their statistics in a single query
+    campaigns = annotate_campaign_stats(Campaign.objects.all()).order_by('-created_at')
     
     # Get daily stats for chart
     daily_stats = get_daily_stats(days=14)
@@ -375,9 +317,27 @@ def campaign_stats(request, campaign_id):
     stats = get_campaign_stats(campaign)
     return JsonResponse(stats)
 
+@login_required
+def recipient_import_status(request, import_id):
+    """Get the progress of a recipient import as JSON"""
+    recipient_import = get_object_or_404(RecipientImport, pk=import_id)
+    
+    return JsonResponse({
+        'status': recipient_import.status,
+        'finished': recipient_import.is_finished,
+        'processed': recipient_import.rows_processed,
+        'inserted': recipient_import.rows_inserted,
+        'updated': recipient_import.rows_updated,
+        'rejected': recipient_import.rows_rejected,
+        'errors': recipient_import.error_messages,
+    })
+
 @login_required
 def daily_stats(request):
     """Get daily email statistics as JSON"""
-    days = int(request.GET.get('days', 7))
+    try:
+        days = int(request.GET.get('days', 7))
+    except ValueError:
+        return JsonResponse({'error': 'days must be an integer'}, status=400)
     stats = get_daily_stats(days=days)
     return JsonResponse(stats)
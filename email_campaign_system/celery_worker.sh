@@ -5,15 +5,31 @@ redis-server --daemonize yes --protected-mode no &
 sleep 2
 echo "Redis server started"
 
-# Start Celery worker
-celery -A email_campaign_system worker --loglevel=info --concurrency=2 &
+# Start a Celery worker pool per queue, each sized on its own, so that a
+# long bulk send, import or report can't hold up priority campaigns
+start_worker() {
+    celery -A email_campaign_system worker -Q "$1" -n "$2@%h" --loglevel=info --concurrency="$3" &
+}
+start_worker priority priority "${PRIORITY_WORKER_CONCURRENCY:-2}"
+start_worker campaigns campaigns "${CAMPAIGN_WORKER_CONCURRENCY:-2}"
+start_worker shards shards "${SHARD_WORKER_CONCURRENCY:-4}"
+start_worker imports imports "${IMPORT_WORKER_CONCURRENCY:-1}"
+start_worker reports,celery housekeeping "${HOUSEKEEPING_WORKER_CONCURRENCY:-1}"
 sleep 2
-echo "Celery worker started"
+echo "Celery workers started"
 
-# Start Celery beat scheduler
+# Start Celery beat scheduler (daily report, and a fallback tick for
+# scheduled campaigns should the campaign scheduler below not be running)
 celery -A email_campaign_system beat --loglevel=info &
 sleep 2
 echo "Celery beat scheduler started"
 
+# Start the campaign scheduler, which dispatches scheduled and reactivated
+# campaigns as they fall due. Deployments that don't use this script must
+# run `python manage.py run_campaign_scheduler` as a process of their own.
+python manage.py run_campaign_scheduler &
+sleep 2
+echo "Campaign scheduler started"
+
 # Keep the script running
 tail -f /dev/null
\ No newline at end of file
@@ -143,6 +143,19 @@ EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 GOOGLE_CLIENT_ID = config('GOOGLE_CLIENT_ID', default='')
 GOOGLE_CLIENT_SECRET = config('GOOGLE_CLIENT_SECRET', default='')
 GOOGLE_REFRESH_TOKEN = config('GOOGLE_REFRESH_TOKEN', default='')
+GOOGLE_TOKEN_URI = config('GOOGLE_TOKEN_URI', default='https://oauth2.googleapis.com/token')
+GOOGLE_TOKEN_REFRESH_MARGIN = config('GOOGLE_TOKEN_REFRESH_MARGIN', default=300, cast=int)  # Refresh this many seconds before expiry
+OAUTH2_LOCK_REDIS_URL = config('REDIS_URL', default='redis://127.0.0.1:6379/0')  # Holds the token refresh lock
+
+# Cache shared by the web and worker processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('REDIS_URL', default='redis://127.0.0.1:6379/0'),
+        'KEY_PREFIX': 'email_campaign',
+    }
+}
+DASHBOARD_STATS_CACHE_TIMEOUT = config('DASHBOARD_STATS_CACHE_TIMEOUT', default=30, cast=int)  # seconds
 
 # Celery settings
 CELERY_BROKER_URL = config('REDIS_URL', default='redis://127.0.0.1:6379/0')
@@ -153,12 +166,40 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
+CELERY_TASK_SOFT_TIME_LIMIT = 28 * 60  # Lets sending tasks stop cleanly before the hard limit
 
-# Configure periodic tasks
+# Task queues, each served by its own worker pool (see celery_worker.sh):
+# priority campaign sends, regular campaign sends, fan-out shards, recipient
+# imports and reporting. Housekeeping stays on the default 'celery' queue.
+CELERY_TASK_ROUTES = {
+    'campaigns.tasks.send_campaign_emails': {'queue': 'campaigns'},
+    'campaigns.tasks.complete_campaign_fanout': {'queue': 'campaigns'},
+    'campaigns.tasks.send_campaign_shard': {'queue': 'shards'},
+    'campaigns.tasks.import_recipients': {'queue': 'imports'},
+    'campaigns.tasks.generate_daily_report': {'queue': 'reports'},
+}
+# Redis broker priorities: 0 is served first; tasks without one sit in the middle
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+CELERY_TASK_DEFAULT_PRIORITY = 5
+# Workers reserve one task at a time, so a higher priority task queued later runs next
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Queue and broker priority of each Campaign.priority
+CAMPAIGN_SEND_QUEUES = {'high': 'priority', 'normal': 'campaigns', 'low': 'campaigns'}
+CAMPAIGN_TASK_PRIORITIES = {'high': 0, 'normal': 5, 'low': 9}
+
+# Configure periodic tasks. Scheduled campaigns are dispatched by the
+# campaign scheduler (manage.py run_campaign_scheduler, started by
+# celery_worker.sh); beat runs the same tick at a low frequency as a safety
+# net in case that process is not running.
 CELERY_BEAT_SCHEDULE = {
     'check-scheduled-campaigns': {
         'task': 'campaigns.tasks.check_scheduled_campaigns',
-        'schedule': 60.0,  # Check every minute
+        'schedule': 600.0,  # Execute every 10 minutes
     },
     'generate-daily-report': {
         'task': 'campaigns.tasks.generate_daily_report',
@@ -169,6 +210,76 @@ CELERY_BEAT_SCHEDULE = {
 # Email sending limits (Gmail quota)
 DAILY_EMAIL_LIMIT = config('DAILY_EMAIL_LIMIT', default=500, cast=int)
 
+# SMTP connection pool (per worker process)
+SMTP_POOL_SIZE = config('SMTP_POOL_SIZE', default=2, cast=int)  # Idle sessions kept open
+SMTP_POOL_MAX_MESSAGES = config('SMTP_POOL_MAX_MESSAGES', default=100, cast=int)  # Retire a session after this many messages
+SMTP_POOL_MAX_IDLE = config('SMTP_POOL_MAX_IDLE', default=240, cast=int)  # Seconds before an idle session is closed
+
+# Sending throughput per SMTP provider, keyed by host: messages per second,
+# messages per batch at most, and campaigns sending at the same time
+SMTP_PROVIDER_THROUGHPUT = {
+    'smtp.gmail.com': {'rate': 0.5, 'burst': 20, 'max_concurrency': 1},
+    'smtp.sendgrid.net': {'rate': 10.0, 'burst': 100, 'max_concurrency': 4},
+    'smtp.mailgun.org': {'rate': 5.0, 'burst': 100, 'max_concurrency': 4},
+    'default': {'rate': 1.0, 'burst': 50, 'max_concurrency': 2},
+}
+_smtp_throughput = SMTP_PROVIDER_THROUGHPUT.get(EMAIL_HOST, SMTP_PROVIDER_THROUGHPUT['default'])
+SMTP_PROVIDER_THROUGHPUT[EMAIL_HOST] = {
+    'rate': config('SMTP_RATE', default=_smtp_throughput['rate'], cast=float),
+    'burst': config('SMTP_BURST', default=_smtp_throughput['burst'], cast=int),
+    'max_concurrency': config('SMTP_MAX_CONCURRENCY', default=_smtp_throughput['max_concurrency'], cast=int),
+}
+SMTP_BATCH_MAX_SECONDS = config('SMTP_BATCH_MAX_SECONDS', default=60, cast=int)  # Shrink batches that would take longer
+SMTP_MAX_DEFERRALS = config('SMTP_MAX_DEFERRALS', default=3, cast=int)  # 4xx replies before a recipient is logged as an error
+
+# Send rate limits shared by all workers, as token buckets in Redis (0 = no limit)
+SEND_RATE_LIMITS = {
+    # Per sender account (EMAIL_HOST_USER)
+    'account': {
+        'second': config('ACCOUNT_SEND_LIMIT_PER_SECOND', default=2, cast=int),
+        'hour': config('ACCOUNT_SEND_LIMIT_PER_HOUR', default=0, cast=int),
+        'day': config('ACCOUNT_SEND_LIMIT_PER_DAY', default=2000, cast=int),
+    },
+    # Across all accounts
+    'global': {
+        'second': config('GLOBAL_SEND_LIMIT_PER_SECOND', default=0, cast=int),
+        'hour': config('GLOBAL_SEND_LIMIT_PER_HOUR', default=0, cast=int),
+        'day': config('GLOBAL_SEND_LIMIT_PER_DAY', default=0, cast=int),
+    },
+}
+RATE_LIMIT_REDIS_URL = config('REDIS_URL', default='redis://127.0.0.1:6379/0')
+RATE_LIMIT_MAX_WAIT = config('RATE_LIMIT_MAX_WAIT', default=5, cast=int)  # Seconds a batch waits for a token before rescheduling
+
+# Sending engine for campaigns that don't choose one: 'sync' sends over one
+# blocking SMTP session, 'async' over SMTP_ASYNC_SESSIONS sessions from an event
+# loop, 'threads' from SMTP_SEND_THREADS threads with a pooled session each
+SMTP_SEND_ENGINE = config('SMTP_SEND_ENGINE', default='sync')
+SMTP_ASYNC_SESSIONS = config('SMTP_ASYNC_SESSIONS', default=4, cast=int)
+SMTP_SEND_THREADS = config('SMTP_SEND_THREADS', default=4, cast=int)  # Keep SMTP_POOL_SIZE as high to reuse every session
+
+# Parallel fan-out: lists with at least two shards' worth of recipients are
+# split into key ranges sent by separate tasks (1 = one chain per campaign)
+CAMPAIGN_FANOUT_SHARDS = config('CAMPAIGN_FANOUT_SHARDS', default=1, cast=int)
+CAMPAIGN_FANOUT_MIN_SHARD_SIZE = config('CAMPAIGN_FANOUT_MIN_SHARD_SIZE', default=500, cast=int)
+
+# Seconds a campaign's send lease (and a batch's recipient claims) outlive the
+# last task of a chain that died, before another task may take over
+CAMPAIGN_SEND_LEASE_TIMEOUT = config('CAMPAIGN_SEND_LEASE_TIMEOUT', default=CELERY_TASK_TIME_LIMIT + 5 * 60, cast=int)
+
+# Campaign scheduler: sleeps until the next campaign is due, woken through
+# Redis when one is scheduled, and re-checks at least every SCHEDULER_MAX_SLEEP seconds
+SCHEDULER_REDIS_URL = config('REDIS_URL', default='redis://127.0.0.1:6379/0')
+SCHEDULER_MAX_SLEEP = config('SCHEDULER_MAX_SLEEP', default=300, cast=int)
+
+# Buffered email log writes
+EMAIL_LOG_FLUSH_SIZE = config('EMAIL_LOG_FLUSH_SIZE', default=200, cast=int)  # Outcomes per bulk insert
+EMAIL_LOG_FLUSH_INTERVAL = config('EMAIL_LOG_FLUSH_INTERVAL', default=5, cast=int)  # Max seconds between flushes
+EMAIL_LOG_JOURNAL_DIR = config('EMAIL_LOG_JOURNAL_DIR', default=str(BASE_DIR / 'var' / 'email_log_journal'))
+
+# Recipient CSV import
+RECIPIENT_IMPORT_CHUNK_SIZE = config('RECIPIENT_IMPORT_CHUNK_SIZE', default=1000, cast=int)  # Rows per upsert
+RECIPIENT_IMPORT_DIR = config('RECIPIENT_IMPORT_DIR', default=str(BASE_DIR / 'var' / 'recipient_imports'))  # Shared with the workers
+
 # CKEditor settings
 CKEDITOR_CONFIGS = {
     'default': {